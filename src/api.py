@@ -0,0 +1,275 @@
+from contextlib import asynccontextmanager
+from typing import Optional
+from fastapi import FastAPI, HTTPException
+from pydantic import BaseModel, Field
+from sqlalchemy.orm import Session
+from db_config import DatabaseConfig
+from models import FatosSintomaResultado
+from compiler import PlanoAvaliacao, compile_grafo
+from loader import load_grafo
+from snapshot import get_snapshot_dir, carrega_snapshot
+from ranking import RankingDiagnosticos
+from regions import FechoRegioes, SubsuncaoSintomas
+from kleene import to_tribool
+
+
+
+
+"""
+HTTP service for the evaluation of the diagnoses. The knowledge base is loaded and compiled once, when the process starts,
+so the requests are answered from memory, without touching the database.
+Run it from the src folder with: uvicorn api:app --workers 4
+"""
+
+
+
+
+class Fatos(BaseModel):
+    """
+    Class to represent the request body with the facts of a case.
+
+    Attributes:
+        presentes (list[int]): The ids of the present symptoms and results.
+        ausentes (list[int]): The ids of the absent symptoms and results. An id in both lists is considered present.
+        arvore (bool): If the evaluation tree of each disease must be returned.
+        subsuncao (bool): If the symptoms implied by the hierarchy of regions must be added to the facts (see SubsuncaoSintomas).
+    """
+    presentes: list[int] = Field(default_factory=list)
+    ausentes: list[int] = Field(default_factory=list)
+    arvore: bool = False
+    subsuncao: bool = False
+
+
+
+
+class Ranking(BaseModel):
+    """
+    Class to represent the request body of the ranking of diseases.
+
+    Attributes:
+        presentes (list[int]): The ids of the present symptoms and results.
+        ausentes (list[int]): The ids of the absent symptoms and results.
+        k (int): The number of diseases returned.
+        subsuncao (bool): If the symptoms implied by the hierarchy of regions must be added to the facts (see SubsuncaoSintomas).
+    """
+    presentes: list[int] = Field(default_factory=list)
+    ausentes: list[int] = Field(default_factory=list)
+    k: int = Field(default=10, ge=1)
+    subsuncao: bool = False
+
+
+
+
+class Fato(BaseModel):
+    """
+    Class to represent a symptom or a result in the listings.
+    """
+    id: int
+    name: str
+
+
+
+
+class NoAvaliacao(BaseModel):
+    """
+    Class to represent a node of the evaluation tree, like AvaliaNode.
+
+    Attributes:
+        expressao (str): The label of the expression (e.g. 'And', 'AoMenos(2)' or the name of the symptom/result).
+        resultado (Optional[bool]): The result of the expression. None means indeterminate.
+        score (Optional[float]): The score of the expression.
+        filhos (list[NoAvaliacao]): The children of the node.
+    """
+    expressao: str
+    resultado: Optional[bool]
+    score: Optional[float]
+    filhos: list["NoAvaliacao"] = Field(default_factory=list)
+
+
+
+
+class AvaliacaoDoenca(BaseModel):
+    """
+    Class to represent the evaluation of the diagnosis of a disease.
+    """
+    doenca_id: int
+    doenca: Optional[str]
+    diagnostico_id: int
+    resultado: Optional[bool]
+    score: Optional[float]
+    arvore: Optional[NoAvaliacao] = None
+
+
+
+
+class BaseConhecimento():
+    """
+    Class to hold the knowledge base used by the service: the compiled plan and the names of the symptoms and results.
+
+    Attributes:
+        plano (PlanoAvaliacao): The compiled plan of all diagnoses.
+        ranking (RankingDiagnosticos): The top K ranking of the diagnoses of the plan.
+        sintomas (list[Fato]): All symptoms, sorted by name.
+        resultados (list[Fato]): All results, sorted by name.
+        subsuncao (SubsuncaoSintomas): The more general/specific symptoms of each symptom by the hierarchy of regions, for the subsumption mode.
+    """
+    def __init__(self, plano: PlanoAvaliacao, sintomas: list[Fato], resultados: list[Fato], subsuncao: SubsuncaoSintomas = None) -> None:
+        """
+        Initialize the knowledge base.
+        """
+        self.plano = plano
+        self.ranking = RankingDiagnosticos(plano)
+        self.sintomas = sintomas
+        self.resultados = resultados
+        self.subsuncao = subsuncao
+
+
+    @classmethod
+    def load(cls) -> "BaseConhecimento":
+        """
+        Load and compile the knowledge base from the database, or from the snapshot set in the DISEASEDX_SNAPSHOT environment variable.
+        """
+        if get_snapshot_dir():
+            grafo, plano = carrega_snapshot(get_snapshot_dir())
+        else:
+            engine = DatabaseConfig().load_engine()
+            with Session(engine) as session:
+                grafo = load_grafo(session)
+            plano = compile_grafo(grafo)
+        sintomas = [Fato(id=sintoma.id, name=repr(sintoma)) for sintoma in grafo.sintomas]
+        resultados = [Fato(id=resultado.id, name=repr(resultado)) for resultado in grafo.resultados]
+        subsuncao = SubsuncaoSintomas(grafo.sintomas, FechoRegioes(grafo.regioes))
+        return cls(plano, sorted(sintomas, key=lambda fato: fato.name), sorted(resultados, key=lambda fato: fato.name), subsuncao)
+
+
+    def get_fatos(self, presentes: list[int], ausentes: list[int], subsuncao: bool = False) -> tuple[list[int], list[int]]:
+        """
+        Return the ids of the present and absent facts, with the symptoms implied by the hierarchy of regions when subsuncao is True.
+        """
+        if not subsuncao or self.subsuncao is None:
+            return presentes, ausentes
+        presentes, ausentes = self.subsuncao.expande(presentes, ausentes)
+        return sorted(presentes), sorted(ausentes)
+
+
+    def avalia(self, presentes: list[int], ausentes: list[int], arvore: bool = False) -> list[AvaliacaoDoenca]:
+        """
+        Evaluate all diagnoses for the given facts, in the order of plano.diagnostico_ids().
+        """
+        fatos = FatosSintomaResultado.from_ids(presentes, ausentes, self.plano.indice_fatos)
+        valores = self.plano.avalia_nos(fatos)
+        return [self._avaliacao(diagnostico_id, valores, arvore) for diagnostico_id in self.plano.diagnostico_ids()]
+
+
+    def _avaliacao(self, diagnostico_id: int, valores: list[tuple[int, float]], arvore: bool) -> AvaliacaoDoenca:
+        """
+        Build the evaluation of a diagnosis from the values of the nodes of the plan.
+        """
+        raiz = self.plano.raizes[diagnostico_id]
+        doenca_id = self.plano.doencas[diagnostico_id]
+        codigo, score = valores[raiz]
+        return AvaliacaoDoenca(
+            doenca_id=doenca_id,
+            doenca=self.plano.nomes_doencas.get(doenca_id),
+            diagnostico_id=diagnostico_id,
+            resultado=to_tribool(codigo).value,
+            score=score,
+            arvore=self.build_arvore(raiz, valores) if arvore else None,
+        )
+
+
+    def build_arvore(self, no: int, valores: list[tuple[int, float]]) -> NoAvaliacao:
+        """
+        Build the evaluation tree of a node of the plan.
+        """
+        codigo, score = valores[no]
+        return NoAvaliacao(
+            expressao=self.plano.labels[no],
+            resultado=to_tribool(codigo).value,
+            score=score,
+            filhos=[self.build_arvore(filho, valores) for filho in self.plano.filhos[no]],
+        )
+
+
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Load the knowledge base once, when the process starts.
+    """
+    app.state.base = BaseConhecimento.load()
+    yield
+
+
+
+
+app = FastAPI(title="DiseaseDx", lifespan=lifespan)
+
+
+
+
+@app.get("/sintomas")
+async def get_sintomas() -> list[Fato]:
+    """
+    List all symptoms.
+    """
+    return app.state.base.sintomas
+
+
+
+
+@app.get("/resultados")
+async def get_resultados() -> list[Fato]:
+    """
+    List all results.
+    """
+    return app.state.base.resultados
+
+
+
+
+@app.post("/diagnosticos/avaliacoes")
+async def avalia_diagnosticos(fatos: Fatos) -> list[AvaliacaoDoenca]:
+    """
+    Evaluate the diagnoses of all diseases for the given facts, like get_diagnosticos_avaliacoes_by_list_of_sintomas_and_resultados.
+    """
+    presentes, ausentes = app.state.base.get_fatos(fatos.presentes, fatos.ausentes, fatos.subsuncao)
+    return app.state.base.avalia(presentes, ausentes, fatos.arvore)
+
+
+
+
+@app.get("/diagnosticos/{diagnostico_id}/arvore")
+async def get_arvore(diagnostico_id: int, presentes: str = "", ausentes: str = "", subsuncao: bool = False) -> NoAvaliacao:
+    """
+    Build the evaluation tree of a single diagnosis. The facts are comma-separated ids.
+    """
+    base = app.state.base
+    if diagnostico_id not in base.plano.raizes:
+        raise HTTPException(status_code=404, detail=f"Diagnosis {diagnostico_id} not found")
+    try:
+        presentes_ids = [int(fato_id) for fato_id in presentes.split(",") if fato_id]
+        ausentes_ids = [int(fato_id) for fato_id in ausentes.split(",") if fato_id]
+    except ValueError:
+        raise HTTPException(status_code=422, detail="The facts must be comma-separated ids")
+    presentes_ids, ausentes_ids = base.get_fatos(presentes_ids, ausentes_ids, subsuncao)
+    fatos = FatosSintomaResultado.from_ids(presentes_ids, ausentes_ids, base.plano.indice_fatos)
+    return base.build_arvore(base.plano.raizes[diagnostico_id], base.plano.avalia_nos(fatos))
+
+
+
+
+@app.post("/diagnosticos/ranking")
+async def ranking_diagnosticos(ranking: Ranking) -> list[AvaliacaoDoenca]:
+    """
+    Return the k diagnoses with the highest scores for the given facts, like the 'Possiveis Doenças' list of the Streamlit page.
+    Only the diagnoses that can enter the top k are evaluated (see RankingDiagnosticos).
+    """
+    base = app.state.base
+    presentes, ausentes = base.get_fatos(ranking.presentes, ranking.ausentes, ranking.subsuncao)
+    avaliacoes = []
+    for diagnostico_id, resultado, score in base.ranking.top_k(presentes, ausentes, ranking.k):
+        doenca_id = base.plano.doencas[diagnostico_id]
+        avaliacoes.append(AvaliacaoDoenca(doenca_id=doenca_id, doenca=base.plano.nomes_doencas.get(doenca_id), diagnostico_id=diagnostico_id, resultado=resultado.value, score=score))
+    return avaliacoes
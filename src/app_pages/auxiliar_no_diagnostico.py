@@ -1,6 +1,5 @@
 import streamlit as st
-from utils import StreamlitQueries
-from models import Sintoma
+from utils import load_streamlit_queries
 import streamlit.components.v1 as components
 
 
@@ -8,20 +7,46 @@ st.set_page_config(layout="wide", page_icon="🩺")
 st.title("Auxiliar no Diagnostico")
 
 
+# Quantidade de itens da busca exibidos em cada seletor
+TAMANHO_PAGINA = 50
+
+
+sq = load_streamlit_queries()
+
+
 def format_func(item) -> str:
-    if isinstance(item, Sintoma):
-        return f"{item.manifestacao.name} no(a) {item.regiao_do_corpo.name}" if item.regiao_do_corpo else f"{item.manifestacao.name}"
-    else:
-        return f"{item.name} do exame {item.exame}"
+    return sq.get_rotulo(item)
 
 
-sq = StreamlitQueries()
+def get_opcoes(chave: str, encontrados: list) -> list:
+    # Os itens já selecionados continuam entre as opções, mesmo quando não estão na página da busca
+    selecionados = st.session_state.get(chave, [])
+    return list(selecionados) + [item for item in encontrados if item not in selecionados]
 
 
 sintomas = sq.get_all_sintomas()
 resultados = sq.get_all_resultados()
 
 
+subsuncao = st.toggle("Considerar a hierarquia das regiões do corpo", help="Um sintoma numa região também conta como evidência para as regiões que a contêm (ex.: Dor no Abdome para Dor no Tronco)")
+
+
+col_busca1, col_busca2 = st.columns(2)
+
+
+with col_busca1:
+	busca_sintomas = st.text_input("Buscar sintomas", placeholder="Digite parte do nome de um sintoma (ex.: dor, ulcera)")
+	sintomas_encontrados, total_sintomas = sq.get_sintomas_by_busca(busca_sintomas, 0, TAMANHO_PAGINA)
+	if total_sintomas > len(sintomas_encontrados):
+		st.caption(f"Exibindo {len(sintomas_encontrados)} de {total_sintomas} sintomas. Refine a busca para encontrar os demais.")
+
+with col_busca2:
+	busca_resultados = st.text_input("Buscar resultados", placeholder="Digite parte do nome de um resultado ou exame")
+	resultados_encontrados, total_resultados = sq.get_resultados_by_busca(busca_resultados, 0, TAMANHO_PAGINA)
+	if total_resultados > len(resultados_encontrados):
+		st.caption(f"Exibindo {len(resultados_encontrados)} de {total_resultados} resultados. Refine a busca para encontrar os demais.")
+
+
 col1, col2 = st.columns(2)
 
 
@@ -30,7 +55,8 @@ with col1:
 	with st.container():
 		present_sintomas = st.multiselect(
 			"Selecione os sintomas presentes", 
-			sintomas,
+			get_opcoes("present_sintomas", sintomas_encontrados),
+			key="present_sintomas",
 			format_func=lambda sintoma: format_func(sintoma),
 			placeholder="Selecione os sintomas presentes"
 		)
@@ -44,7 +70,8 @@ with col1:
 	with st.container():
 		present_resultados = st.multiselect(
 			"Selecione os resultados presentes", 
-			resultados,
+			get_opcoes("present_resultados", resultados_encontrados),
+			key="present_resultados",
 			format_func=lambda resultado: format_func(resultado),
 			placeholder="Selecione os resultados presentes"
 		)
@@ -61,7 +88,8 @@ with col2:
 	with st.container():
 		not_present_sintomas = st.multiselect(
 			"Selecione os sintomas ausentes", 
-			sintomas,
+			get_opcoes("not_present_sintomas", sintomas_encontrados),
+			key="not_present_sintomas",
 			format_func=lambda sintoma: format_func(sintoma),
 			placeholder="Selecione os sintomas ausentes"
 		)
@@ -75,7 +103,8 @@ with col2:
 	with st.container():
 		not_present_resultados = st.multiselect(
 			"Selecione os resultados ausentes", 
-			resultados,
+			get_opcoes("not_present_resultados", resultados_encontrados),
+			key="not_present_resultados",
 			format_func=lambda resultado: format_func(resultado),
 			placeholder="Selecione os resultados ausentes"
 		)
@@ -107,7 +136,18 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 
-diagnosticos_avaliacoes = sq.get_diagnosticos_avaliacoes_by_list_of_sintomas_and_resultados(present_sintomas, not_present_sintomas, present_resultados, not_present_resultados)
+# No modo de subsunção, os sintomas implicados pela hierarquia das regiões são adicionados aos selecionados
+if subsuncao:
+	present_sintomas, not_present_sintomas = sq.expande_sintomas_by_subsuncao(present_sintomas, not_present_sintomas)
+
+
+# A avaliação incremental é mantida entre as execuções, então só os fatos alterados desde o último clique são reavaliados.
+# Ela é refeita quando a base de conhecimento é recarregada (após uma escrita), para não avaliar com o plano antigo
+if 'avaliacao_incremental' not in st.session_state or st.session_state.avaliacao_incremental.plano is not sq.plano:
+	st.session_state.avaliacao_incremental = sq.get_avaliacao_incremental()
+
+
+diagnosticos_resultados = sq.get_diagnosticos_resultados_by_avaliacao_incremental(st.session_state.avaliacao_incremental, present_sintomas, not_present_sintomas, present_resultados, not_present_resultados)
 
 
 if 'clicked' not in st.session_state:
@@ -120,23 +160,28 @@ def click_button() -> None:
 
 with col2:
 
-	for doenca in diagnosticos_avaliacoes.keys():
-		if diagnosticos_avaliacoes[doenca][0].result.value == True:
+	for doenca in diagnosticos_resultados.keys():
+		if diagnosticos_resultados[doenca][0].value == True:
 			st.success(doenca.name + " é compatível com os sintomas e resultados selecionados.")
 
 	if st.session_state.clicked:
 		st.button(f"Ocultar Árvores de Avaliação", on_click=click_button, key="exibir_arvore")
 		st.write("Possiveis Doenças:")
+		quantidade = st.number_input("Quantidade de doenças exibidas", min_value=1, value=10, step=1)
 
-		diagnosticos_ordered_by_score = sorted(diagnosticos_avaliacoes.keys(), key=lambda x: diagnosticos_avaliacoes[x][1], reverse=True)
+		# Só as doenças que podem entrar no top K são avaliadas, e só as árvores delas são construídas
+		diagnosticos_top_k = sq.get_top_k_diagnosticos_by_list_of_sintomas_and_resultados(present_sintomas, not_present_sintomas, present_resultados, not_present_resultados, quantidade)
 		
-		for doenca in diagnosticos_ordered_by_score:
+		for doenca in diagnosticos_top_k:
 			diagnostico = sq.get_diagnostico_by_doenca(doenca)
+			score = f"{diagnosticos_top_k[doenca][1]:.2f}"
 			if diagnostico.paper_link:
-				st.html(f'<span style="color:#1f77b4;"><a href="{diagnostico.paper_link}" target="_blank">{doenca.name}</a> | Score = {diagnosticos_avaliacoes[doenca][1]}</span>')
+				st.html(f'<span style="color:#1f77b4;"><a href="{diagnostico.paper_link}" target="_blank">{doenca.name}</a> | Score = {score}</span>')
 			else:
-				st.html(f'<span style="color:#1f77b4;">{doenca.name} | Score = {diagnosticos_avaliacoes[doenca][1]}</span>')
-			st.html(diagnosticos_avaliacoes[doenca][0].build_html_string())
+				st.html(f'<span style="color:#1f77b4;">{doenca.name} | Score = {score}</span>')
+			# A árvore de avaliação só é construída quando as árvores estão sendo exibidas
+			arvore = sq.get_arvore_avaliacao_by_doenca(doenca, present_sintomas, not_present_sintomas, present_resultados, not_present_resultados)
+			st.html(arvore.build_html_string())
 			
 	else:
 		st.button(f"Exibir Árvores de Avaliação", on_click=click_button, key="exibir_arvore")
@@ -144,11 +189,11 @@ with col2:
 
 with col1:
 
-	most_common_sintoma = sq.get_most_common_sintoma(sintomas, present_sintomas, not_present_sintomas)
-	st.write("Sintoma mais comum:", most_common_sintoma)
+	most_common_sintoma = sq.get_most_common_sintoma(sintomas, present_sintomas, not_present_sintomas, present_resultados, not_present_resultados)
+	st.write("Próximo sintoma a perguntar:", most_common_sintoma)
 
-	most_common_resultado = sq.get_most_common_resultado(resultados, present_resultados, not_present_resultados)
-	st.write("Resultado mais comum:", most_common_resultado)
+	most_common_resultado = sq.get_most_common_resultado(resultados, present_resultados, not_present_resultados, present_sintomas, not_present_sintomas)
+	st.write("Próximo resultado a perguntar:", most_common_resultado)
 	
 	df_sintoma_doencas = sq.st_write_sintoma_doencas_table()
 	st.dataframe(df_sintoma_doencas)
@@ -3,13 +3,13 @@ from sqlalchemy.orm import Session, joinedload, selectin_polymorphic, subquerylo
 from sqlalchemy import create_engine
 from db_config import DatabaseConfig
 from models import Doenca, Diagnostico, Or, And, AoMenos, Sintoma, Manifestacao, RegiaoComposta, RegiaoDoCorpo, Orgao, Exame, Resultado, Expressao, FatosSintomaResultado, AvaliaNode
-from utils import StreamlitQueries
+from utils import load_streamlit_queries
 import streamlit as st
 
 
 st.set_page_config(layout="wide", page_icon="🎲")
 st.title("Cadastrar Dados")
-sq = StreamlitQueries()
+sq = load_streamlit_queries()
 
 
 tab_names = ["Manifestação", "Orgão", "Região Composta", "Exame", "Resultado", "Sintoma", "Doença", "Or", "And", "Ao Menos", "Diagnóstico"]
@@ -1,12 +1,12 @@
 import streamlit as st
-from utils import StreamlitQueries
+from utils import load_streamlit_queries
 
 
 st.set_page_config(layout="wide", page_icon="🔢")
 st.title("Contador de Sintomas de uma Doenca")
 
 
-sq = StreamlitQueries()
+sq = load_streamlit_queries()
 
 
 # Obter todos os sintomas do banco de dados
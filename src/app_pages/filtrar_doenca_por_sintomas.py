@@ -1,5 +1,5 @@
 import streamlit as st
-from utils import StreamlitQueries
+from utils import load_streamlit_queries
 from models import Sintoma
 
 
@@ -14,7 +14,7 @@ def format_func(item) -> str:
         return f"{item.name} do exame {item.exame}"
 
 
-sq = StreamlitQueries()
+sq = load_streamlit_queries()
 
 
 # Obter todos os sintomas do banco de dados
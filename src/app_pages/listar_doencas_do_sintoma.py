@@ -1,12 +1,12 @@
 import streamlit as st
-from utils import StreamlitQueries
+from utils import load_streamlit_queries
 
 
 st.set_page_config(layout="wide", page_icon="📝")
 st.title("Listar Doencas de um Sintoma")
 
 
-sq = StreamlitQueries()
+sq = load_streamlit_queries()
 
 
 # Obter todos os sintomas do banco de dados
@@ -28,4 +28,8 @@ sintoma = st.selectbox(
 if sintoma:
 	diagnosticos = sq.get_diagnosticos_by_sintoma(sintoma)
 	doencas = [diagnostico.doenca for diagnostico in diagnosticos]
-	st.write(f"Doenças do Sintoma:", doencas)
\ No newline at end of file
+	st.write(f"Doenças do Sintoma:", doencas)
+
+	# Sintomas e resultados que aparecem nos mesmos diagnósticos
+	coocorrentes = sq.get_fatos_coocorrentes(sintoma)
+	st.write("Sintomas e Resultados que aparecem junto:", [f"{fato} ({quantidade})" for fato, quantidade in coocorrentes])
\ No newline at end of file
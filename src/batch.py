@@ -0,0 +1,127 @@
+import numpy as np
+from kleene import VERDADEIRO, FALSO, INDETERMINADO
+from compiler import PlanoAvaliacao, OP_FATO, OP_AND, OP_OR
+
+
+
+
+def codifica_casos(plano: PlanoAvaliacao, casos) -> np.ndarray:
+    """
+    Function to encode a list of cases as an N x F int8 matrix of facts, with the columns ordered like plano.fatos_ids.
+    Each case is a tuple (presentes, ausentes) of symptom/result ids. Ids that are not in the plan are ignored.
+    """
+    casos = list(casos)
+    fatos = np.zeros((len(casos), len(plano.fatos_ids)), dtype=np.int8)
+    for linha, (presentes, ausentes) in enumerate(casos):
+        for fato_id in ausentes:
+            coluna = plano.indice_fatos.get(fato_id)
+            if coluna is not None:
+                fatos[linha, coluna] = FALSO
+        for fato_id in presentes:
+            coluna = plano.indice_fatos.get(fato_id)
+            if coluna is not None:
+                fatos[linha, coluna] = VERDADEIRO
+    return fatos
+
+
+
+
+def avalia_lote(plano: PlanoAvaliacao, fatos: np.ndarray, tamanho_lote: int = 10000) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Function to evaluate all diagnoses of a plan for N cases at once.
+    The facts are an N x F int8 matrix (VERDADEIRO, FALSO or INDETERMINADO), with the columns ordered like plano.fatos_ids.
+    It returns an N x D int8 matrix of Kleene results and an N x D float matrix of scores, with the columns ordered like plano.diagnostico_ids().
+    The cases are processed in chunks of tamanho_lote rows to bound the memory used by the intermediate node values.
+    """
+    fatos = np.asarray(fatos, dtype=np.int8)
+    if fatos.ndim != 2 or fatos.shape[1] != len(plano.fatos_ids):
+        raise ValueError(f"Expected an N x {len(plano.fatos_ids)} matrix of facts, got shape {fatos.shape}")
+
+    raizes = [plano.raizes[diagnostico_id] for diagnostico_id in plano.diagnostico_ids()]
+    resultados = np.empty((fatos.shape[0], len(raizes)), dtype=np.int8)
+    scores = np.empty((fatos.shape[0], len(raizes)), dtype=np.float64)
+
+    for inicio in range(0, fatos.shape[0], tamanho_lote):
+        fim = inicio + tamanho_lote
+        node_resultados, node_scores = _avalia_nos(plano, fatos[inicio:fim])
+        for coluna, raiz in enumerate(raizes):
+            resultados[inicio:fim, coluna] = node_resultados[raiz]
+            scores[inicio:fim, coluna] = node_scores[raiz]
+
+    return resultados, scores
+
+
+
+
+def _avalia_nos(plano: PlanoAvaliacao, fatos: np.ndarray) -> tuple[list[np.ndarray], list[np.ndarray]]:
+    """
+    Evaluate every node of the plan for a chunk of cases, in topological order.
+    Each node value is a column vector with one entry per case, and the And/Or/AoMenos nodes are reductions over the stacked values of their children.
+    """
+    n = fatos.shape[0]
+    node_resultados = []
+    node_scores = []
+
+    for op, arg, filhos in zip(plano.ops, plano.args, plano.filhos):
+        if op == OP_FATO:
+            resultado = fatos[:, plano.indice_fatos[arg]]
+            node_resultados.append(resultado)
+            node_scores.append(resultado.astype(np.float64))
+            continue
+
+        if not filhos:
+            resultado, score = _avalia_sem_filhos(op, n)
+            node_resultados.append(resultado)
+            node_scores.append(score)
+            continue
+
+        filhos_resultados = np.stack([node_resultados[filho] for filho in filhos], axis=1)
+        filhos_scores = np.stack([node_scores[filho] for filho in filhos], axis=1)
+        verdadeiros = np.count_nonzero(filhos_resultados == VERDADEIRO, axis=1)
+        falsos = np.count_nonzero(filhos_resultados == FALSO, axis=1)
+
+        if op == OP_AND:
+            resultado = np.where(falsos > 0, FALSO, np.where(verdadeiros == len(filhos), VERDADEIRO, INDETERMINADO))
+            score = np.where(falsos > 0, -1.0, np.where(verdadeiros == len(filhos), 1.0, filhos_scores.mean(axis=1)))
+        elif op == OP_OR:
+            resultado = np.where(verdadeiros > 0, VERDADEIRO, np.where(falsos == len(filhos), FALSO, INDETERMINADO))
+            score = np.where(verdadeiros > 0, 1.0, np.where(falsos == len(filhos), -1.0, filhos_scores.max(axis=1)))
+        else:
+            resultado, score = _avalia_ao_menos(arg, filhos_resultados, filhos_scores, verdadeiros, falsos)
+
+        node_resultados.append(resultado.astype(np.int8))
+        node_scores.append(score)
+
+    return node_resultados, node_scores
+
+
+
+
+def _avalia_ao_menos(qtd, filhos_resultados, filhos_scores, verdadeiros, falsos) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Vectorized version of PlanoAvaliacao._avalia_ao_menos: the score is the average of the top 'qtd' children scores,
+    a True AoMenos scores 1 and a False one only scores -1 when its last child is False.
+    """
+    n_filhos = filhos_resultados.shape[1]
+    top = min(qtd, n_filhos)
+    maiores = -np.partition(-filhos_scores, top - 1, axis=1)[:, :top]
+    media = maiores.sum(axis=1) / qtd
+
+    verdadeiro = verdadeiros >= qtd
+    falso = ~verdadeiro & (falsos > 0) & (n_filhos - falsos < qtd)
+    resultado = np.where(verdadeiro, VERDADEIRO, np.where(falso, FALSO, INDETERMINADO))
+    score = np.where(verdadeiro, 1.0, np.where(falso & (filhos_resultados[:, -1] == FALSO), -1.0, media))
+    return resultado, score
+
+
+
+
+def _avalia_sem_filhos(op: int, n: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Evaluate an And/Or/AoMenos node without children: an empty And is True, an empty Or is False and an empty AoMenos is indeterminate, without score.
+    """
+    if op == OP_AND:
+        return np.full(n, VERDADEIRO, dtype=np.int8), np.full(n, 1.0)
+    if op == OP_OR:
+        return np.full(n, FALSO, dtype=np.int8), np.full(n, -1.0)
+    return np.full(n, INDETERMINADO, dtype=np.int8), np.full(n, np.nan)
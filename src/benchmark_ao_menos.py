@@ -0,0 +1,105 @@
+import random
+import time
+import numpy as np
+from models import FatosSintomaResultado, Manifestacao, Sintoma, AoMenos
+from compiler import PlanoAvaliacao
+from batch import avalia_lote
+
+
+
+
+"""
+Benchmark of the evaluation of wide AoMenos nodes, like the gene-panel criteria "at least 3 of 400 variants".
+It doesn't need a database: the symptoms are transient objects with manually assigned ids.
+Run the script with python src/benchmark_ao_menos.py.
+"""
+QTD = 3
+TAMANHOS = (10, 100, 400, 1000, 2000, 5000)
+REPETICOES = 5
+CASOS_LOTE = 1000
+
+
+
+
+def build_ao_menos(n: int) -> tuple[AoMenos, list[Sintoma]]:
+    """
+    Function to build an AoMenos(QTD) over n transient symptoms, with ids from 1 to n.
+    """
+    manifestacao = Manifestacao(name="Variante")
+    sintomas = []
+    for i in range(1, n + 1):
+        sintoma = Sintoma(manifestacao)
+        sintoma.id = i
+        sintomas.append(sintoma)
+    return AoMenos(QTD, sintomas), sintomas
+
+
+
+
+def build_fatos(sintomas: list[Sintoma], rng: random.Random) -> FatosSintomaResultado:
+    """
+    Function to build facts where less than QTD symptoms are present, so the AoMenos can't stop early and every child is evaluated.
+    """
+    presentes = rng.sample(sintomas, QTD - 1)
+    ausentes = [sintoma for sintoma in rng.sample(sintomas, len(sintomas) // 2) if sintoma not in presentes]
+    return FatosSintomaResultado(sintomas, presentes, ausentes, [], [], [])
+
+
+
+
+def avalia_reordenando(expr: AoMenos, fatos: FatosSintomaResultado) -> float:
+    """
+    Function with the previous AoMenos scoring, that sorts all the scores again after each child. It's only kept here for comparison.
+    """
+    scores = []
+    score = None
+    for exp in expr.expressoes:
+        scores.append(exp.avalia_codigo(fatos)[1])
+        score = sum(sorted(scores, reverse=True)[:expr.qtd]) / expr.qtd
+    return score
+
+
+
+
+def mede(funcao, *args) -> float:
+    """
+    Function to return the best time, in milliseconds, of REPETICOES calls.
+    """
+    tempos = []
+    for _ in range(REPETICOES):
+        inicio = time.perf_counter()
+        funcao(*args)
+        tempos.append(time.perf_counter() - inicio)
+    return min(tempos) * 1000
+
+
+
+
+def main() -> None:
+    """
+    Print the time of each evaluation path for AoMenos nodes with a growing number of children.
+    """
+    rng = random.Random(42)
+    print(f"AoMenos({QTD}) - best of {REPETICOES} runs, in ms (batch: {CASOS_LOTE} cases)")
+    print(f"{'children':>8} {'re-sort':>10} {'avalia':>10} {'resultado':>10} {'plano':>10} {'batch':>10}")
+
+    for n in TAMANHOS:
+        expr, sintomas = build_ao_menos(n)
+        fatos = build_fatos(sintomas, rng)
+        plano = PlanoAvaliacao()
+        plano.raizes[0] = plano.add_expressao(expr)
+        casos = np.array([[rng.choice((-1, 0, 0, 1)) for _ in range(n)] for _ in range(CASOS_LOTE)], dtype=np.int8)
+
+        # O reordenamento é quadrático, então só é medido nos tamanhos menores
+        reordenando = f"{mede(avalia_reordenando, expr, fatos):10.2f}" if n <= 2000 else f"{'-':>10}"
+        print(f"{n:>8} {reordenando} "
+              f"{mede(expr.avalia, fatos):10.2f} "
+              f"{mede(expr.avalia_resultado, fatos):10.2f} "
+              f"{mede(plano.avalia, fatos):10.2f} "
+              f"{mede(avalia_lote, plano, casos):10.2f}")
+
+
+
+
+if __name__ == "__main__":
+    main()
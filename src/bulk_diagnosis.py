@@ -0,0 +1,239 @@
+import argparse
+import csv
+import json
+import math
+import os
+import sys
+from collections import deque
+from itertools import islice
+import numpy as np
+from db_config import DatabaseConfig
+from compiler import PlanoAvaliacao, load_plano
+from snapshot import get_snapshot_dir, carrega_plano
+from parallel import ExecutorParalelo, init_worker, avalia_casos
+from kleene import VERDADEIRO, FALSO
+
+
+
+
+def parse_ids(valor) -> list[int]:
+    """
+    Function to parse a list of symptom/result ids. In CSV files the ids are separated by ';', ',' or spaces.
+    """
+    if valor is None:
+        return []
+    if isinstance(valor, list):
+        return [int(fato_id) for fato_id in valor]
+    return [int(fato_id) for fato_id in str(valor).replace(";", " ").replace(",", " ").split()]
+
+
+
+
+def read_casos(arquivo, formato: str):
+    """
+    Generator to read the cases of a CSV or JSONL file, one at a time, as tuples (id, presentes, ausentes).
+    Each case has the columns/keys 'id', 'presentes' and 'ausentes'. When the id is missing, the line number is used.
+    """
+    if formato == "csv":
+        linhas = csv.DictReader(arquivo)
+    else:
+        linhas = (json.loads(linha) for linha in arquivo if linha.strip())
+
+    for numero, linha in enumerate(linhas, start=1):
+        caso_id = linha.get("id")
+        yield (
+            str(caso_id) if caso_id not in (None, "") else str(numero),
+            parse_ids(linha.get("presentes")),
+            parse_ids(linha.get("ausentes")),
+        )
+
+
+
+
+def read_blocos(casos, tamanho_bloco: int):
+    """
+    Generator to group the cases in blocks of tamanho_bloco cases.
+    """
+    while True:
+        bloco = list(islice(casos, tamanho_bloco))
+        if not bloco:
+            return
+        yield bloco
+
+
+
+
+class EscritorJsonl():
+    """
+    Class to write the evaluation of each case and disease as a JSON line: {"caso", "doenca", "diagnostico", "resultado", "score"}.
+    The result is true, false or null (indeterminate), like the Tribool returned by the Streamlit page.
+    """
+    def __init__(self, caminho: str) -> None:
+        """
+        Open the output file.
+        """
+        self.arquivo = open(caminho, "w", encoding="utf-8")
+
+
+    def write(self, caso_ids: list[str], doencas: list[str], diagnosticos: list[int], resultados: np.ndarray, scores: np.ndarray) -> None:
+        """
+        Write the rows of a block of cases.
+        """
+        valores = {VERDADEIRO: True, FALSO: False}
+        for linha, caso_id in enumerate(caso_ids):
+            for coluna, doenca in enumerate(doencas):
+                score = float(scores[linha, coluna])
+                self.arquivo.write(json.dumps({
+                    "caso": caso_id,
+                    "doenca": doenca,
+                    "diagnostico": diagnosticos[coluna],
+                    "resultado": valores.get(int(resultados[linha, coluna])),
+                    "score": None if math.isnan(score) else score,
+                }, ensure_ascii=False) + "\n")
+
+
+    def close(self) -> None:
+        """
+        Close the output file.
+        """
+        self.arquivo.close()
+
+
+
+
+class EscritorParquet():
+    """
+    Class to write the evaluation of each case and disease to a Parquet file, one row group per block of cases.
+    It has the same columns of EscritorJsonl. pyarrow is only imported when a Parquet file is written.
+    """
+    def __init__(self, caminho: str) -> None:
+        """
+        Open the output file with the schema of the rows.
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self.pa = pa
+        self.schema = pa.schema([
+            ("caso", pa.string()),
+            ("doenca", pa.string()),
+            ("diagnostico", pa.int64()),
+            ("resultado", pa.bool_()),
+            ("score", pa.float64()),
+        ])
+        self.writer = pq.ParquetWriter(caminho, self.schema)
+
+
+    def write(self, caso_ids: list[str], doencas: list[str], diagnosticos: list[int], resultados: np.ndarray, scores: np.ndarray) -> None:
+        """
+        Write the rows of a block of cases as a row group.
+        """
+        n_casos, n_doencas = resultados.shape
+        resultados = resultados.ravel()
+        tabela = self.pa.Table.from_arrays([
+            self.pa.array(np.repeat(np.array(caso_ids, dtype=object), n_doencas), type=self.pa.string()),
+            self.pa.array(np.tile(np.array(doencas, dtype=object), n_casos), type=self.pa.string()),
+            self.pa.array(np.tile(np.array(diagnosticos, dtype=np.int64), n_casos)),
+            self.pa.array(resultados == VERDADEIRO, mask=~np.isin(resultados, (VERDADEIRO, FALSO))),
+            self.pa.array(scores.ravel(), from_pandas=True),
+        ], schema=self.schema)
+        self.writer.write_table(tabela)
+
+
+    def close(self) -> None:
+        """
+        Close the output file.
+        """
+        self.writer.close()
+
+
+
+
+def formato_por_extensao(caminho: str, formatos: tuple[str, ...]) -> str:
+    """
+    Function to infer the format of a file from its extension.
+    """
+    extensao = os.path.splitext(caminho)[1].lower().lstrip(".")
+    if extensao == "json":
+        extensao = "jsonl"
+    if extensao not in formatos:
+        raise ValueError(f"Can't infer the format of '{caminho}', use one of {formatos}")
+    return extensao
+
+
+
+
+def write_bloco(escritor, doencas: list[str], diagnosticos: list[int], caso_ids: list[str], future) -> int:
+    """
+    Function to wait for the evaluation of a block of cases and write it. Return the number of cases of the block.
+    """
+    resultados, scores = future.result()
+    escritor.write(caso_ids, doencas, diagnosticos, resultados, scores)
+    return len(caso_ids)
+
+
+
+
+def run(plano: PlanoAvaliacao, entrada: str, saida: str, formato_entrada: str = None, formato_saida: str = None, workers: int = 1, tamanho_bloco: int = 10000) -> int:
+    """
+    Function to evaluate all cases of the input file and write the results to the output file. Return the number of cases.
+    The cases are read and evaluated in blocks of tamanho_bloco cases, and at most two blocks per worker are in flight,
+    so the memory used doesn't depend on the size of the input. The output keeps the order of the input.
+    """
+    formato_entrada = formato_entrada or formato_por_extensao(entrada, ("csv", "jsonl"))
+    formato_saida = formato_saida or formato_por_extensao(saida, ("jsonl", "parquet"))
+    diagnosticos = plano.diagnostico_ids()
+    doencas = [plano.nomes_doencas.get(plano.doencas[diagnostico_id]) for diagnostico_id in diagnosticos]
+
+    escritor = EscritorParquet(saida) if formato_saida == "parquet" else EscritorJsonl(saida)
+    total = 0
+    try:
+        with open(entrada, newline="", encoding="utf-8") as arquivo:
+            blocos = read_blocos(read_casos(arquivo, formato_entrada), tamanho_bloco)
+
+            if workers <= 1:
+                init_worker(plano)
+                for bloco in blocos:
+                    resultados, scores = avalia_casos([(presentes, ausentes) for _, presentes, ausentes in bloco])
+                    escritor.write([caso_id for caso_id, _, _ in bloco], doencas, diagnosticos, resultados, scores)
+                    total += len(bloco)
+                return total
+
+            with ExecutorParalelo(plano, workers) as executor:
+                pendentes = deque()
+                for bloco in blocos:
+                    future = executor.submit_casos([(presentes, ausentes) for _, presentes, ausentes in bloco])
+                    pendentes.append(([caso_id for caso_id, _, _ in bloco], future))
+                    if len(pendentes) >= 2 * workers:
+                        total += write_bloco(escritor, doencas, diagnosticos, *pendentes.popleft())
+                while pendentes:
+                    total += write_bloco(escritor, doencas, diagnosticos, *pendentes.popleft())
+    finally:
+        escritor.close()
+    return total
+
+
+
+
+def main(argv: list[str] = None) -> None:
+    """
+    Command-line entry point. Run the script with python src/bulk_diagnosis.py casos.csv resultados.parquet --workers 8
+    """
+    parser = argparse.ArgumentParser(description="Evaluate the diagnoses of all diseases for every case of a CSV/JSONL file.")
+    parser.add_argument("entrada", help="CSV or JSONL file with the columns/keys 'id', 'presentes' and 'ausentes' (symptom and result ids)")
+    parser.add_argument("saida", help="JSONL or Parquet file with one row per case and disease")
+    parser.add_argument("--formato-entrada", choices=("csv", "jsonl"), help="Format of the input file (default: by the extension)")
+    parser.add_argument("--formato-saida", choices=("jsonl", "parquet"), help="Format of the output file (default: by the extension)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Number of worker processes (default: number of CPUs)")
+    parser.add_argument("--snapshot", default=get_snapshot_dir(), help="Snapshot directory to load the plan from, instead of the database (default: $DISEASEDX_SNAPSHOT)")
+    parser.add_argument("--tamanho-bloco", type=int, default=10000, help="Number of cases evaluated at a time by each worker (default: 10000)")
+    args = parser.parse_args(argv)
+
+    plano = carrega_plano(args.snapshot) if args.snapshot else load_plano(DatabaseConfig().load_engine())
+    total = run(plano, args.entrada, args.saida, args.formato_entrada, args.formato_saida, args.workers, args.tamanho_bloco)
+    print(f"{total} cases evaluated for {len(plano.raizes)} diagnoses.", file=sys.stderr)
+
+
+
+
+if __name__ == "__main__":
+    main()
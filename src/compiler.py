@@ -0,0 +1,318 @@
+import heapq
+from sqlalchemy import Engine
+from sqlalchemy.orm import Session
+from tribool import Tribool
+from kleene import VERDADEIRO, FALSO, INDETERMINADO, e, ou, ao_menos, to_tribool
+from models import Expressao, And, Or, AoMenos, Sintoma, Resultado, Diagnostico
+from loader import GrafoConhecimento, load_grafo
+
+
+
+
+"""
+Operation codes of the nodes of a compiled evaluation plan.
+"""
+OP_FATO = 0
+OP_AND = 1
+OP_OR = 2
+OP_AO_MENOS = 3
+
+
+
+
+class PlanoAvaliacao():
+    """
+    Class to represent a flat, ORM-free evaluation plan for the expressions of a set of diagnoses.
+    The expression trees are compiled once, when the knowledge base loads, into parallel lists indexed by node.
+    The nodes are stored in topological order (children always come before their parents), so the plan can be evaluated
+    without touching any SQLAlchemy-instrumented attribute. An expression shared by more than one tree (same expressao id) is compiled only once.
+    Structurally identical subexpressions (same type, qtd and children) are hash-consed into a single node, even when they are different rows,
+    so each of them is evaluated at most once per fact set across all diagnoses.
+
+    Attributes:
+        ops (list[int]): The operation code of each node (OP_FATO, OP_AND, OP_OR or OP_AO_MENOS).
+        args (list[int]): The fact id for OP_FATO nodes, the qtd for OP_AO_MENOS nodes and 0 for the others.
+        filhos (list[tuple[int, ...]]): The indexes of the children of each node.
+        expressao_ids (list[int]): The id of the Expressao each node was compiled from.
+        labels (list[str]): The label of each node, the same one used in AvaliaNode.expressao.
+        raizes (dict[int, int]): The index of the root node of each diagnosis, keyed by the diagnosis id.
+        doencas (dict[int, int]): The disease id of each diagnosis, keyed by the diagnosis id.
+        nomes_doencas (dict[int, str]): The name of each disease, keyed by the disease id.
+        fatos_ids (list[int]): The ids of the symptoms and results known by the plan, in the order of their dense index.
+        indice_fatos (dict[int, int]): The dense index of each symptom/result, keyed by its id.
+        estruturas (dict[tuple, int]): The index of each And/Or/AoMenos node, keyed by its structure (op, qtd, children indexes).
+    """
+    def __init__(self) -> None:
+        """
+        Initialize an empty plan.
+        """
+        self.ops = []
+        self.args = []
+        self.filhos = []
+        self.expressao_ids = []
+        self.labels = []
+        self.raizes = {}
+        self.doencas = {}
+        self.nomes_doencas = {}
+        self.fatos_ids = []
+        self.indice_fatos = {}
+        self.estruturas = {}
+        self._indices = {}
+
+
+    def __len__(self) -> int:
+        """
+        Return the number of nodes in the plan.
+        """
+        return len(self.ops)
+
+
+    def add_fato(self, fato_id: int) -> int:
+        """
+        Register a symptom or result in the plan and return its dense index.
+        """
+        if fato_id not in self.indice_fatos:
+            self.indice_fatos[fato_id] = len(self.fatos_ids)
+            self.fatos_ids.append(fato_id)
+        return self.indice_fatos[fato_id]
+
+
+    def add_expressao(self, expr: Expressao) -> int:
+        """
+        Compile an expression tree into the plan and return the index of its root node.
+        Expressions that were already compiled are reused by their id, and the others are reused by their structure.
+        The children of And and Or are compared regardless of their order, since their result and score don't depend on it.
+        And keeps repeated children (its score is the mean of the children), while Or compares them as a set (its score is the max).
+        The children of AoMenos keep their order, since a False AoMenos only scores -1 when its last child is False.
+        """
+        if expr.id is not None and expr.id in self._indices:
+            return self._indices[expr.id]
+
+        if isinstance(expr, (Sintoma, Resultado)):
+            op, arg, filhos, label = OP_FATO, expr.id, (), repr(expr)
+            self.add_fato(expr.id)
+        elif isinstance(expr, AoMenos):
+            filhos = tuple(self.add_expressao(e) for e in expr.expressoes)
+            op, arg, label = OP_AO_MENOS, expr.qtd, f"{expr.__class__.__name__}({expr.qtd})"
+        elif isinstance(expr, And):
+            filhos = tuple(self.add_expressao(e) for e in expr.expressoes)
+            op, arg, label = OP_AND, 0, expr.__class__.__name__
+        elif isinstance(expr, Or):
+            filhos = tuple(self.add_expressao(e) for e in expr.expressoes)
+            op, arg, label = OP_OR, 0, expr.__class__.__name__
+        else:
+            raise TypeError(f"Unsupported expression type: {expr.__class__.__name__}")
+
+        if op != OP_FATO:
+            estrutura = self._estrutura(op, arg, filhos)
+            if estrutura in self.estruturas:
+                indice = self.estruturas[estrutura]
+                if expr.id is not None:
+                    self._indices[expr.id] = indice
+                return indice
+
+        return self.add_no(op, arg, filhos, expr.id, label)
+
+
+    def add_no(self, op: int, arg: int, filhos: tuple[int, ...], expressao_id: int, label: str) -> int:
+        """
+        Append a node to the plan and return its index. The children must already be in the plan.
+        It's used by add_expressao and to rebuild a plan from its arrays (see snapshot.py), so it doesn't hash-cons the node again.
+        """
+        indice = len(self.ops)
+        if op != OP_FATO:
+            self.estruturas.setdefault(self._estrutura(op, arg, filhos), indice)
+        self.ops.append(op)
+        self.args.append(arg)
+        self.filhos.append(filhos)
+        self.expressao_ids.append(expressao_id)
+        self.labels.append(label)
+        if expressao_id is not None:
+            self._indices.setdefault(expressao_id, indice)
+        return indice
+
+
+    def _estrutura(self, op: int, arg: int, filhos: tuple[int, ...]) -> tuple:
+        """
+        Return the key of an And/Or/AoMenos node in self.estruturas.
+        """
+        if op == OP_AND:
+            return (op, arg, tuple(sorted(filhos)))
+        if op == OP_OR:
+            return (op, arg, tuple(sorted(set(filhos))))
+        return (op, arg, filhos)
+
+
+    def add_diagnostico(self, diagnostico: Diagnostico) -> int:
+        """
+        Compile the expression of a diagnosis into the plan and register its root node.
+        """
+        raiz = self.add_expressao(diagnostico.expressao)
+        self.raizes[diagnostico.id] = raiz
+        self.doencas[diagnostico.id] = diagnostico.doenca_id
+        if diagnostico.doenca is not None:
+            self.nomes_doencas[diagnostico.doenca_id] = diagnostico.doenca.name
+        return raiz
+
+
+    def diagnostico_ids(self) -> list[int]:
+        """
+        Return the ids of the compiled diagnoses, in the order used by the columns of the batch evaluator.
+        """
+        return list(self.raizes)
+
+
+    def avalia_no(self, no: int, fatos, memo: dict) -> tuple[int, float]:
+        """
+        Evaluate a single node of the plan, with the same result and score semantics of the avalia methods in models.py.
+        The result is returned as a Kleene code (see kleene.py), like Expressao.avalia_codigo.
+        The memo dictionary stores the (code, score) of the nodes already evaluated for the same facts, so shared nodes are evaluated only once.
+        The facts must provide a get_codigo(fato_id) method, like FatosSintomaResultado.
+        Like Expressao.avalia_resultado, it stops evaluating the children of a node as soon as its result and score are decided.
+        """
+        if no in memo:
+            return memo[no]
+
+        op = self.ops[no]
+        if op == OP_FATO:
+            memo[no] = self.avalia_fato(self.args[no], fatos)
+            return memo[no]
+
+        codigos = []
+        scores = []
+        count_true = 0
+        for filho in self.filhos[no]:
+            filho_codigo, filho_score = self.avalia_no(filho, fatos, memo)
+            if op == OP_AND and filho_codigo == FALSO:
+                memo[no] = (FALSO, -1)
+                return memo[no]
+            if filho_codigo == VERDADEIRO:
+                count_true += 1
+                if op == OP_OR or (op == OP_AO_MENOS and count_true == self.args[no]):
+                    memo[no] = (VERDADEIRO, 1)
+                    return memo[no]
+            codigos.append(filho_codigo)
+            scores.append(filho_score)
+
+        memo[no] = self.combina(op, self.args[no], codigos, scores)
+        return memo[no]
+
+
+    def avalia_fato(self, fato_id: int, fatos) -> tuple[int, float]:
+        """
+        Evaluate a symptom or result leaf, like Sintoma.avalia_codigo and Resultado.avalia_codigo. The code of a fact is also its score.
+        """
+        codigo = fatos.get_codigo(fato_id)
+        return codigo, codigo
+
+
+    def combina(self, op: int, arg: int, codigos: list[int], scores: list[float]) -> tuple[int, float]:
+        """
+        Combine the codes and scores of the children of an And, Or or AoMenos node, using the lookup tables of kleene.py.
+        """
+        if op == OP_AND:
+            codigo = VERDADEIRO
+            for filho_codigo in codigos:
+                codigo = e(codigo, filho_codigo)
+            if codigo == INDETERMINADO:
+                return INDETERMINADO, sum(scores) / len(scores)
+            return codigo, codigo
+        elif op == OP_OR:
+            codigo = FALSO
+            for filho_codigo in codigos:
+                codigo = ou(codigo, filho_codigo)
+            if codigo == INDETERMINADO:
+                return INDETERMINADO, max(scores)
+            return codigo, codigo
+        else:
+            return self._avalia_ao_menos(arg, codigos, scores)
+
+
+    def _avalia_ao_menos(self, qtd: int, codigos: list[int], scores: list[float]) -> tuple[int, float]:
+        """
+        Combine the children of an AoMenos node. It reproduces AoMenos.avalia, where the score of the top 'qtd' children
+        is recomputed after each child, so a False AoMenos only keeps the -1 score when its last child is False.
+        Only the top 'qtd' scores are selected (heapq.nlargest), so a wide node costs O(n log qtd) instead of a full sort.
+        """
+        if not codigos:
+            return INDETERMINADO, None
+
+        codigo = ao_menos(qtd, len(codigos), codigos.count(VERDADEIRO), codigos.count(FALSO))
+        if codigo == VERDADEIRO:
+            return VERDADEIRO, 1
+        if codigo == FALSO and codigos[-1] == FALSO:
+            return FALSO, -1
+        return codigo, sum(heapq.nlargest(qtd, scores)) / qtd
+
+
+    def avalia_diagnostico(self, diagnostico_id: int, fatos, memo: dict = None) -> tuple[Tribool, float]:
+        """
+        Evaluate the expression of a single diagnosis and return its result and score.
+        A memo shared between calls with the same facts avoids evaluating the common nodes again.
+        """
+        if memo is None:
+            memo = {}
+        codigo, score = self.avalia_no(self.raizes[diagnostico_id], fatos, memo)
+        return to_tribool(codigo), score
+
+
+    def avalia_nos(self, fatos) -> list[tuple[int, float]]:
+        """
+        Evaluate every node of the plan with the same facts and return the (code, score) of each node.
+        Since the nodes are in topological order, it's a single pass over the plan and every node is evaluated exactly once.
+        """
+        valores = []
+        for op, arg, filhos in zip(self.ops, self.args, self.filhos):
+            if op == OP_FATO:
+                valores.append(self.avalia_fato(arg, fatos))
+            else:
+                codigos = [valores[filho][0] for filho in filhos]
+                scores = [valores[filho][1] for filho in filhos]
+                valores.append(self.combina(op, arg, codigos, scores))
+        return valores
+
+
+    def avalia(self, fatos) -> dict[int, tuple[Tribool, float]]:
+        """
+        Evaluate the expressions of all diagnoses with the same facts.
+        Return a dictionary with the (result, score) of each diagnosis, keyed by the diagnosis id.
+        """
+        valores = self.avalia_nos(fatos)
+        return {diagnostico_id: (to_tribool(valores[raiz][0]), valores[raiz][1]) for diagnostico_id, raiz in self.raizes.items()}
+
+
+
+
+def compile_diagnosticos(diagnosticos: list[Diagnostico]) -> PlanoAvaliacao:
+    """
+    Function to compile the expressions of a list of diagnoses into a single evaluation plan.
+    It must be called while the diagnoses are attached to a session, since it walks their expression trees.
+    """
+    plano = PlanoAvaliacao()
+    for diagnostico in diagnosticos:
+        plano.add_diagnostico(diagnostico)
+    return plano
+
+
+
+
+def compile_grafo(grafo: GrafoConhecimento) -> PlanoAvaliacao:
+    """
+    Function to compile all diagnoses of a knowledge base loaded with load_grafo, with every symptom and result registered as a fact.
+    """
+    plano = compile_diagnosticos(grafo.diagnosticos)
+    for fato in grafo.sintomas + grafo.resultados:
+        plano.add_fato(fato.id)
+    return plano
+
+
+
+
+def load_plano(engine: Engine) -> PlanoAvaliacao:
+    """
+    Function to compile all diagnoses of the database into an evaluation plan, with every symptom and result registered as a fact.
+    It's used by the entry points that don't run inside Streamlit (e.g. bulk_diagnosis.py), since the plan doesn't depend on the session after it's built.
+    The knowledge base is read with load_grafo, so the number of queries doesn't depend on the depth of the expressions.
+    """
+    with Session(engine) as session:
+        return compile_grafo(load_grafo(session))
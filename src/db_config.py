@@ -1,10 +1,60 @@
 import os
+import tomllib
 import streamlit as st
-from sqlalchemy import create_engine, Engine
+from sqlalchemy import create_engine, event, inspect, Engine
+from sqlalchemy.pool import StaticPool
 from urllib.parse import quote_plus
 from sqlalchemy_utils import database_exists, create_database, drop_database
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import sessionmaker
 from models import Base, Manifestacao, Orgao, RegiaoComposta, Sintoma, Exame, Resultado, Or, And, AoMenos, Doenca, Diagnostico
+from versioning import init_versoes
+from hashcons import init_assinaturas
+
+
+
+
+"""
+Environment variable with the path of the config file and the default path, used when it exists.
+The settings are read from the [database] table of the file.
+"""
+CONFIG_ENV = "DISEASEDX_CONFIG"
+CONFIG_FILE = "diseasedx.toml"
+
+"""
+Prefix of the environment variables that override the settings of the config file (e.g. DISEASEDX_DB_POOL_SIZE=20).
+"""
+SETTINGS_ENV_PREFIX = "DISEASEDX_DB_"
+
+"""
+Default settings of the database connection.
+    backend: "mysql" or "sqlite". Ignored when url is set.
+    url: Full connection string, used as is.
+    host, port, name, driver: MySQL database. The user and password come from MYSQL_USER and MYSQL_PASS.
+    path: SQLite database file, or ":memory:" for a shared in-memory database (see memory_name).
+    pool_size, max_overflow, pool_timeout, pool_pre_ping, pool_recycle: Connection pool of the engine (not used by the in-memory SQLite database).
+    statement_timeout: Maximum time of a statement in milliseconds, 0 to disable (max_execution_time in MySQL, busy_timeout in SQLite).
+    sqlite_wal, sqlite_mmap_size, sqlite_cache_size: WAL journal, size of the memory-mapped I/O in bytes and page cache (negative is in KiB) of SQLite.
+"""
+DEFAULT_SETTINGS = {
+    "backend": "mysql",
+    "url": "",
+    "host": "localhost",
+    "port": 3306,
+    "name": "diseasedx_test",
+    "driver": "mysql+mysqlconnector",
+    "path": "mylocaldb.db",
+    "memory_name": "diseasedx",
+    "pool_size": 10,
+    "max_overflow": 20,
+    "pool_timeout": 30,
+    "pool_pre_ping": True,
+    "pool_recycle": 1800,
+    "statement_timeout": 0,
+    "sqlite_wal": True,
+    "sqlite_mmap_size": 268435456,
+    "sqlite_cache_size": -65536,
+    "echo": False,
+}
 
 
 
@@ -12,24 +62,146 @@ from models import Base, Manifestacao, Orgao, RegiaoComposta, Sintoma, Exame, Re
 class DatabaseConfig:
     """
     This class is responsible for creating the engine for database connection and initializing the database.
+    The connection is configured by DEFAULT_SETTINGS, the config file and the environment variables, in this order (see load_settings).
     Run the script with python src/db_config.py to create the database.
     """
+    def load_settings(self) -> dict:
+        """
+        Returns the settings of the database connection: the DEFAULT_SETTINGS, updated by the [database] table of the config file
+        (DISEASEDX_CONFIG, or diseasedx.toml when it exists) and then by the DISEASEDX_DB_* environment variables.
+        The values of the environment variables are converted to the type of the default value.
+        """
+        settings = dict(DEFAULT_SETTINGS)
+
+        path = os.getenv(CONFIG_ENV, CONFIG_FILE)
+        if os.getenv(CONFIG_ENV) or os.path.exists(path):
+            with open(path, "rb") as file:
+                settings.update(tomllib.load(file).get("database", {}))
+
+        for key, default in DEFAULT_SETTINGS.items():
+            value = os.getenv(SETTINGS_ENV_PREFIX + key.upper())
+            if value is None:
+                continue
+            if isinstance(default, bool):
+                settings[key] = value.strip().lower() in ("1", "true", "yes", "on")
+            elif isinstance(default, int):
+                settings[key] = int(value)
+            else:
+                settings[key] = value
+        return settings
+
+
+
+
+    def build_engine(self, settings: dict) -> Engine:
+        """
+        Returns a new engine for the settings (see load_settings).
+        SQLite is tuned on each new connection: WAL journal (only for files), synchronous NORMAL, memory-mapped I/O, a bigger page cache and
+        temporary tables in memory. With path ":memory:" all the connections share the same in-memory database, which lives while the engine exists.
+        """
+        url = settings["url"]
+        if not url and settings["backend"] == "sqlite":
+            if settings["path"] == ":memory:":
+                url = f"sqlite:///file:{settings['memory_name']}?mode=memory&cache=shared&uri=true"
+            else:
+                url = f"sqlite:///{settings['path']}"
+        elif not url:
+            username = os.getenv('MYSQL_USER')
+            password = quote_plus(os.getenv('MYSQL_PASS', ''))
+            url = f"{settings['driver']}://{username}:{password}@{settings['host']}:{settings['port']}/{settings['name']}"
+
+        if url.startswith("sqlite"):
+            return self._build_sqlite_engine(url, settings)
+
+        engine = create_engine(
+            url,
+            echo=settings["echo"],
+            pool_size=settings["pool_size"],
+            max_overflow=settings["max_overflow"],
+            pool_timeout=settings["pool_timeout"],
+            pool_pre_ping=settings["pool_pre_ping"],
+            pool_recycle=settings["pool_recycle"],
+        )
+        if settings["statement_timeout"] and engine.dialect.name == "mysql":
+            @event.listens_for(engine, "connect")
+            def set_statement_timeout(dbapi_connection, connection_record) -> None:
+                cursor = dbapi_connection.cursor()
+                cursor.execute(f"SET SESSION max_execution_time = {int(settings['statement_timeout'])}")
+                cursor.close()
+        return engine
+
+
+
+
+    def _build_sqlite_engine(self, url: str, settings: dict) -> Engine:
+        """
+        Returns a new SQLite engine with the tuning PRAGMAs of build_engine.
+        The in-memory database uses a single connection (StaticPool), shared by the threads of Streamlit, since it's lost when its last connection is closed.
+        """
+        memory = "mode=memory" in url or url in ("sqlite://", "sqlite:///:memory:")
+        if memory:
+            engine = create_engine(url, echo=settings["echo"], poolclass=StaticPool, connect_args={"check_same_thread": False})
+        else:
+            engine = create_engine(
+                url,
+                echo=settings["echo"],
+                pool_size=settings["pool_size"],
+                max_overflow=settings["max_overflow"],
+                pool_timeout=settings["pool_timeout"],
+                pool_pre_ping=settings["pool_pre_ping"],
+                connect_args={"check_same_thread": False},
+            )
+
+        @event.listens_for(engine, "connect")
+        def set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+            cursor = dbapi_connection.cursor()
+            if settings["sqlite_wal"] and not memory:
+                cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.execute("PRAGMA temp_store=MEMORY")
+            cursor.execute(f"PRAGMA mmap_size={int(settings['sqlite_mmap_size'])}")
+            cursor.execute(f"PRAGMA cache_size={int(settings['sqlite_cache_size'])}")
+            if settings["statement_timeout"]:
+                cursor.execute(f"PRAGMA busy_timeout={int(settings['statement_timeout'])}")
+            cursor.close()
+        return engine
+
+
+
+
+    def is_memory(self, engine: Engine) -> bool:
+        """
+        Returns True when the engine uses an in-memory SQLite database.
+        """
+        return engine.dialect.name == "sqlite" and (engine.url.query.get("mode") == "memory" or engine.url.database in (None, "", ":memory:"))
+
+
+
+
     @st.cache_resource
     def load_engine(_self) -> Engine:
         """
-        Returns the engine for the database connection. The st.cache_resource decorator is used to cache the engine so that it's not recreated every time.
-        It's possible to use a SQLite database for local development, just switch the self.connection_string to "sqlite:///mylocaldb.db".
+        Returns the engine for the database connection, with the settings of load_settings.
+        The st.cache_resource decorator is used to cache the engine (and its connection pool) so that it's not recreated every time.
+        An in-memory database starts empty in each process, so its tables are created and populated with the example data here, when they don't exist yet.
         """
-        username = os.getenv('MYSQL_USER')
-        password = quote_plus(os.getenv('MYSQL_PASS'))
-        server = "localhost"
-        port = "3306"
-        dbname = "diseasedx_test"
-        connection_string = f"mysql+mysqlconnector://{username}:{password}@{server}:{port}/{dbname}"
-        # connection_string = f"sqlite:///mylocaldb.db"
-        engine = create_engine(connection_string, echo=False)
+        engine = _self.build_engine(_self.load_settings())
+        if _self.is_memory(engine) and not inspect(engine).has_table(Diagnostico.__tablename__):
+            _self.create_tables(engine)
+            _self.populate_with_examples(engine)
         return engine
-    
+
+
+
+
+    @st.cache_resource
+    def load_sessionmaker(_self) -> sessionmaker:
+        """
+        Returns the session factory bound to the cached engine, so every session takes its connection from the same pool.
+        The objects aren't expired on commit, so they can be used after the session is closed.
+        """
+        return sessionmaker(bind=_self.load_engine(), expire_on_commit=False)
+
 
 
 
@@ -38,14 +210,18 @@ class DatabaseConfig:
         Initializes the database by creating it if it doesn't exist and creating the tables.
         """
         engine = self.load_engine()
-        if database_exists(engine.url):
-            print(f"Database already exists. Dropping it...")
-            drop_database(engine.url)
-
-        create_database(engine.url)
-        print(f"Database created successfully.")
-
-        Base.metadata.create_all(engine)
+        if self.is_memory(engine):
+            # O banco em memória é criado com a primeira conexão, só recria as tabelas
+            Base.metadata.drop_all(engine)
+        else:
+            if database_exists(engine.url):
+                print(f"Database already exists. Dropping it...")
+                drop_database(engine.url)
+
+            create_database(engine.url)
+            print(f"Database created successfully.")
+
+        self.create_tables(engine)
         print("Tables created successfully.")
 
         self.populate_with_examples()
@@ -54,12 +230,24 @@ class DatabaseConfig:
 
 
 
-    def populate_with_examples(self) -> None:
+    def create_tables(self, engine: Engine) -> None:
+        """
+        Creates the tables of the models, the rows of the versions and the index of the structural hashes in the database of the engine.
+        """
+        Base.metadata.create_all(engine)
+        init_versoes(engine)
+        init_assinaturas(engine)
+
+
+
+
+    def populate_with_examples(self, engine: Engine = None) -> None:
         """
         Populates the database with example data from hardcoded objects below.
+        By default it uses the cached engine. The engine can be given while it's being built (see load_engine).
         """
-        engine = self.load_engine()
-        with Session(engine, expire_on_commit=False) as session:
+        session_factory = sessionmaker(bind=engine, expire_on_commit=False) if engine is not None else self.load_sessionmaker()
+        with session_factory() as session:
 
             # Criando os objetos de Manifestacao
             dor = Manifestacao(name="Dor")
@@ -0,0 +1,146 @@
+import json
+import hashlib
+from sqlalchemy import Engine, bindparam, event, inspect, select, text, update
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
+from models import Expressao, And, Or, AoMenos, Sintoma, Resultado
+from loader import load_grafo
+
+
+
+
+def assinatura(chave: tuple) -> str:
+    """
+    Function to get the structural hash of an expression (the column Expressao.assinatura) from its canonical key (see Expressao.chave_estrutural).
+    It's the SHA-256 of the key as JSON, so it's the same in every process and database.
+    """
+    return hashlib.sha256(json.dumps(chave, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+
+
+def init_assinaturas(engine: Engine) -> None:
+    """
+    Function to add the assinatura column and its index to an expressao table created before them, and to fill the hash of the expressions
+    that don't have it yet (e.g. written by older versions), with a single bulk UPDATE.
+    """
+    if "assinatura" not in {coluna["name"] for coluna in inspect(engine).get_columns(Expressao.__tablename__)}:
+        with engine.begin() as connection:
+            connection.execute(text(f"ALTER TABLE {Expressao.__tablename__} ADD COLUMN assinatura VARCHAR(64)"))
+        for index in Expressao.__table__.indexes:
+            index.create(engine, checkfirst=True)
+
+    with Session(engine) as session:
+        if session.scalar(select(Expressao.id).where(Expressao.assinatura.is_(None)).limit(1)) is None:
+            return
+        grafo = load_grafo(session)
+        linhas = [{"id": expr.id, "assinatura": assinatura(expr.chave_estrutural())} for expr in grafo.expressoes if expr.assinatura is None]
+        session.execute(update(Expressao), linhas)
+        session.commit()
+
+
+
+
+@event.listens_for(Session, "after_flush")
+def preenche_assinaturas(session: Session, flush_context) -> None:
+    """
+    Function to fill the hash of the new expressions of every flush, after the ids are assigned, so every ORM write (e.g. populate_with_examples)
+    stores it, even when it doesn't go through get_or_create_expressao.
+    """
+    novas = [obj for obj in session.new if isinstance(obj, Expressao) and obj.assinatura is None]
+    if not novas:
+        return
+    tabela = Expressao.__table__
+    linhas = [{"b_id": obj.id, "b_assinatura": assinatura(obj.chave_estrutural())} for obj in novas]
+    session.connection().execute(update(tabela).where(tabela.c.id == bindparam("b_id")).values(assinatura=bindparam("b_assinatura")), linhas)
+    for obj, linha in zip(novas, linhas):
+        set_committed_value(obj, "assinatura", linha["b_assinatura"])
+
+
+
+
+def get_or_create_expressao(session: Session, expressao: Expressao, criadas: list = None) -> Expressao:
+    """
+    Function to get the stored expression with the same structure of expressao, or to insert it when there's none (hash-consing).
+    expressao is only read: the expression returned is an instance of the session, either the existing one or a new copy built with the
+    instances of the session of its children, manifestation, region or exam, so the objects loaded in memory (e.g. by load_grafo) aren't attached to it.
+    The exception is a symptom/result of a new manifestation, region or exam, which can't exist yet, so it's inserted as it is.
+    The new expressions are appended to criadas, so the caller can increment their versions.
+    """
+    if expressao.id is not None:
+        return session.get(type(expressao), expressao.id)
+    if criadas is None:
+        criadas = []
+
+    if isinstance(expressao, (And, Or, AoMenos)):
+        return get_or_create_composta(session, type(expressao), expressao.expressoes, getattr(expressao, "qtd", None), criadas)
+
+    relacionados = [expressao.manifestacao, expressao.regiao_do_corpo] if isinstance(expressao, Sintoma) else [expressao.exame]
+    if any(obj is not None and obj.id is None for obj in relacionados):
+        # Uma folha com manifestação, região ou exame novo também é nova
+        session.add(expressao)
+        session.flush()
+        criadas.append(expressao)
+        return expressao
+
+    with session.no_autoflush:
+        if isinstance(expressao, Sintoma):
+            nova = Sintoma(get_relacionado(session, expressao.manifestacao), get_relacionado(session, expressao.regiao_do_corpo))
+        else:
+            nova = Resultado(expressao.name, get_relacionado(session, expressao.exame))
+    return _get_or_insert(session, nova, criadas)
+
+
+
+
+def get_or_create_composta(session: Session, tipo: type, filhos: list[Expressao], qtd: int = None, criadas: list = None) -> Expressao:
+    """
+    Function to get or insert (see get_or_create_expressao) the And/Or/AoMenos (tipo) with these children and qtd (only for AoMenos).
+    The children are resolved first, so equal subexpressions are also reused, and they're kept in the order of their ids.
+    """
+    if criadas is None:
+        criadas = []
+    resolvidos = {}
+    for filho in filhos:
+        filho = get_or_create_expressao(session, filho, criadas)
+        resolvidos[filho.id] = filho
+    filhos = [resolvidos[filho_id] for filho_id in sorted(resolvidos)]
+    nova = AoMenos(qtd, filhos) if tipo is AoMenos else tipo(filhos)
+    return _get_or_insert(session, nova, criadas)
+
+
+
+
+def get_relacionado(session: Session, obj):
+    """
+    Function to get the instance of the session of a stored manifestation, region or exam (or None).
+    """
+    if obj is None:
+        return None
+    return session.get(type(obj), obj.id)
+
+
+
+
+def _get_or_insert(session: Session, nova: Expressao, criadas: list) -> Expressao:
+    """
+    Function to return the stored expression with the structural hash of nova, or to insert nova.
+    When it already exists, the relationships of nova are undone, so its backrefs don't stay in the instances of the session.
+    """
+    chave = assinatura(nova.chave_estrutural())
+    with session.no_autoflush:
+        existente = session.scalars(select(Expressao).where(Expressao.assinatura == chave).order_by(Expressao.id).limit(1)).first()
+    if existente is not None:
+        if isinstance(nova, (And, Or, AoMenos)):
+            nova.expressoes = []
+        elif isinstance(nova, Resultado):
+            nova.exame = None
+        if nova in session:
+            session.expunge(nova)
+        return existente
+
+    nova.assinatura = chave
+    session.add(nova)
+    session.flush()
+    criadas.append(nova)
+    return nova
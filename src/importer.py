@@ -0,0 +1,352 @@
+import os
+import sys
+import json
+import argparse
+from sqlalchemy import Engine, Table, func, insert, select
+from sqlalchemy.orm import Session
+from db_config import DatabaseConfig
+from models import Expressao, And, Or, AoMenos, Sintoma, Resultado, Exame, Manifestacao, RegiaoDoCorpo, RegiaoComposta, Orgao, Doenca, Diagnostico
+from models import and_expressoes, or_expressoes, ao_menos_expressoes, regioes_da_parte
+from loader import GrafoConhecimento, load_grafo
+from versioning import ENTIDADES, init_versoes, incrementa_versao
+from hashcons import assinatura, init_assinaturas
+
+
+
+
+"""
+Tables written by the import, in the order of their foreign keys, and the tables whose ids are assigned by the importer.
+"""
+TABELAS = (
+    Manifestacao.__table__, RegiaoDoCorpo.__table__, Orgao.__table__, RegiaoComposta.__table__, regioes_da_parte,
+    Exame.__table__, Expressao.__table__, Sintoma.__table__, Resultado.__table__, And.__table__, Or.__table__, AoMenos.__table__,
+    and_expressoes, or_expressoes, ao_menos_expressoes, Doenca.__table__, Diagnostico.__table__,
+)
+TABELAS_ID = (Manifestacao.__table__, RegiaoDoCorpo.__table__, Exame.__table__, Expressao.__table__, Doenca.__table__, Diagnostico.__table__)
+
+
+
+
+class ImportadorCatalogo():
+    """
+    Class to import catalogs of diseases, with their diagnosis expressions, symptoms, regions and exams, into the database.
+    The references of the catalog are resolved in memory against caches with the same keys of the *_cache of StreamlitQueries, filled with the
+    existing knowledge base, so an object that already exists (in the database or earlier in the catalog) is reused instead of inserted again.
+    The ids and structural hashes (see hashcons.py) of the new objects are assigned here, so the rows of each table are written with a single bulk INSERT (see grava).
+    The ids are reserved at the start of each transaction (see reserva_ids), so the objects created by other writers in the meantime don't collide with them.
+    Existing objects are never changed (e.g. new parts of an existing RegiaoComposta are ignored).
+
+    Attributes:
+        proximos_ids (dict[Table, int]): Next id of each table of TABELAS_ID, read by reserva_ids in the current transaction.
+        manifestacao_cache, regiao_cache, exame_cache, sintoma_cache, resultado_cache, doenca_cache, diagnostico_cache (dict[tuple, int]): Ids by the keys of StreamlitQueries.
+        and_cache, or_cache (dict[tuple, int]): Ids of the And/Or expressions by the sorted ids of their children.
+        aomenos_cache (dict[tuple, int]): Ids of the AoMenos expressions by (qtd, sorted ids of their children), like StreamlitQueries.
+        regioes_por_nome, exames_por_nome (dict[str, int]): Ids of the regions and exams by name, used by the references of the catalog.
+        regioes_catalogo (dict[str, dict]): Regions of the catalog by name, resolved when they are referenced.
+        linhas (dict[Table, list[dict]]): Rows not written yet, by table.
+        entidades (set[str]): Entities changed by the rows not written yet (see versioning.py).
+        criados (dict[str, int]): Number of objects created by entity.
+    """
+    def __init__(self, grafo: GrafoConhecimento) -> None:
+        """
+        Initialize the caches with the objects of the knowledge base.
+        """
+        self.proximos_ids = {}
+        self.manifestacao_cache = {(obj.name,): obj.id for obj in grafo.manifestacoes}
+        self.regiao_cache = {(obj.name, obj.type): obj.id for obj in grafo.regioes}
+        self.exame_cache = {(obj.name, obj.preco): obj.id for obj in grafo.exames}
+        self.sintoma_cache = {(obj.manifestacao_id, obj.regiao_do_corpo_id): obj.id for obj in grafo.sintomas}
+        self.resultado_cache = {(obj.name, obj.exame_id): obj.id for obj in grafo.resultados}
+        self.doenca_cache = {(obj.name,): obj.id for obj in grafo.doencas}
+        self.diagnostico_cache = {(obj.doenca_id, obj.expressao_id): obj.id for obj in grafo.diagnosticos}
+        self.and_cache = {}
+        self.or_cache = {}
+        self.aomenos_cache = {}
+        for obj in grafo.expressoes:
+            ids = tuple(sorted(e.id for e in getattr(obj, "expressoes", [])))
+            if isinstance(obj, AoMenos):
+                self.aomenos_cache[(obj.qtd, ids)] = obj.id
+            elif isinstance(obj, And):
+                self.and_cache[ids] = obj.id
+            elif isinstance(obj, Or):
+                self.or_cache[ids] = obj.id
+
+        self.regioes_por_nome = {}
+        for obj in grafo.regioes:
+            self.regioes_por_nome.setdefault(obj.name, obj.id)
+        self.exames_por_nome = {}
+        for obj in grafo.exames:
+            self.exames_por_nome.setdefault(obj.name, obj.id)
+
+        self.regioes_catalogo = {}
+        self.linhas = {}
+        self.entidades = set()
+        self.criados = dict.fromkeys(ENTIDADES, 0)
+
+
+    def reserva_ids(self, session: Session) -> None:
+        """
+        Read the next id of each table of TABELAS_ID in the transaction of the session, before any object of the transaction is created.
+        On MySQL, the SELECT ... FOR UPDATE locks the end of the primary key of each table until the commit, so the concurrent inserts wait for it.
+        SQLite allows a single writer, and a transaction that read the ids before another one wrote fails instead of reusing them.
+        """
+        self.proximos_ids = {tabela: (session.scalar(select(func.max(tabela.c.id)).with_for_update()) or 0) + 1 for tabela in TABELAS_ID}
+
+
+    def novo_id(self, tabela: Table) -> int:
+        """
+        Return the next id of the table.
+        """
+        novo_id = self.proximos_ids[tabela]
+        self.proximos_ids[tabela] = novo_id + 1
+        return novo_id
+
+
+    def add_linha(self, tabela: Table, linha: dict, entidade: str = None) -> None:
+        """
+        Add a row to be written by grava. When entidade is set, a new object of that entity is counted.
+        """
+        self.linhas.setdefault(tabela, []).append(linha)
+        if entidade:
+            self.entidades.add(entidade)
+            self.criados[entidade] += 1
+
+
+    def get_manifestacao(self, name: str) -> int:
+        """
+        Return the id of the manifestation, creating it when it doesn't exist.
+        """
+        key = (name,)
+        if key not in self.manifestacao_cache:
+            self.manifestacao_cache[key] = self.novo_id(Manifestacao.__table__)
+            self.add_linha(Manifestacao.__table__, {"id": self.manifestacao_cache[key], "name": name}, "manifestacao")
+        return self.manifestacao_cache[key]
+
+
+    def add_regioes(self, regioes: list[dict]) -> None:
+        """
+        Add the regions of the catalog: {"name", "tipo" ("orgao" or "regiao_composta"), "regioes" (names of the parts)}.
+        Without "tipo", a region with "regioes" is a RegiaoComposta and the others are Orgao. The parts can be listed after the region.
+        """
+        self.regioes_catalogo.update({regiao["name"]: regiao for regiao in regioes})
+        for regiao in regioes:
+            self.get_regiao(regiao["name"])
+
+
+    def get_regiao(self, name: str, caminho: tuple = ()) -> int:
+        """
+        Return the id of the region with this name, creating it (and its parts) when it's a new region of the catalog.
+        """
+        regiao = self.regioes_catalogo.get(name)
+        if regiao is None:
+            if name not in self.regioes_por_nome:
+                raise ValueError(f"Unknown region: {name}")
+            return self.regioes_por_nome[name]
+        if name in caminho:
+            raise ValueError(f"Cycle in the parts of the region: {' > '.join(caminho + (name,))}")
+
+        tipo = regiao.get("tipo", "regiao_composta" if "regioes" in regiao else "orgao")
+        if tipo not in ("orgao", "regiao_composta"):
+            raise ValueError(f"Unknown region type: {tipo}")
+        key = (name, tipo)
+        if key not in self.regiao_cache:
+            partes = sorted({self.get_regiao(parte, caminho + (name,)) for parte in regiao.get("regioes", [])})
+            regiao_id = self.novo_id(RegiaoDoCorpo.__table__)
+            self.add_linha(RegiaoDoCorpo.__table__, {"id": regiao_id, "name": name, "type": tipo}, "regiao")
+            if tipo == "orgao":
+                self.add_linha(Orgao.__table__, {"id": regiao_id})
+            else:
+                self.add_linha(RegiaoComposta.__table__, {"id": regiao_id})
+                for parte_id in partes:
+                    self.add_linha(regioes_da_parte, {"regiao_composta_id": regiao_id, "regiao_do_corpo_id": parte_id})
+            self.regiao_cache[key] = regiao_id
+        self.regioes_por_nome[name] = self.regiao_cache[key]
+        return self.regiao_cache[key]
+
+
+    def add_exames(self, exames: list[dict]) -> None:
+        """
+        Add the exams of the catalog and their results: {"name", "preco", "resultados" (names of the results)}.
+        """
+        for exame in exames:
+            key = (exame["name"], exame.get("preco", ""))
+            if key not in self.exame_cache:
+                self.exame_cache[key] = self.novo_id(Exame.__table__)
+                self.add_linha(Exame.__table__, {"id": self.exame_cache[key], "name": key[0], "preco": key[1]}, "exame")
+            self.exames_por_nome[exame["name"]] = self.exame_cache[key]
+            for resultado in exame.get("resultados", []):
+                self.get_resultado({"exame": exame["name"], "name": resultado})
+
+
+    def get_sintoma(self, sintoma) -> int:
+        """
+        Return the id of the symptom {"manifestacao", "regiao"} (or just the name of the manifestation), creating it when it doesn't exist.
+        """
+        if isinstance(sintoma, str):
+            sintoma = {"manifestacao": sintoma}
+        manifestacao_id = self.get_manifestacao(sintoma["manifestacao"])
+        regiao_id = self.get_regiao(sintoma["regiao"]) if sintoma.get("regiao") else None
+        key = (manifestacao_id, regiao_id)
+        if key not in self.sintoma_cache:
+            self.sintoma_cache[key] = self.novo_id(Expressao.__table__)
+            self.add_linha(Expressao.__table__, {"id": self.sintoma_cache[key], "type": "sintoma", "assinatura": assinatura(("sintoma",) + key)}, "sintoma")
+            self.add_linha(Sintoma.__table__, {"id": self.sintoma_cache[key], "manifestacao_id": manifestacao_id, "regiao_do_corpo_id": regiao_id})
+        return self.sintoma_cache[key]
+
+
+    def get_resultado(self, resultado: dict) -> int:
+        """
+        Return the id of the result {"exame", "name"} of an exam of the catalog or of the database, creating it when it doesn't exist.
+        """
+        if resultado["exame"] not in self.exames_por_nome:
+            raise ValueError(f"Unknown exam: {resultado['exame']}")
+        key = (resultado["name"], self.exames_por_nome[resultado["exame"]])
+        if key not in self.resultado_cache:
+            self.resultado_cache[key] = self.novo_id(Expressao.__table__)
+            self.add_linha(Expressao.__table__, {"id": self.resultado_cache[key], "type": "resultado", "assinatura": assinatura(("resultado",) + key)}, "resultado")
+            self.add_linha(Resultado.__table__, {"id": self.resultado_cache[key], "name": key[0], "exame_id": key[1]})
+        return self.resultado_cache[key]
+
+
+    def get_expressao(self, expressao: dict) -> int:
+        """
+        Return the id of the expression, creating it (and its children) when it doesn't exist. The expressions of the catalog are
+        {"sintoma": ...}, {"resultado": ...}, {"and": [expressions]}, {"or": [expressions]} and {"ao_menos": {"qtd", "expressoes": [expressions]}}.
+        """
+        if "sintoma" in expressao:
+            return self.get_sintoma(expressao["sintoma"])
+        if "resultado" in expressao:
+            return self.get_resultado(expressao["resultado"])
+        if "and" in expressao:
+            return self.get_composta(And.__table__, and_expressoes, "and_id", self.and_cache, (), expressao["and"])
+        if "or" in expressao:
+            return self.get_composta(Or.__table__, or_expressoes, "or_id", self.or_cache, (), expressao["or"])
+        if "ao_menos" in expressao:
+            qtd = int(expressao["ao_menos"]["qtd"])
+            return self.get_composta(AoMenos.__table__, ao_menos_expressoes, "ao_menos_id", self.aomenos_cache, (qtd,), expressao["ao_menos"]["expressoes"])
+        raise ValueError(f"Unknown expression: {expressao}")
+
+
+    def get_composta(self, tabela: Table, associacao: Table, coluna: str, cache: dict, prefixo: tuple, filhos: list[dict]) -> int:
+        """
+        Return the id of the And/Or/AoMenos with these children, creating it when it doesn't exist. The children are a set (the association
+        table has one row per child), kept in the order of their ids, like the expressions loaded by load_grafo.
+        """
+        ids = tuple(sorted({self.get_expressao(filho) for filho in filhos}))
+        key = prefixo + (ids,) if prefixo else ids
+        if key not in cache:
+            cache[key] = self.novo_id(Expressao.__table__)
+            self.add_linha(Expressao.__table__, {"id": cache[key], "type": tabela.name, "assinatura": assinatura((tabela.name,) + prefixo + (list(ids),))}, "expressao")
+            self.add_linha(tabela, {"id": cache[key], "qtd": prefixo[0]} if prefixo else {"id": cache[key]})
+            for filho_id in ids:
+                self.add_linha(associacao, {coluna: cache[key], "expressao_id": filho_id})
+        return cache[key]
+
+
+    def add_doenca(self, doenca: dict) -> None:
+        """
+        Add a disease of the catalog and its diagnosis: {"name", "expressao", "sensibilidade", "especificidade", "acuracia", "paper_link"}.
+        """
+        key = (doenca["name"],)
+        if key not in self.doenca_cache:
+            self.doenca_cache[key] = self.novo_id(Doenca.__table__)
+            self.add_linha(Doenca.__table__, {"id": self.doenca_cache[key], "name": doenca["name"]}, "doenca")
+        if "expressao" not in doenca:
+            return
+
+        key = (self.doenca_cache[key], self.get_expressao(doenca["expressao"]))
+        if key not in self.diagnostico_cache:
+            self.diagnostico_cache[key] = self.novo_id(Diagnostico.__table__)
+            self.add_linha(Diagnostico.__table__, {
+                "id": self.diagnostico_cache[key],
+                "sensibilidade": doenca.get("sensibilidade"),
+                "especificidade": doenca.get("especificidade"),
+                "acuracia": doenca.get("acuracia"),
+                "doenca_id": key[0],
+                "expressao_id": key[1],
+                "paper_link": doenca.get("paper_link"),
+            }, "diagnostico")
+
+
+    def grava(self, session: Session) -> None:
+        """
+        Write the pending rows in the transaction of the session, with one bulk INSERT per table in the order of TABELAS,
+        and increment the versions of the changed entities. The caller commits the session.
+        """
+        for tabela in TABELAS:
+            linhas = self.linhas.pop(tabela, None)
+            if linhas:
+                session.execute(insert(tabela), linhas)
+        if self.entidades:
+            incrementa_versao(session, *sorted(self.entidades))
+        self.entidades = set()
+
+
+
+
+def read_catalogo(caminho: str) -> dict:
+    """
+    Function to read a catalog from a JSON or YAML file (by the extension). PyYAML is only imported when a YAML file is read.
+    The catalog has the optional keys "manifestacoes" (names), "regioes", "exames" and "doencas" (see ImportadorCatalogo).
+    """
+    with open(caminho, encoding="utf-8") as arquivo:
+        if os.path.splitext(caminho)[1].lower() in (".yaml", ".yml"):
+            import yaml
+            return yaml.safe_load(arquivo) or {}
+        return json.load(arquivo)
+
+
+
+
+def importa_catalogos(engine: Engine, catalogos: list[dict], tamanho_lote: int = 1000) -> dict[str, int]:
+    """
+    Function to import the catalogs into the database and return the number of objects created by entity.
+    The existing knowledge base is loaded once, with load_grafo, but the ids are read again in each transaction (see ImportadorCatalogo.reserva_ids). For each catalog, the manifestations, regions and exams are written in one
+    transaction, and then the diseases in transactions of tamanho_lote diseases. Each transaction increments the versions of the changed entities,
+    so the running apps reload the knowledge base. If a transaction fails, the committed ones are kept, and importing the catalog again skips them.
+    """
+    init_versoes(engine)
+    init_assinaturas(engine)
+    with Session(engine) as session:
+        importador = ImportadorCatalogo(load_grafo(session))
+
+    for catalogo in catalogos:
+        with Session(engine) as session:
+            importador.reserva_ids(session)
+            for manifestacao in catalogo.get("manifestacoes", []):
+                importador.get_manifestacao(manifestacao)
+            importador.add_regioes(catalogo.get("regioes", []))
+            importador.add_exames(catalogo.get("exames", []))
+            importador.grava(session)
+            session.commit()
+
+        doencas = catalogo.get("doencas", [])
+        for inicio in range(0, len(doencas), tamanho_lote):
+            with Session(engine) as session:
+                importador.reserva_ids(session)
+                for doenca in doencas[inicio:inicio + tamanho_lote]:
+                    importador.add_doenca(doenca)
+                importador.grava(session)
+                session.commit()
+    return importador.criados
+
+
+
+
+def main(argv: list[str] = None) -> None:
+    """
+    Command-line entry point. Run the script with python src/importer.py catalogo.yaml
+    """
+    parser = argparse.ArgumentParser(description="Import catalogs of diseases, expressions, symptoms, regions and exams from JSON/YAML files.")
+    parser.add_argument("arquivos", nargs="+", help="JSON or YAML files with the catalogs")
+    parser.add_argument("--tamanho-lote", type=int, default=1000, help="Number of diseases written by each transaction (default: 1000)")
+    args = parser.parse_args(argv)
+
+    criados = importa_catalogos(DatabaseConfig().load_engine(), [read_catalogo(caminho) for caminho in args.arquivos], args.tamanho_lote)
+    print(", ".join(f"{quantidade} {entidade}" for entidade, quantidade in criados.items()) + " created.", file=sys.stderr)
+
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+import numpy as np
+from compiler import PlanoAvaliacao
+from inverted_index import IndiceInvertido
+
+
+
+
+class MatrizIncidencia():
+    """
+    Class to represent the sparse incidence matrix of a compiled plan: one row per diagnosis (i.e. per disease) and one column per symptom/result,
+    with a 1 where the expression of the diagnosis references the fact. It's built once per version of the knowledge base, with plain numpy arrays
+    in CSR format (the data is always 1, so only indptr and indices are stored), and in CSC format (its transpose) for the queries by fact.
+    Counts, co-occurrences and "which diseases use this symptom" queries are then vectorized operations over these arrays.
+
+    Attributes:
+        diagnostico_ids (np.ndarray): The diagnosis id of each row, in the order of plano.diagnostico_ids().
+        doenca_ids (np.ndarray): The disease id of each row.
+        fatos_ids (np.ndarray): The symptom/result id of each column, in the order of plano.fatos_ids.
+        indptr (np.ndarray): The CSR row pointers: the columns of row i are indices[indptr[i]:indptr[i + 1]].
+        indices (np.ndarray): The CSR column indexes, sorted in each row.
+        indptr_t (np.ndarray): The CSC column pointers: the rows of column j are indices_t[indptr_t[j]:indptr_t[j + 1]].
+        indices_t (np.ndarray): The CSC row indexes, sorted in each column.
+        linha_por_diagnostico (dict[int, int]): The row of each diagnosis, keyed by the diagnosis id.
+        coluna_por_fato (dict[int, int]): The column of each symptom/result, keyed by the fact id.
+    """
+    def __init__(self, plano: PlanoAvaliacao, indice: IndiceInvertido = None) -> None:
+        """
+        Build the matrix from the facts of each diagnosis of the inverted index (built from the plan when it's not given).
+        """
+        indice = indice if indice is not None else IndiceInvertido(plano)
+        self.diagnostico_ids = np.array(plano.diagnostico_ids(), dtype=np.int64)
+        self.doenca_ids = np.array([plano.doencas[diagnostico_id] for diagnostico_id in self.diagnostico_ids.tolist()], dtype=np.int64)
+        self.fatos_ids = np.array(plano.fatos_ids, dtype=np.int64)
+        self.linha_por_diagnostico = {diagnostico_id: linha for linha, diagnostico_id in enumerate(self.diagnostico_ids.tolist())}
+        self.coluna_por_fato = dict(plano.indice_fatos)
+
+        colunas = [sorted(plano.indice_fatos[fato_id] for fato_id in indice.get_fatos(diagnostico_id)) for diagnostico_id in self.diagnostico_ids.tolist()]
+        self.indptr = np.zeros(len(colunas) + 1, dtype=np.int64)
+        np.cumsum([len(linha) for linha in colunas], out=self.indptr[1:])
+        self.indices = np.fromiter((coluna for linha in colunas for coluna in linha), dtype=np.int32, count=int(self.indptr[-1]))
+
+        # CSC: as entradas ordenadas por coluna (estável, então as linhas continuam em ordem)
+        ordem = np.argsort(self.indices, kind="stable")
+        self.indices_t = np.repeat(np.arange(len(colunas), dtype=np.int32), np.diff(self.indptr))[ordem]
+        self.indptr_t = np.zeros(len(self.fatos_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.indices, minlength=len(self.fatos_ids)), out=self.indptr_t[1:])
+
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        """
+        Return the number of rows (diagnoses) and columns (symptoms/results).
+        """
+        return len(self.diagnostico_ids), len(self.fatos_ids)
+
+
+    def mascara(self, diagnostico_ids) -> np.ndarray:
+        """
+        Return the boolean mask of the rows of the given diagnoses.
+        """
+        mascara = np.zeros(len(self.diagnostico_ids), dtype=bool)
+        linhas = [self.linha_por_diagnostico[diagnostico_id] for diagnostico_id in diagnostico_ids if diagnostico_id in self.linha_por_diagnostico]
+        mascara[linhas] = True
+        return mascara
+
+
+    def linhas(self, fato_id: int) -> np.ndarray:
+        """
+        Return the rows of the diagnoses that reference a fact (a column of the CSC arrays).
+        """
+        coluna = self.coluna_por_fato.get(fato_id)
+        if coluna is None:
+            return np.zeros(0, dtype=np.int32)
+        return self.indices_t[self.indptr_t[coluna]:self.indptr_t[coluna + 1]]
+
+
+    def colunas(self, diagnostico_id: int) -> np.ndarray:
+        """
+        Return the columns of the facts referenced by a diagnosis (a row of the CSR arrays).
+        """
+        linha = self.linha_por_diagnostico.get(diagnostico_id)
+        if linha is None:
+            return np.zeros(0, dtype=np.int32)
+        return self.indices[self.indptr[linha]:self.indptr[linha + 1]]
+
+
+    def get_diagnosticos(self, fato_id: int) -> np.ndarray:
+        """
+        Return the ids of the diagnoses that reference a fact, in the order of the rows.
+        """
+        return self.diagnostico_ids[self.linhas(fato_id)]
+
+
+    def get_doencas(self, fato_id: int) -> np.ndarray:
+        """
+        Return the ids of the diseases that share a fact, without repetition.
+        """
+        return np.unique(self.doenca_ids[self.linhas(fato_id)])
+
+
+    def get_fatos(self, diagnostico_id: int) -> np.ndarray:
+        """
+        Return the ids of the facts referenced by a diagnosis, in the order of the columns.
+        """
+        return self.fatos_ids[self.colunas(diagnostico_id)]
+
+
+    def contagens(self, mascara: np.ndarray = None) -> np.ndarray:
+        """
+        Return the number of diagnoses that reference each fact (the sum of each column), counting only the rows of the mask when it's given.
+        """
+        indices = self.indices if mascara is None else self.indices[np.repeat(mascara, np.diff(self.indptr))]
+        return np.bincount(indices, minlength=len(self.fatos_ids))
+
+
+    def coocorrencias(self, fato_id: int) -> np.ndarray:
+        """
+        Return, for each fact, the number of diagnoses that reference both it and the given fact (a row of the co-occurrence matrix AᵀA).
+        """
+        mascara = np.zeros(len(self.diagnostico_ids), dtype=bool)
+        mascara[self.linhas(fato_id)] = True
+        return self.contagens(mascara)
@@ -0,0 +1,132 @@
+import copy
+import heapq
+from tribool import Tribool
+from kleene import INDETERMINADO, from_tribool, to_tribool
+from compiler import PlanoAvaliacao, OP_FATO
+
+
+
+
+class AvaliacaoIncremental():
+    """
+    Class to keep the evaluation of all diagnoses of a plan up to date while the facts change one at a time.
+    It caches the (result, score) of every node and keeps a reverse index from each symptom/result to the plan nodes that read it.
+    When a fact flips, only the ancestors of its nodes are recomputed, and the propagation stops at the nodes whose value didn't change.
+    It also works as the facts of the plan (it provides get_codigo), so the same semantics of PlanoAvaliacao are kept.
+
+    Attributes:
+        plano (PlanoAvaliacao): The compiled plan being evaluated.
+        fatos (dict[int, int]): The Kleene code of each known fact, keyed by the fact id. Missing facts are indeterminate.
+        pais (list[list[int]]): The indexes of the parents of each node.
+        nos_por_fato (dict[int, list[int]]): The indexes of the leaf nodes of each fact, keyed by the fact id.
+        diagnosticos_por_raiz (dict[int, list[int]]): The ids of the diagnoses of each root node, keyed by the node index.
+        valores (list[tuple[int, float]]): The cached (code, score) of each node.
+    """
+    def __init__(self, plano: PlanoAvaliacao) -> None:
+        """
+        Build the reverse indexes of the plan and evaluate every node once, with all facts indeterminate.
+        """
+        self.plano = plano
+        self.fatos = {}
+        self.pais = [[] for _ in range(len(plano))]
+        self.nos_por_fato = {}
+        self.diagnosticos_por_raiz = {}
+
+        for diagnostico_id, raiz in plano.raizes.items():
+            self.diagnosticos_por_raiz.setdefault(raiz, []).append(diagnostico_id)
+        for no, (op, arg, filhos) in enumerate(zip(plano.ops, plano.args, plano.filhos)):
+            if op == OP_FATO:
+                self.nos_por_fato.setdefault(arg, []).append(no)
+            for filho in filhos:
+                if not self.pais[filho] or self.pais[filho][-1] != no:
+                    self.pais[filho].append(no)
+
+        self.valores = []
+        for no in range(len(plano)):
+            self.valores.append(self._reavalia_no(no))
+
+
+    def copia(self) -> "AvaliacaoIncremental":
+        """
+        Return an independent copy of the evaluation, with its own facts and cached values. The reverse indexes of the plan are static, so they're shared instead of built again.
+        """
+        avaliacao = copy.copy(self)
+        avaliacao.fatos = dict(self.fatos)
+        avaliacao.valores = list(self.valores)
+        return avaliacao
+
+
+    def get_codigo(self, fato_id) -> int:
+        """
+        Get the current Kleene code of a fact by its id, like FatosSintomaResultado.get_codigo.
+        """
+        return self.fatos.get(fato_id, INDETERMINADO)
+
+
+    def _reavalia_no(self, no: int) -> tuple[int, float]:
+        """
+        Recompute a single node from the current facts and the cached values of its children.
+        """
+        if self.plano.ops[no] == OP_FATO:
+            return self.plano.avalia_fato(self.plano.args[no], self)
+        filhos = self.plano.filhos[no]
+        codigos = [self.valores[filho][0] for filho in filhos]
+        scores = [self.valores[filho][1] for filho in filhos]
+        return self.plano.combina(self.plano.ops[no], self.plano.args[no], codigos, scores)
+
+
+    def altera_fato(self, fato_id: int, valor: Tribool) -> set[int]:
+        """
+        Change the value of a fact (Tribool(True), Tribool(False) or Tribool(None)) and recompute only the nodes affected by it.
+        Since the nodes of the plan are in topological order, a min-heap of node indexes visits every affected node after all of its children.
+        Return the ids of the diagnoses whose result or score changed.
+        """
+        codigo = from_tribool(valor)
+        if self.get_codigo(fato_id) == codigo:
+            return set()
+        if codigo == INDETERMINADO:
+            del self.fatos[fato_id]
+        else:
+            self.fatos[fato_id] = codigo
+
+        pendentes = list(self.nos_por_fato.get(fato_id, []))
+        heapq.heapify(pendentes)
+        agendados = set(pendentes)
+        alterados = set()
+
+        while pendentes:
+            no = heapq.heappop(pendentes)
+            valor_no = self._reavalia_no(no)
+            if valor_no == self.valores[no]:
+                continue
+            self.valores[no] = valor_no
+            alterados.add(no)
+            for pai in self.pais[no]:
+                if pai not in agendados:
+                    agendados.add(pai)
+                    heapq.heappush(pendentes, pai)
+
+        return {diagnostico_id for no in alterados for diagnostico_id in self.diagnosticos_por_raiz.get(no, [])}
+
+
+    def sincroniza(self, presentes: set[int], ausentes: set[int]) -> set[int]:
+        """
+        Bring the facts to the given present and absent fact ids, flipping only the facts that changed since the last call.
+        Return the ids of the diagnoses whose result or score changed.
+        """
+        alterados = set()
+        for fato_id in [fato_id for fato_id in self.fatos if fato_id not in presentes and fato_id not in ausentes]:
+            alterados |= self.altera_fato(fato_id, Tribool(None))
+        for fato_id in presentes:
+            alterados |= self.altera_fato(fato_id, Tribool(True))
+        for fato_id in ausentes:
+            if fato_id not in presentes:
+                alterados |= self.altera_fato(fato_id, Tribool(False))
+        return alterados
+
+
+    def avaliacoes(self) -> dict[int, tuple[Tribool, float]]:
+        """
+        Return the cached (result, score) of each diagnosis, keyed by the diagnosis id.
+        """
+        return {diagnostico_id: (to_tribool(self.valores[raiz][0]), self.valores[raiz][1]) for diagnostico_id, raiz in self.plano.raizes.items()}
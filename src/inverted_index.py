@@ -0,0 +1,60 @@
+from compiler import PlanoAvaliacao, OP_FATO
+
+
+
+
+class IndiceInvertido():
+    """
+    Class to represent the inverted index of a compiled plan: which diagnoses and expression nodes reference each symptom/result.
+    It's built once, from the plan, so the "which diseases use this symptom" queries are dictionary lookups instead of walking every expression tree.
+
+    Attributes:
+        diagnosticos_por_fato (dict[int, list[int]]): The ids of the diagnoses that reference each fact, in the order of plano.diagnostico_ids(), keyed by the fact id.
+        nos_por_fato (dict[int, list[int]]): The indexes of the plan nodes whose subexpression references each fact, in topological order, keyed by the fact id.
+        fatos_por_diagnostico (dict[int, frozenset[int]]): The ids of the facts referenced by each diagnosis, keyed by the diagnosis id.
+        diagnosticos_por_doenca (dict[int, list[int]]): The ids of the diagnoses of each disease, keyed by the disease id.
+    """
+    def __init__(self, plano: PlanoAvaliacao) -> None:
+        """
+        Build the index with a single pass over the nodes of the plan, since the children always come before their parents.
+        """
+        fatos_por_no = []
+        self.nos_por_fato = {}
+        for no, (op, arg, filhos) in enumerate(zip(plano.ops, plano.args, plano.filhos)):
+            if op == OP_FATO:
+                fatos_por_no.append(frozenset((arg,)))
+            else:
+                fatos_por_no.append(frozenset().union(*(fatos_por_no[filho] for filho in filhos)))
+            for fato_id in fatos_por_no[no]:
+                self.nos_por_fato.setdefault(fato_id, []).append(no)
+
+        self.diagnosticos_por_fato = {}
+        self.fatos_por_diagnostico = {}
+        self.diagnosticos_por_doenca = {}
+        for diagnostico_id in plano.diagnostico_ids():
+            fatos = fatos_por_no[plano.raizes[diagnostico_id]]
+            self.fatos_por_diagnostico[diagnostico_id] = fatos
+            self.diagnosticos_por_doenca.setdefault(plano.doencas[diagnostico_id], []).append(diagnostico_id)
+            for fato_id in fatos:
+                self.diagnosticos_por_fato.setdefault(fato_id, []).append(diagnostico_id)
+
+
+    def get_diagnosticos(self, fato_id: int) -> list[int]:
+        """
+        Return the ids of the diagnoses that reference a fact.
+        """
+        return self.diagnosticos_por_fato.get(fato_id, [])
+
+
+    def get_nos(self, fato_id: int) -> list[int]:
+        """
+        Return the indexes of the plan nodes whose subexpression references a fact.
+        """
+        return self.nos_por_fato.get(fato_id, [])
+
+
+    def get_fatos(self, diagnostico_id: int) -> frozenset[int]:
+        """
+        Return the ids of the facts referenced by a diagnosis.
+        """
+        return self.fatos_por_diagnostico.get(diagnostico_id, frozenset())
@@ -0,0 +1,89 @@
+from tribool import Tribool
+
+
+
+
+"""
+Integer codes of the three-valued (Kleene) logic used internally by the evaluation code.
+The code of a fact is also its score (1, -1 or 0), as in Sintoma.avalia and Resultado.avalia.
+Tribool objects are only created at the public API boundary, with to_tribool.
+"""
+VERDADEIRO = 1
+FALSO = -1
+INDETERMINADO = 0
+
+
+
+
+"""
+Lookup tables of the Kleene AND/OR operators, indexed by [a + 1][b + 1].
+"""
+TABELA_E = (
+    (FALSO, FALSO, FALSO),
+    (FALSO, INDETERMINADO, INDETERMINADO),
+    (FALSO, INDETERMINADO, VERDADEIRO),
+)
+
+TABELA_OU = (
+    (FALSO, INDETERMINADO, VERDADEIRO),
+    (INDETERMINADO, INDETERMINADO, VERDADEIRO),
+    (VERDADEIRO, VERDADEIRO, VERDADEIRO),
+)
+
+
+
+
+_TRIBOOLS = (Tribool(False), Tribool(None), Tribool(True))
+_CODIGOS = {True: VERDADEIRO, False: FALSO, None: INDETERMINADO}
+
+
+
+
+def e(a: int, b: int) -> int:
+    """
+    Function to compute the Kleene AND of two codes.
+    """
+    return TABELA_E[a + 1][b + 1]
+
+
+
+
+def ou(a: int, b: int) -> int:
+    """
+    Function to compute the Kleene OR of two codes.
+    """
+    return TABELA_OU[a + 1][b + 1]
+
+
+
+
+def ao_menos(qtd: int, total: int, verdadeiros: int, falsos: int) -> int:
+    """
+    Function to compute the threshold operator of AoMenos: True when at least 'qtd' of the 'total' children are True,
+    False when at least one child is False and the remaining ones can't reach 'qtd' anymore, and indeterminate otherwise.
+    """
+    if verdadeiros >= qtd:
+        return VERDADEIRO
+    if falsos > 0 and total - falsos < qtd:
+        return FALSO
+    return INDETERMINADO
+
+
+
+
+def to_tribool(codigo: int) -> Tribool:
+    """
+    Function to convert a code to the Tribool returned by the public API.
+    """
+    return _TRIBOOLS[codigo + 1]
+
+
+
+
+def from_tribool(valor) -> int:
+    """
+    Function to convert a Tribool (or None, for an unknown fact) to its code.
+    """
+    if valor is None:
+        return INDETERMINADO
+    return _CODIGOS[valor.value]
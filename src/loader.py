@@ -0,0 +1,142 @@
+from sqlalchemy import select
+from sqlalchemy.orm import Session, with_polymorphic
+from sqlalchemy.orm.attributes import set_committed_value
+from models import Expressao, And, Or, AoMenos, Sintoma, Resultado, Exame, Manifestacao, RegiaoDoCorpo, RegiaoComposta, Orgao, Doenca, Diagnostico
+from models import and_expressoes, or_expressoes, ao_menos_expressoes, regioes_da_parte
+
+
+
+
+class GrafoConhecimento():
+    """
+    Class to represent the whole knowledge base loaded in memory: every diagnosis with its expression DAG and the metadata of the leaves.
+    All relationships of the objects are already loaded, so they can be used after the session is closed without DetachedInstanceError.
+
+    Attributes:
+        manifestacoes (list[Manifestacao]): All manifestations.
+        regioes (list[RegiaoDoCorpo]): All regions of the body (Orgao and RegiaoComposta).
+        exames (list[Exame]): All exams.
+        expressoes (list[Expressao]): All expressions (And, Or, AoMenos, Sintoma and Resultado).
+        doencas (list[Doenca]): All diseases.
+        diagnosticos (list[Diagnostico]): All diagnoses.
+    """
+    def __init__(self, manifestacoes, regioes, exames, expressoes, doencas, diagnosticos) -> None:
+        """
+        Initialize the knowledge base with the loaded objects.
+        """
+        self.manifestacoes = manifestacoes
+        self.regioes = regioes
+        self.exames = exames
+        self.expressoes = expressoes
+        self.doencas = doencas
+        self.diagnosticos = diagnosticos
+
+
+    @property
+    def sintomas(self) -> list[Sintoma]:
+        """
+        Return all symptoms.
+        """
+        return [expr for expr in self.expressoes if isinstance(expr, Sintoma)]
+
+
+    @property
+    def resultados(self) -> list[Resultado]:
+        """
+        Return all results.
+        """
+        return [expr for expr in self.expressoes if isinstance(expr, Resultado)]
+
+
+    @property
+    def orgaos(self) -> list[Orgao]:
+        """
+        Return all organs.
+        """
+        return [regiao for regiao in self.regioes if isinstance(regiao, Orgao)]
+
+
+
+
+def load_grafo(session: Session) -> GrafoConhecimento:
+    """
+    Function to load the whole knowledge base with a constant number of queries, that doesn't depend on the depth of the expressions.
+    Each table is read once (the subclasses of Expressao and RegiaoDoCorpo with a single polymorphic query each), the association tables are
+    read as plain rows, and the relationships are assembled in memory by liga_grafo, so nothing is lazy loaded later.
+    The children of each And/Or/AoMenos are ordered by id, like the lazy load of the association table by its primary key.
+    """
+    manifestacoes = session.scalars(select(Manifestacao)).all()
+    regioes = session.scalars(select(with_polymorphic(RegiaoDoCorpo, "*"))).all()
+    exames = session.scalars(select(Exame)).all()
+    expressoes = session.scalars(select(with_polymorphic(Expressao, "*"))).all()
+    doencas = session.scalars(select(Doenca)).all()
+    diagnosticos = session.scalars(select(Diagnostico)).all()
+
+    filhos = []
+    for tabela, coluna in ((and_expressoes, "and_id"), (or_expressoes, "or_id"), (ao_menos_expressoes, "ao_menos_id")):
+        filhos += session.execute(select(tabela.c[coluna], tabela.c.expressao_id).order_by(tabela.c[coluna], tabela.c.expressao_id)).all()
+    partes = session.execute(select(regioes_da_parte.c.regiao_composta_id, regioes_da_parte.c.regiao_do_corpo_id).order_by(regioes_da_parte.c.regiao_composta_id, regioes_da_parte.c.regiao_do_corpo_id)).all()
+
+    return liga_grafo(manifestacoes, regioes, exames, expressoes, doencas, diagnosticos, filhos, partes)
+
+
+
+
+def liga_grafo(manifestacoes, regioes, exames, expressoes, doencas, diagnosticos, filhos, partes) -> GrafoConhecimento:
+    """
+    Function to set every relationship of the objects of the knowledge base from their foreign keys and the rows of the association tables,
+    with set_committed_value, as if they had been loaded from the database. It's used by load_grafo and to rebuild a snapshot (see snapshot.py).
+    The children of each And/Or/AoMenos and the parts of each RegiaoComposta keep the order of the (parent id, child id) rows of filhos and partes.
+    """
+    manifestacoes_by_id = {manifestacao.id: manifestacao for manifestacao in manifestacoes}
+    regioes_by_id = {regiao.id: regiao for regiao in regioes}
+    exames_by_id = {exame.id: exame for exame in exames}
+    expressoes_by_id = {expr.id: expr for expr in expressoes}
+    doencas_by_id = {doenca.id: doenca for doenca in doencas}
+
+    # Expressões compostas: filhos e o caminho inverso (and_expr, or_expr e ao_menos_expr)
+    filhos_by_id = {}
+    pais_by_id = {}
+    for pai_id, filho_id in filhos:
+        filhos_by_id.setdefault(pai_id, []).append(expressoes_by_id[filho_id])
+        pais_by_id.setdefault(filho_id, []).append(expressoes_by_id[pai_id])
+    for expr in expressoes:
+        if isinstance(expr, (And, Or, AoMenos)):
+            set_committed_value(expr, "expressoes", filhos_by_id.get(expr.id, []))
+        pais = pais_by_id.get(expr.id, [])
+        for cls, inverso in ((And, "and_expr"), (Or, "or_expr"), (AoMenos, "ao_menos_expr")):
+            set_committed_value(expr, inverso, [pai for pai in pais if isinstance(pai, cls)])
+
+    # Regiões compostas e o caminho inverso (regiao_composta)
+    partes_by_id = {}
+    compostas_by_id = {}
+    for composta_id, regiao_id in partes:
+        partes_by_id.setdefault(composta_id, []).append(regioes_by_id[regiao_id])
+        compostas_by_id.setdefault(regiao_id, []).append(regioes_by_id[composta_id])
+    for regiao in regioes:
+        if isinstance(regiao, RegiaoComposta):
+            set_committed_value(regiao, "regioes", partes_by_id.get(regiao.id, []))
+        set_committed_value(regiao, "regiao_composta", compostas_by_id.get(regiao.id, []))
+
+    # Folhas: manifestação, região e exame
+    resultados_por_exame = {}
+    for expr in expressoes:
+        if isinstance(expr, Sintoma):
+            set_committed_value(expr, "manifestacao", manifestacoes_by_id.get(expr.manifestacao_id))
+            set_committed_value(expr, "regiao_do_corpo", regioes_by_id.get(expr.regiao_do_corpo_id))
+        elif isinstance(expr, Resultado):
+            set_committed_value(expr, "exame", exames_by_id.get(expr.exame_id))
+            resultados_por_exame.setdefault(expr.exame_id, []).append(expr)
+    for exame in exames:
+        set_committed_value(exame, "resultados", resultados_por_exame.get(exame.id, []))
+
+    # Diagnósticos e doenças
+    diagnostico_por_doenca = {}
+    for diag in diagnosticos:
+        set_committed_value(diag, "doenca", doencas_by_id.get(diag.doenca_id))
+        set_committed_value(diag, "expressao", expressoes_by_id.get(diag.expressao_id))
+        diagnostico_por_doenca[diag.doenca_id] = diag
+    for doenca in doencas:
+        set_committed_value(doenca, "diagnostico", diagnostico_por_doenca.get(doenca.id))
+
+    return GrafoConhecimento(manifestacoes, regioes, exames, expressoes, doencas, diagnosticos)
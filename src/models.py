@@ -1,7 +1,9 @@
+import heapq
 from typing import Optional
 from sqlalchemy import ForeignKey, String, Float, Integer, Table, Column
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 from tribool import Tribool
+from kleene import VERDADEIRO, FALSO, INDETERMINADO, e, ou, ao_menos, to_tribool, from_tribool
 
 
 
@@ -10,27 +12,50 @@ class FatosSintomaResultado():
     """
     Class to represent the facts of symptoms and results.
     It works as a 'context' for evaluating the expressions in the interpreter design pattern.
-    It's a dictionary that stores the symptoms and results as keys and their values as Tribool objects (True, False, None).
+    The facts are stored in two bitsets (presentes and ausentes) indexed by the dense id of each symptom/result, so a lookup is O(1)
+    and building the facts only costs the number of selected symptoms and results. Facts in neither bitset are indeterminate (Tribool(None)).
+
+    Attributes:
+        indice (dict[int, int]): The dense index of each symptom/result, keyed by its id (e.g. PlanoAvaliacao.indice_fatos).
+        presentes (int): Bitset with the dense indexes of the present facts.
+        ausentes (int): Bitset with the dense indexes of the absent facts.
     """
-    def __init__(self, sintomas, sintomas_presentes, sintomas_ausentes, resultados, resultados_presentes, resultados_ausentes) -> None:
+    def __init__(self, sintomas, sintomas_presentes, sintomas_ausentes, resultados, resultados_presentes, resultados_ausentes, indice: dict[int, int] = None) -> None:
         """
-        Initialize self.fatos dictionary with present/absent/indeterminate symptoms and results.
+        Initialize the bitsets with the present/absent symptoms and results. A fact that is both present and absent is considered present.
+        When the dense index isn't given, it's built from the lists of all symptoms and results.
         """
-        self.fatos = {}
-        for sintoma in sintomas:
-            if sintoma in sintomas_presentes:
-                self.fatos[sintoma] = Tribool(True)
-            elif sintoma in sintomas_ausentes:
-                self.fatos[sintoma] = Tribool(False)
-            else:
-                self.fatos[sintoma] = Tribool(None)
-        for resultado in resultados:
-            if resultado in resultados_presentes:
-                self.fatos[resultado] = Tribool(True)
-            elif resultado in resultados_ausentes:
-                self.fatos[resultado] = Tribool(False)
-            else:
-                self.fatos[resultado] = Tribool(None)
+        self.sintomas = sintomas
+        self.resultados = resultados
+        if indice is None:
+            indice = {fato.id: i for i, fato in enumerate(list(sintomas) + list(resultados))}
+        self.indice = indice
+
+        self.presentes = self._build_bitset(fato.id for fato in list(sintomas_presentes) + list(resultados_presentes))
+        self.ausentes = self._build_bitset(fato.id for fato in list(sintomas_ausentes) + list(resultados_ausentes)) & ~self.presentes
+
+
+    @classmethod
+    def from_ids(cls, presentes, ausentes, indice: dict[int, int]) -> "FatosSintomaResultado":
+        """
+        Build the facts from the ids of the present and absent symptoms/results, without the ORM objects (e.g. in a worker process).
+        """
+        fatos = cls([], [], [], [], [], [], indice=indice)
+        fatos.presentes = fatos._build_bitset(presentes)
+        fatos.ausentes = fatos._build_bitset(ausentes) & ~fatos.presentes
+        return fatos
+
+
+    def _build_bitset(self, fatos_ids) -> int:
+        """
+        Build a bitset with the dense indexes of the given fact ids. Ids that aren't in the index are ignored.
+        """
+        bitset = 0
+        for fato_id in fatos_ids:
+            i = self.indice.get(fato_id)
+            if i is not None:
+                bitset |= 1 << i
+        return bitset
 
     
     def __getitem__(self, fato) -> Tribool:
@@ -38,7 +63,31 @@ class FatosSintomaResultado():
         Get the value of a fact (sintoma or resultado)
         Without this method defined, it would give an TypeError: 'FatosSintomaResultado' object is not subscriptable.
         """
-        return self.fatos.get(fato)
+        return self.get_by_id(fato.id)
+
+
+    def get_by_id(self, fato_id) -> Tribool:
+        """
+        Get the value of a fact by its id. It's used by the compiled evaluation plans, which don't keep references to the ORM objects.
+        It returns None for ids that aren't in the index, like the old dictionary did for unknown facts.
+        """
+        if fato_id not in self.indice:
+            return None
+        return to_tribool(self.get_codigo(fato_id))
+
+
+    def get_codigo(self, fato_id) -> int:
+        """
+        Get the Kleene code of a fact by its id (VERDADEIRO, FALSO or INDETERMINADO), without creating a Tribool.
+        """
+        i = self.indice.get(fato_id)
+        if i is None:
+            return INDETERMINADO
+        if self.presentes >> i & 1:
+            return VERDADEIRO
+        if self.ausentes >> i & 1:
+            return FALSO
+        return INDETERMINADO
     
     
     def print_fatos(self) -> None:
@@ -46,8 +95,8 @@ class FatosSintomaResultado():
         Print the facts in a readable format.
         """
         print(f"Fatos:")
-        for fato, valor in self.fatos.items():
-            print(f"-> {fato}: {valor}")
+        for fato in list(self.sintomas) + list(self.resultados):
+            print(f"-> {fato}: {self[fato]}")
 
 
 
@@ -104,18 +153,19 @@ class AvaliaNode():
         Build an HTML string representation of the evaluation tree.
         The level parameter is used to indent the tree structure.
         """
+        codigo = from_tribool(self.result)
         if level == 0:
-            if self.result is Tribool(True):
+            if codigo == VERDADEIRO:
                 string = f"<span style='background-color:green;'>{self.expressao} ({self.result}) ({self.score:.2f})</span>"
-            elif self.result is Tribool(False):
+            elif codigo == FALSO:
                 string = f"<span style='background-color:red;'>{self.expressao} ({self.result}) ({self.score:.2f})</span>"
             else:
                 string = f"{self.expressao} ({self.result}) ({self.score:.2f})"
         else:
             indent = "&nbsp;" * 12 * level
-            if self.result is Tribool(True):
+            if codigo == VERDADEIRO:
                 string = f"<br>{indent}<span style='background-color:green;'>{self.expressao} ({self.result}) ({self.score:.2f})</span>"
-            elif self.result is Tribool(False):
+            elif codigo == FALSO:
                 string = f"<br>{indent}<span style='background-color:red;'>{self.expressao} ({self.result}) ({self.score:.2f})</span>"
             else:
                 string = f"<br>{indent}{self.expressao} ({self.result}) ({self.score:.2f})"
@@ -172,11 +222,13 @@ class Expressao(Base):
     Attributes:
         id (int): The unique identifier for the expression.
         type (str): The type of the expression (discriminator column).
+        assinatura (str): The structural hash of the expression (see chave_estrutural and hashcons.py), indexed to find an equal expression before inserting a new one.
         ao_menos_expr (list[AoMenos]): List of AoMenos expressions associated with this expression.
     """
     __tablename__ = "expressao"
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     type: Mapped[str] = mapped_column(String(255))
+    assinatura: Mapped[Optional[str]] = mapped_column(String(64), index=True)
 
     ao_menos_expr: Mapped[list["AoMenos"]] = relationship("AoMenos", secondary=ao_menos_expressoes, back_populates="expressoes")
     or_expr: Mapped[list["Or"]] = relationship("Or", secondary=or_expressoes, back_populates="expressoes")
@@ -198,6 +250,29 @@ class Expressao(Base):
         raise NotImplementedError("Subclass must implement this method")
     
 
+    def avalia_resultado(self, fatos: FatosSintomaResultado) -> tuple[Tribool, float]:
+        """
+        Evaluate the expression using the provided facts, returning only the result and the score.
+        It has the same semantics of avalia, but doesn't build the evaluation tree, so it's used when nobody will look at the AvaliaNode.
+
+        Parameters:
+            fatos (FatosSintomaResultado): The facts to be used for evaluation.
+        """
+        codigo, score = self.avalia_codigo(fatos)
+        return to_tribool(codigo), score
+
+
+    def avalia_codigo(self, fatos: FatosSintomaResultado) -> tuple[int, float]:
+        """
+        Evaluate the expression like avalia_resultado, but returning the Kleene code of the result (see kleene.py) instead of a Tribool.
+        It's the kernel used internally by avalia_resultado, so no Tribool is created while walking the tree.
+
+        Parameters:
+            fatos (FatosSintomaResultado): The facts to be used for evaluation. They must provide a get_codigo(fato_id) method.
+        """
+        raise NotImplementedError("Subclass must implement this method")
+
+
     def contem(self, fato) -> bool:
         """
         Check if the expression contains the given fact (sintoma or resultado).
@@ -206,6 +281,15 @@ class Expressao(Base):
             fato: The fact to be checked.
         """
         raise NotImplementedError("Subclass must implement this method")
+
+
+    def chave_estrutural(self) -> tuple:
+        """
+        Return the canonical key of the structure of the expression: its type and the ids of its children (sorted, since the children are a set)
+        or of its manifestation/region/exam. Two expressions with the same key are equal, so only one of them needs to be stored.
+        The children must already have ids.
+        """
+        raise NotImplementedError("Subclass must implement this method")
     
 
     def __repr__(self) -> str:
@@ -254,28 +338,45 @@ class And(Expressao):
         avalia_node = AvaliaNode()
         avalia_node.instance = self
         avalia_node.expressao = self.__class__.__name__
-        results = []
+        codigo = VERDADEIRO
         scores = []
 
         for expr in self.expressoes:
             expr_result, expr_avalia_node = expr.avalia(fatos)
             avalia_node.children.append(expr_avalia_node)
             scores.append(expr_avalia_node.score)
-            results.append(expr_result)
+            codigo = e(codigo, from_tribool(expr_result))
 
-        if any(result is Tribool(False) for result in results):
-            avalia_node.result = Tribool(False)
+        if codigo == FALSO:
             avalia_node.score = -1
-        elif all(result is Tribool(True) for result in results):
-            avalia_node.result = Tribool(True)
+        elif codigo == VERDADEIRO:
             avalia_node.score = 1
         else:
-            avalia_node.result = Tribool(None)
             avalia_node.score = sum(scores) / len(scores)
+        avalia_node.result = to_tribool(codigo)
 
         return avalia_node.result, avalia_node
     
     
+    def avalia_codigo(self, fatos: FatosSintomaResultado) -> tuple[int, float]:
+        """
+        Evaluate the AND expression without building the evaluation tree. It stops at the first False child, since the score is -1 no matter the other children.
+        """
+        codigo = VERDADEIRO
+        scores = []
+
+        for expr in self.expressoes:
+            expr_codigo, expr_score = expr.avalia_codigo(fatos)
+            codigo = e(codigo, expr_codigo)
+            if codigo == FALSO:
+                return FALSO, -1
+            scores.append(expr_score)
+
+        if codigo == VERDADEIRO:
+            return VERDADEIRO, 1
+        return INDETERMINADO, sum(scores) / len(scores)
+    
+    
     def contem(self, fato) -> bool:
         """
         Check if the AND expression contains the given fact (sintoma or resultado).
@@ -285,13 +386,20 @@ class And(Expressao):
                 return True
         return False
 
+
+    def chave_estrutural(self) -> tuple:
+        """
+        Return the canonical key of the AND expression: ("and", sorted ids of the children).
+        """
+        return ("and", sorted({expr.id for expr in self.expressoes}))
+
     
 
     def __repr__(self) -> str:
         """
         Return a string representation of the AND expression.
         """
-        ands = " & ".join([expr for expr in self.expressoes])
+        ands = " & ".join([repr(expr) for expr in self.expressoes])
         return f"{self.__class__.__name__}({ands})"
 
 
@@ -334,28 +442,45 @@ class Or(Expressao):
         avalia_node = AvaliaNode()
         avalia_node.instance = self
         avalia_node.expressao = self.__class__.__name__
-        results = []
+        codigo = FALSO
         scores = []
 
         for expr in self.expressoes:
             expr_result, expr_avalia_node = expr.avalia(fatos)
             avalia_node.children.append(expr_avalia_node)
             scores.append(expr_avalia_node.score)
-            results.append(expr_result)
+            codigo = ou(codigo, from_tribool(expr_result))
 
-        if any(result is Tribool(True) for result in results):
-            avalia_node.result = Tribool(True)
+        if codigo == VERDADEIRO:
             avalia_node.score = 1
-        elif all(result is Tribool(False) for result in results):
-            avalia_node.result = Tribool(False)
+        elif codigo == FALSO:
             avalia_node.score = -1
         else:
-            avalia_node.result = Tribool(None)
             avalia_node.score = max(scores)
+        avalia_node.result = to_tribool(codigo)
 
         return avalia_node.result, avalia_node
     
     
+    def avalia_codigo(self, fatos: FatosSintomaResultado) -> tuple[int, float]:
+        """
+        Evaluate the OR expression without building the evaluation tree. It stops at the first True child, since the score is 1 no matter the other children.
+        """
+        codigo = FALSO
+        scores = []
+
+        for expr in self.expressoes:
+            expr_codigo, expr_score = expr.avalia_codigo(fatos)
+            codigo = ou(codigo, expr_codigo)
+            if codigo == VERDADEIRO:
+                return VERDADEIRO, 1
+            scores.append(expr_score)
+
+        if codigo == FALSO:
+            return FALSO, -1
+        return INDETERMINADO, max(scores)
+    
+    
     def contem(self, fato) -> bool:
         """
         Check if the OR expression contains the given fact (sintoma or resultado).
@@ -365,11 +490,18 @@ class Or(Expressao):
                 return True
         return False
 
+
+    def chave_estrutural(self) -> tuple:
+        """
+        Return the canonical key of the OR expression: ("or", sorted ids of the children).
+        """
+        return ("or", sorted({expr.id for expr in self.expressoes}))
+
     def __repr__(self) -> str:
         """
         Return a string representation of the OR expression.
         """
-        ors = " | ".join([expr for expr in self.expressoes])
+        ors = " | ".join([repr(expr) for expr in self.expressoes])
         return f"{self.__class__.__name__}({ors})"
 
 
@@ -408,40 +540,89 @@ class AoMenos(Expressao):
         """
         Evaluate the AoMenos expression using the provided facts. It serves as the interpret method in the interpreter design pattern.
         It returns a tuple with the result (if the AoMenos is True, False or Indeterminate) and an AvaliaNode object that represents the evaluation tree.
+        The score is the average of the 'qtd' largest children scores, kept in a min-heap while the children are evaluated, so it's O(n log qtd).
         """
         avalia_node = AvaliaNode()
         avalia_node.instance = self
         avalia_node.expressao = f"{self.__class__.__name__}({self.qtd})"
-        count_qtd = self.qtd
+        count_true = 0
         count_false = 0
-        scores = []
-        n_largests = []
+        maiores = []
+        codigo = INDETERMINADO
 
         for exp in self.expressoes:
             result, exp_avalia_node = exp.avalia(fatos)
+            codigo = from_tribool(result)
             avalia_node.children.append(exp_avalia_node)
-            scores.append(exp_avalia_node.score)
-            n_largests = sorted(scores, reverse=True)[:self.qtd]
-            avalia_node.score = sum(n_largests) / self.qtd
+            self._add_score(maiores, exp_avalia_node.score)
 
-            if result is Tribool(True):
-                count_qtd -= 1
-                if count_qtd == 0:
+            if codigo == VERDADEIRO:
+                count_true += 1
+                if count_true == self.qtd:
                     avalia_node.result = result
-                    avalia_node.score = 1
 
-            if result is Tribool(False):
+            if codigo == FALSO:
                 count_false += 1
                 if len(self.expressoes) - count_false < self.qtd:
                     avalia_node.result = result
-                    avalia_node.score = -1 # To prevent a false AoMenos 2 to be equal 0 (cause it would be (1 + -1) / len(self.qtd) = 0)
+
+        if self.expressoes:
+            if from_tribool(avalia_node.result) == VERDADEIRO:
+                avalia_node.score = 1
+            elif avalia_node.result is not None and codigo == FALSO:
+                avalia_node.score = -1 # To prevent a false AoMenos 2 to be equal 0 (cause it would be (1 + -1) / len(self.qtd) = 0)
+            else:
+                avalia_node.score = sum(sorted(maiores, reverse=True)) / self.qtd
 
         if avalia_node.result is None:
-            return Tribool(None), avalia_node
+            return to_tribool(INDETERMINADO), avalia_node
         else:
             return avalia_node.result, avalia_node
     
     
+    def avalia_codigo(self, fatos: FatosSintomaResultado) -> tuple[int, float]:
+        """
+        Evaluate the AoMenos expression without building the evaluation tree.
+        It stops as soon as 'qtd' children are True, since the score is 1 from then on. A False AoMenos can't stop early,
+        because its score depends on the remaining children (it's only -1 when the last child is False).
+        Only the 'qtd' largest scores are kept, in a min-heap, so wide nodes (e.g. 3 of 400 variants) stay near-linear.
+        """
+        if not self.expressoes:
+            return INDETERMINADO, None
+
+        count_true = 0
+        count_false = 0
+        maiores = []
+        codigo = INDETERMINADO
+
+        for exp in self.expressoes:
+            codigo, score = exp.avalia_codigo(fatos)
+            self._add_score(maiores, score)
+
+            if codigo == VERDADEIRO:
+                count_true += 1
+                if count_true == self.qtd:
+                    return VERDADEIRO, 1
+
+            if codigo == FALSO:
+                count_false += 1
+
+        score = sum(sorted(maiores, reverse=True)) / self.qtd
+        if ao_menos(self.qtd, len(self.expressoes), count_true, count_false) == FALSO:
+            return FALSO, -1 if codigo == FALSO else score
+        return INDETERMINADO, score
+
+
+    def _add_score(self, maiores: list[float], score: float) -> None:
+        """
+        Add a child score to the min-heap with the 'qtd' largest scores seen so far.
+        """
+        if len(maiores) < self.qtd:
+            heapq.heappush(maiores, score)
+        elif maiores and score > maiores[0]:
+            heapq.heapreplace(maiores, score)
+    
+    
     def contem(self, fato) -> bool:
         """
         Check if the AoMenos expression contains the given fact (sintoma or resultado).
@@ -449,6 +630,13 @@ class AoMenos(Expressao):
         return any(expr.contem(fato) for expr in self.expressoes)
 
 
+    def chave_estrutural(self) -> tuple:
+        """
+        Return the canonical key of the AoMenos expression: ("ao_menos", qtd, sorted ids of the children), like the aomenos_cache of StreamlitQueries.
+        """
+        return ("ao_menos", self.qtd, sorted({expr.id for expr in self.expressoes}))
+
+
     def __repr__(self) -> str:
         """
         Return a string representation of the AoMenos expression.
@@ -634,22 +822,32 @@ class Sintoma(Expressao):
         avalia_node.expressao = self
         result = fatos[self]
         avalia_node.result = result
-
-        if result is Tribool(True):
-            score = 1
-        elif result is Tribool(False):
-            score = -1
-        else:
-            score = 0
-        avalia_node.score = score
+        avalia_node.score = from_tribool(result)
         return result, avalia_node
 
         
+    def avalia_codigo(self, fatos) -> tuple[int, float]:
+        """
+        Evaluate the symptom without building the evaluation tree. The code of a fact is also its score.
+        """
+        codigo = fatos.get_codigo(self.id)
+        return codigo, codigo
+
+        
     def contem(self, fato) -> bool:
         """
         Check if the symptom contains the given fact (sintoma or resultado).
         """
         return self == fato
+
+
+    def chave_estrutural(self) -> tuple:
+        """
+        Return the canonical key of the symptom: ("sintoma", manifestation id, region id), like the sintoma_cache of StreamlitQueries.
+        """
+        manifestacao_id = self.manifestacao.id if self.manifestacao is not None else self.manifestacao_id
+        regiao_id = self.regiao_do_corpo.id if self.regiao_do_corpo is not None else self.regiao_do_corpo_id
+        return ("sintoma", manifestacao_id, regiao_id)
         
     def __hash__(self) -> int:
         """
@@ -745,22 +943,30 @@ class Resultado(Expressao):
         avalia_node.expressao = self
         result = fatos[self]
         avalia_node.result = result
-
-        if result is Tribool(True):
-            score = 1
-        elif result is Tribool(False):
-            score = -1
-        else:
-            score = 0
-        avalia_node.score = score
+        avalia_node.score = from_tribool(result)
         return result, avalia_node
 
         
+    def avalia_codigo(self, fatos) -> tuple[int, float]:
+        """
+        Evaluate the result without building the evaluation tree. The code of a fact is also its score.
+        """
+        codigo = fatos.get_codigo(self.id)
+        return codigo, codigo
+
+        
     def contem(self, fato) -> bool:
         """
         Check if the result contains the given fact (sintoma or resultado).
         """
         return self == fato
+
+
+    def chave_estrutural(self) -> tuple:
+        """
+        Return the canonical key of the result: ("resultado", name, exam id), like the resultado_cache of StreamlitQueries.
+        """
+        return ("resultado", self.name, self.exame.id if self.exame is not None else self.exame_id)
     
         
     def __hash__(self) -> int:
@@ -843,4 +1049,28 @@ class Diagnostico(Base):
         """
         Return a string representation of the diagnosis.
         """
-        return f"{self.__class__.__name__}({self.doenca}, {self.expressao})"
\ No newline at end of file
+        return f"{self.__class__.__name__}({self.doenca}, {self.expressao})"
+    
+
+
+
+class VersaoBase(Base):
+    """
+    Class to represent the version of the knowledge base or of one of its entities (see versioning.py).
+    The row of the whole knowledge base ('base') is incremented on every write, and the row of each changed entity receives the new version,
+    so the caches can be keyed by the versions of the entities they read.
+
+    Attributes:
+        entidade (str): The name of the entity (e.g. 'sintoma', 'doenca'), or 'base' for the whole knowledge base.
+        versao (int): The version of the knowledge base when the entity last changed.
+    """
+    __tablename__ = "versao_base"
+    entidade: Mapped[str] = mapped_column(String(255), primary_key=True)
+    versao: Mapped[int] = mapped_column(Integer, default=0)
+
+
+    def __repr__(self) -> str:
+        """
+        Return a string representation of the version.
+        """
+        return f"{self.__class__.__name__}({self.entidade}, {self.versao})"
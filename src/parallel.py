@@ -0,0 +1,144 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, Future
+import numpy as np
+from tribool import Tribool
+from models import FatosSintomaResultado
+from compiler import PlanoAvaliacao
+from batch import codifica_casos, avalia_lote
+from kleene import to_tribool
+
+
+
+
+"""
+Plan used by the worker processes. It's set once per process, by init_worker, so the knowledge base isn't sent with every task.
+"""
+_plano = None
+
+
+
+
+def init_worker(plano: PlanoAvaliacao) -> None:
+    """
+    Function to initialize a worker process with the compiled plan. It's the initializer of the process pool.
+    """
+    global _plano
+    _plano = plano
+
+
+
+
+def avalia_diagnosticos(diagnostico_ids: list[int], presentes: list[int], ausentes: list[int]) -> list[tuple[int, float]]:
+    """
+    Function to evaluate some diagnoses of a single case with the plan of the current process.
+    The memo is shared by the diagnoses of the shard, so their common nodes are evaluated only once.
+    It returns the (code, score) of each diagnosis, in the given order.
+    """
+    fatos = FatosSintomaResultado.from_ids(presentes, ausentes, _plano.indice_fatos)
+    memo = {}
+    return [_plano.avalia_no(_plano.raizes[diagnostico_id], fatos, memo) for diagnostico_id in diagnostico_ids]
+
+
+
+
+def avalia_casos(casos: list[tuple[list[int], list[int]]]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Function to evaluate a block of cases (presentes, ausentes) with the plan of the current process.
+    It returns the N x D matrices of results and scores of batch.avalia_lote.
+    """
+    return avalia_lote(_plano, codifica_casos(_plano, casos))
+
+
+
+
+def avalia_fatos(fatos: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Function to evaluate a block of an N x F matrix of facts with the plan of the current process.
+    """
+    return avalia_lote(_plano, fatos)
+
+
+
+
+class ExecutorParalelo():
+    """
+    Class to evaluate the compiled plan in a pool of worker processes, so a big request uses all cores.
+    Each worker receives the plan once, when it starts, and keeps it for all tasks.
+    A single case is sharded by disease, and a batch of cases is sharded by chunks of cases.
+    The results are always merged in the order of plano.diagnostico_ids() and of the cases, so they don't depend on which worker finishes first.
+
+    Attributes:
+        plano (PlanoAvaliacao): The compiled plan evaluated by the workers.
+        workers (int): The number of worker processes.
+        executor (ProcessPoolExecutor): The pool of worker processes.
+    """
+    def __init__(self, plano: PlanoAvaliacao, workers: int = None) -> None:
+        """
+        Start the pool of worker processes. By default it uses one worker per CPU.
+        """
+        self.plano = plano
+        self.workers = workers or os.cpu_count() or 1
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker, initargs=(plano,))
+
+
+    def __enter__(self) -> "ExecutorParalelo":
+        """
+        Use the executor as a context manager, so the workers are stopped at the end of the block.
+        """
+        return self
+
+
+    def __exit__(self, *args) -> None:
+        """
+        Stop the worker processes at the end of the with block.
+        """
+        self.shutdown()
+
+
+    def shutdown(self) -> None:
+        """
+        Stop the worker processes.
+        """
+        self.executor.shutdown()
+
+
+    def avalia(self, presentes: list[int], ausentes: list[int]) -> dict[int, tuple[Tribool, float]]:
+        """
+        Evaluate all diagnoses of a single case, given the ids of the present and absent symptoms/results.
+        The diagnoses are split in one contiguous shard per worker. Return the (result, score) of each diagnosis, keyed by the diagnosis id.
+        """
+        diagnostico_ids = self.plano.diagnostico_ids()
+        tamanho = -(-len(diagnostico_ids) // self.workers) or 1
+        shards = [diagnostico_ids[inicio:inicio + tamanho] for inicio in range(0, len(diagnostico_ids), tamanho)]
+        presentes, ausentes = list(presentes), list(ausentes)
+
+        futures = [self.executor.submit(avalia_diagnosticos, shard, presentes, ausentes) for shard in shards]
+        avaliacoes = {}
+        for shard, future in zip(shards, futures):
+            for diagnostico_id, (codigo, score) in zip(shard, future.result()):
+                avaliacoes[diagnostico_id] = (to_tribool(codigo), score)
+        return avaliacoes
+
+
+    def avalia_lote(self, fatos: np.ndarray, tamanho_bloco: int = 10000) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Evaluate all diagnoses for an N x F matrix of facts, like batch.avalia_lote, with the cases split in chunks of tamanho_bloco rows.
+        """
+        fatos = np.asarray(fatos, dtype=np.int8)
+        if fatos.ndim != 2 or fatos.shape[1] != len(self.plano.fatos_ids):
+            raise ValueError(f"Expected an N x {len(self.plano.fatos_ids)} matrix of facts, got shape {fatos.shape}")
+        if fatos.shape[0] == 0:
+            return avalia_lote(self.plano, fatos)
+
+        tamanho_bloco = min(tamanho_bloco, -(-fatos.shape[0] // self.workers))
+        blocos = [fatos[inicio:inicio + tamanho_bloco] for inicio in range(0, fatos.shape[0], tamanho_bloco)]
+        avaliados = list(self.executor.map(avalia_fatos, blocos))
+        return np.concatenate([resultados for resultados, _ in avaliados]), np.concatenate([scores for _, scores in avaliados])
+
+
+    def submit_casos(self, casos: list[tuple[list[int], list[int]]]) -> Future:
+        """
+        Submit a block of cases (presentes, ausentes) to the pool. The future returns the N x D matrices of results and scores.
+        It's used by the callers that stream the cases and need to bound the number of blocks in flight (e.g. bulk_diagnosis.py).
+        """
+        return self.executor.submit(avalia_casos, casos)
@@ -0,0 +1,87 @@
+import heapq
+import math
+from tribool import Tribool
+from compiler import PlanoAvaliacao
+from inverted_index import IndiceInvertido
+from incidence import MatrizIncidencia
+from incremental import AvaliacaoIncremental
+from kleene import FALSO
+
+
+
+
+class SeletorPerguntas():
+    """
+    Class to choose the next best question (which unknown symptom or result to ask about) for the current facts.
+    The diagnoses that aren't False yet are the possible ones, and the uncertainty is the entropy of a uniform distribution over them.
+    Asking about a fact splits the possible diagnoses in the ones that remain possible if it's present and the ones that remain possible if it's absent.
+    The expected information gain of the question is the entropy now minus the expected entropy after the answer.
+    Each answer is simulated on an incremental evaluation (see incremental.py) and then undone, so only the ancestors of the fact are evaluated again.
+    The incremental evaluation with all facts unknown is built once, and each call works on a copy of it, so its reverse indexes aren't built again.
+
+    Attributes:
+        plano (PlanoAvaliacao): The compiled plan of the diagnoses.
+        indice (IndiceInvertido): The index of the diagnoses that reference each fact.
+        incidencia (MatrizIncidencia): The incidence matrix of the diagnoses and facts, used to count the possible diagnoses that reference each fact.
+        avaliacao (AvaliacaoIncremental): The incremental evaluation of the plan with all facts unknown. It's never changed, only copied.
+    """
+    def __init__(self, plano: PlanoAvaliacao, indice: IndiceInvertido, incidencia: MatrizIncidencia = None) -> None:
+        """
+        Initialize the selector with the plan, its inverted index and its incidence matrix (built from them when it's not given).
+        """
+        self.plano = plano
+        self.indice = indice
+        self.incidencia = incidencia if incidencia is not None else MatrizIncidencia(plano, indice)
+        self.avaliacao = AvaliacaoIncremental(plano)
+
+
+    def possiveis(self, avaliacao: AvaliacaoIncremental) -> set[int]:
+        """
+        Return the ids of the diagnoses that aren't False in the incremental evaluation.
+        """
+        return {diagnostico_id for diagnostico_id, raiz in self.plano.raizes.items() if avaliacao.valores[raiz][0] != FALSO}
+
+
+    def ganho(self, fato_id: int, avaliacao: AvaliacaoIncremental, possiveis: set[int]) -> float:
+        """
+        Return the expected information gain, in bits, of asking about an unknown fact of the incremental evaluation.
+        The probability of each answer is proportional to the number of diagnoses that remain possible with it.
+        """
+        if not any(diagnostico_id in possiveis for diagnostico_id in self.indice.get_diagnosticos(fato_id)):
+            return 0.0
+
+        restantes = []
+        for resposta in (Tribool(True), Tribool(False)):
+            alterados = avaliacao.altera_fato(fato_id, resposta)
+            descartados = sum(1 for diagnostico_id in alterados if diagnostico_id in possiveis and avaliacao.valores[self.plano.raizes[diagnostico_id]][0] == FALSO)
+            avaliacao.altera_fato(fato_id, Tribool(None))
+            restantes.append(len(possiveis) - descartados)
+
+        total = sum(restantes)
+        entropia_esperada = sum(n / total * math.log2(n) for n in restantes if n > 0)
+        return math.log2(len(possiveis)) - entropia_esperada
+
+
+    def melhores(self, presentes, ausentes, candidatos, k: int = 1) -> list[tuple[int, float]]:
+        """
+        Return the (fact id, gain) of the k candidate facts with the highest expected information gain, ignoring the facts already known.
+        Ties are broken by the number of possible diagnoses that reference the fact (the old 'most common' criterion), and then by the order of the candidates.
+        """
+        presentes = set(presentes)
+        ausentes = set(ausentes) - presentes
+        avaliacao = self.avaliacao.copia()
+        avaliacao.sincroniza(presentes, ausentes)
+        possiveis = self.possiveis(avaliacao)
+        frequencias = self.incidencia.contagens(self.incidencia.mascara(possiveis))
+
+        chaves = []
+        for posicao, fato_id in enumerate(candidatos):
+            if fato_id in presentes or fato_id in ausentes:
+                continue
+            coluna = self.incidencia.coluna_por_fato.get(fato_id)
+            frequencia = int(frequencias[coluna]) if coluna is not None else 0
+            # Um fato que nenhum diagnóstico possível usa não tem ganho
+            ganho = self.ganho(fato_id, avaliacao, possiveis) if frequencia else 0.0
+            chaves.append((ganho, frequencia, -posicao, fato_id))
+
+        return [(fato_id, ganho) for ganho, _, _, fato_id in heapq.nlargest(k, chaves)]
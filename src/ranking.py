@@ -0,0 +1,88 @@
+import heapq
+from tribool import Tribool
+from models import FatosSintomaResultado
+from compiler import PlanoAvaliacao
+from inverted_index import IndiceInvertido
+from kleene import to_tribool
+
+
+
+
+class RankingDiagnosticos():
+    """
+    Class to rank the diagnoses of a plan by score and return only the top K, without evaluating the diagnoses that can't enter it.
+    The score of a diagnosis never decreases when an unknown fact becomes present, and never increases when it becomes absent
+    (True > Indeterminate > False at every node). So, for the current facts:
+    - A diagnosis that doesn't reference any known fact has exactly its baseline score (the score with all facts unknown).
+    - A diagnosis that only references absent facts can't score more than its baseline.
+    - A diagnosis that references a present fact can score up to 1.
+    The diagnoses are evaluated in decreasing order of their upper bound, and the evaluation stops when the next bound is lower
+    than the K-th best exact score found so far. The order is the same of sorting all diagnoses by score (stable, in plano.diagnostico_ids() order).
+
+    Attributes:
+        plano (PlanoAvaliacao): The compiled plan of the diagnoses.
+        posicoes (dict[int, int]): The position of each diagnosis in plano.diagnostico_ids(), used to break ties.
+        base (dict[int, tuple[int, float]]): The (code, score) of each diagnosis with all facts unknown, keyed by the diagnosis id.
+        indice (IndiceInvertido): The index of the diagnoses that reference each fact.
+    """
+    def __init__(self, plano: PlanoAvaliacao, indice: IndiceInvertido = None) -> None:
+        """
+        Evaluate the baseline of every diagnosis. The inverted index of the plan is built when it isn't given.
+        """
+        self.plano = plano
+        self.posicoes = {diagnostico_id: posicao for posicao, diagnostico_id in enumerate(plano.diagnostico_ids())}
+        valores = plano.avalia_nos(FatosSintomaResultado.from_ids([], [], plano.indice_fatos))
+        self.base = {diagnostico_id: valores[raiz] for diagnostico_id, raiz in plano.raizes.items()}
+        self.indice = indice if indice is not None else IndiceInvertido(plano)
+
+
+    def limites(self, presentes, ausentes) -> dict[int, float]:
+        """
+        Return the upper bound of the score of each diagnosis for the given fact ids. Only the diagnoses that reference a known fact are returned,
+        since the others have exactly their baseline score.
+        """
+        limites = {}
+        for fato_id in ausentes:
+            for diagnostico_id in self.indice.get_diagnosticos(fato_id):
+                limites[diagnostico_id] = self.base[diagnostico_id][1]
+        for fato_id in presentes:
+            for diagnostico_id in self.indice.get_diagnosticos(fato_id):
+                limites[diagnostico_id] = 1
+        return limites
+
+
+    def top_k(self, presentes, ausentes, k: int) -> list[tuple[int, Tribool, float]]:
+        """
+        Return the (diagnosis id, result, score) of the k diagnoses with the highest scores for the given present and absent fact ids.
+        A fact in both sets is considered present. Diagnoses without score (an empty AoMenos) come last.
+        """
+        presentes = set(presentes)
+        ausentes = set(ausentes) - presentes
+        limites = self.limites(presentes, ausentes)
+        valores = {diagnostico_id: valor for diagnostico_id, valor in self.base.items() if diagnostico_id not in limites}
+
+        # Min-heap com os k maiores scores exatos encontrados até agora
+        maiores = heapq.nlargest(k, (self._chave(diagnostico_id, score) for diagnostico_id, (_, score) in valores.items()))
+        heapq.heapify(maiores)
+
+        fatos = FatosSintomaResultado.from_ids(presentes, ausentes, self.plano.indice_fatos)
+        memo = {}
+        for diagnostico_id in sorted(limites, key=lambda diagnostico_id: self._chave(diagnostico_id, limites[diagnostico_id]), reverse=True):
+            if len(maiores) == k and self._chave(diagnostico_id, limites[diagnostico_id]) < maiores[0]:
+                break
+            valores[diagnostico_id] = self.plano.avalia_no(self.plano.raizes[diagnostico_id], fatos, memo)
+            chave = self._chave(diagnostico_id, valores[diagnostico_id][1])
+            if len(maiores) < k:
+                heapq.heappush(maiores, chave)
+            elif chave > maiores[0]:
+                heapq.heapreplace(maiores, chave)
+
+        ranking = sorted(maiores, reverse=True)
+        return [(diagnostico_id, to_tribool(valores[diagnostico_id][0]), valores[diagnostico_id][1]) for _, _, diagnostico_id in ranking]
+
+
+    def _chave(self, diagnostico_id: int, score: float) -> tuple[float, int, int]:
+        """
+        Return the sort key of a diagnosis: the highest scores first and, between equal scores, the first diagnoses of the plan.
+        """
+        return (score if score is not None else float("-inf"), -self.posicoes[diagnostico_id], diagnostico_id)
@@ -0,0 +1,108 @@
+from models import RegiaoDoCorpo, RegiaoComposta, Sintoma
+
+
+
+
+class FechoRegioes():
+    """
+    Class to represent the transitive closure of the hierarchy of regions of the body (the regioes_da_parte table): the composite regions
+    that contain each region, directly or not (e.g. Tronco ⊃ Tórax ⊃ Peito ⊃ Pulmão). It's computed once per version of the knowledge base,
+    so an ancestor check is a set lookup instead of walking the relationships of the regions.
+    A region can be part of more than one composite region, so the ancestors are kept as sets instead of intervals of a tree.
+
+    Attributes:
+        ancestrais (dict[int, frozenset[int]]): The ids of the composite regions that contain each region, keyed by the region id.
+    """
+    def __init__(self, regioes: list[RegiaoDoCorpo]) -> None:
+        """
+        Build the closure from all regions loaded in memory (e.g. GrafoConhecimento.regioes).
+        The ancestors of a region already closed are reused, so each region is visited about once. Cycles don't stop it, but a region isn't its own ancestor.
+        """
+        pais = {regiao.id: [] for regiao in regioes}
+        for regiao in regioes:
+            if isinstance(regiao, RegiaoComposta):
+                for parte in regiao.regioes:
+                    pais.setdefault(parte.id, []).append(regiao.id)
+
+        self.ancestrais = {}
+        for regiao_id in pais:
+            ancestrais = set()
+            pilha = list(pais[regiao_id])
+            while pilha:
+                pai_id = pilha.pop()
+                if pai_id in ancestrais:
+                    continue
+                ancestrais.add(pai_id)
+                if pai_id in self.ancestrais:
+                    ancestrais |= self.ancestrais[pai_id]
+                else:
+                    pilha.extend(pais[pai_id])
+            ancestrais.discard(regiao_id)
+            self.ancestrais[regiao_id] = frozenset(ancestrais)
+
+
+    def get_ancestrais(self, regiao_id: int) -> frozenset[int]:
+        """
+        Return the ids of the composite regions that contain a region.
+        """
+        return self.ancestrais.get(regiao_id, frozenset())
+
+
+    def contem(self, regiao_id: int, parte_id: int) -> bool:
+        """
+        Check if a region is the same or contains another one, in O(1).
+        """
+        return regiao_id == parte_id or regiao_id in self.ancestrais.get(parte_id, ())
+
+
+
+
+class SubsuncaoSintomas():
+    """
+    Class to represent the subsumption of the symptoms by the hierarchy of regions: a symptom is more general than another one
+    when both have the same manifestation and its region contains the region of the other (e.g. "Dor no Tronco" is more general than "Dor no Abdome").
+    A symptom without a region is more general than every symptom of its manifestation.
+    In the subsumption mode, a present symptom is evidence for its more general symptoms, and an absent symptom rules out its more specific ones.
+
+    Attributes:
+        fecho (FechoRegioes): The closure of the hierarchy of regions.
+        generalizacoes (dict[int, list[int]]): The ids of the more general symptoms of each symptom, keyed by the symptom id.
+        especializacoes (dict[int, list[int]]): The ids of the more specific symptoms of each symptom, keyed by the symptom id.
+    """
+    def __init__(self, sintomas: list[Sintoma], fecho: FechoRegioes) -> None:
+        """
+        Build the maps of the symptoms with the closure of the regions. Only the ancestors of the region of each symptom are looked up,
+        so it doesn't compare every pair of symptoms of a manifestation.
+        """
+        self.fecho = fecho
+        por_manifestacao = {}
+        for sintoma in sintomas:
+            manifestacao_id = sintoma.manifestacao.id if sintoma.manifestacao else None
+            regiao_id = sintoma.regiao_do_corpo.id if sintoma.regiao_do_corpo else None
+            por_manifestacao.setdefault(manifestacao_id, {})[regiao_id] = sintoma.id
+
+        self.generalizacoes = {}
+        self.especializacoes = {}
+        for sintomas_por_regiao in por_manifestacao.values():
+            for regiao_id, sintoma_id in sintomas_por_regiao.items():
+                if regiao_id is None:
+                    continue
+                gerais = [sintomas_por_regiao[ancestral_id] for ancestral_id in fecho.get_ancestrais(regiao_id) if ancestral_id in sintomas_por_regiao]
+                if None in sintomas_por_regiao:
+                    gerais.append(sintomas_por_regiao[None])
+                if gerais:
+                    self.generalizacoes[sintoma_id] = sorted(gerais)
+                for geral_id in gerais:
+                    self.especializacoes.setdefault(geral_id, []).append(sintoma_id)
+
+
+    def expande(self, presentes, ausentes) -> tuple[set[int], set[int]]:
+        """
+        Return the ids of the present and absent facts with the ones implied by the hierarchy of regions.
+        The ids of the results and of the symptoms without a more general/specific one are kept as they are. A fact that is both present and absent is considered present.
+        """
+        presentes = set(presentes)
+        ausentes = set(ausentes)
+        presentes |= {geral_id for fato_id in presentes for geral_id in self.generalizacoes.get(fato_id, ())}
+        ausentes |= {especifico_id for fato_id in ausentes for especifico_id in self.especializacoes.get(fato_id, ())}
+        return presentes, ausentes - presentes
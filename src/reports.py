@@ -0,0 +1,232 @@
+import argparse
+import os
+import sys
+import numpy as np
+import pandas as pd
+from sqlalchemy.orm import Session
+from db_config import DatabaseConfig
+from loader import GrafoConhecimento, load_grafo
+from compiler import compile_grafo
+from snapshot import get_snapshot_dir, carrega_snapshot
+from inverted_index import IndiceInvertido
+from incidence import MatrizIncidencia
+from models import Sintoma
+
+
+
+
+"""
+Names of the reports of Relatorios, used by the command-line tool to export them.
+"""
+RELATORIOS = ("sintoma_doencas", "resultado_doencas", "doenca_sintomas", "doenca_sintomas_resultados", "doenca_diagnostico")
+
+
+"""
+Formats of the exported reports, keyed by the extension of the file.
+"""
+FORMATOS = {".parquet": "parquet", ".arrow": "arrow", ".feather": "arrow"}
+
+
+
+
+def nome_sintoma(sintoma: Sintoma, separador: str = "no(a)") -> str:
+    """
+    Function to get the name of a symptom shown in the reports: the manifestation and, when there's one, the region of the body.
+    """
+    if sintoma.regiao_do_corpo is None:
+        return f"{sintoma.manifestacao.name}"
+    return f"{sintoma.manifestacao.name} {separador} {sintoma.regiao_do_corpo.name}"
+
+
+
+
+class Relatorios():
+    """
+    Class to build the reports of the knowledge base shown by the app (see the st_write functions of StreamlitQueries) and exported by this script.
+    Each report is built in a single pass over the incidence matrix, with the values of each column collected in lists and a single DataFrame built at the end,
+    instead of growing the DataFrame one row at a time.
+
+    Attributes:
+        grafo (GrafoConhecimento): The knowledge base loaded in memory.
+        indice (IndiceInvertido): The inverted index of the compiled plan, used to get the diagnoses of each disease.
+        incidencia (MatrizIncidencia): The incidence matrix of the compiled plan.
+        nomes_doencas (np.ndarray): The name of the disease of each row of the incidence matrix.
+    """
+    def __init__(self, grafo: GrafoConhecimento, incidencia: MatrizIncidencia, indice: IndiceInvertido) -> None:
+        """
+        Initialize the reports with the knowledge base and the structures already built from its plan.
+        """
+        self.grafo = grafo
+        self.indice = indice
+        self.incidencia = incidencia
+        nomes = {doenca.id: doenca.name for doenca in grafo.doencas}
+        self.nomes_doencas = np.array([nomes.get(doenca_id) for doenca_id in incidencia.doenca_ids.tolist()], dtype=object)
+
+
+    def _doencas_por_fato(self, fatos: list) -> tuple[list[list[str]], list[int]]:
+        """
+        Return the sorted names of the diseases of the diagnoses that reference each fact (a column of the matrix) and their count.
+        """
+        doencas, contagens = [], []
+        for fato in fatos:
+            linhas = self.incidencia.linhas(fato.id)
+            doencas.append(sorted(self.nomes_doencas[linhas].tolist()))
+            contagens.append(len(linhas))
+        return doencas, contagens
+
+
+    def _fatos_por_doenca(self, rotulos: dict[int, str]) -> list[list[str]]:
+        """
+        Return the sorted labels of the facts in rotulos referenced by each disease (a row of the matrix), in the order of grafo.doencas.
+        When the disease has more than one diagnosis, the last one is used, like in get_sintomas_by_doenca.
+        """
+        rotulo_por_coluna = np.array([rotulos.get(fato_id) for fato_id in self.incidencia.fatos_ids.tolist()], dtype=object)
+        fatos = []
+        for doenca in self.grafo.doencas:
+            diagnosticos = self.indice.diagnosticos_por_doenca.get(doenca.id)
+            colunas = self.incidencia.colunas(diagnosticos[-1]) if diagnosticos else []
+            fatos.append(sorted(rotulo for rotulo in rotulo_por_coluna[colunas].tolist() if rotulo is not None))
+        return fatos
+
+
+    def sintoma_doencas(self) -> pd.DataFrame:
+        """
+        Return the report of the diseases associated with each symptom, sorted by their count.
+        """
+        sintomas = self.grafo.sintomas
+        doencas, contagens = self._doencas_por_fato(sintomas)
+        df = pd.DataFrame({
+            "Sintoma": [nome_sintoma(sintoma) for sintoma in sintomas],
+            "Doenças": doencas,
+            "Count": contagens,
+        })
+        return df.sort_values(by="Count", ascending=False, kind="stable")
+
+
+    def resultado_doencas(self) -> pd.DataFrame:
+        """
+        Return the report of the diseases associated with each result, sorted by their count.
+        """
+        resultados = self.grafo.resultados
+        doencas, contagens = self._doencas_por_fato(resultados)
+        df = pd.DataFrame({
+            "Resultado": [f"{resultado.name}" for resultado in resultados],
+            "Doenças": doencas,
+            "Count": contagens,
+        })
+        return df.sort_values(by="Count", ascending=False, kind="stable")
+
+
+    def doenca_sintomas(self) -> pd.DataFrame:
+        """
+        Return the report of the symptoms of each disease.
+        """
+        return pd.DataFrame({
+            "Doença": [doenca.name for doenca in self.grafo.doencas],
+            "Sintomas": self._fatos_por_doenca({sintoma.id: nome_sintoma(sintoma, "no (a)") for sintoma in self.grafo.sintomas}),
+        })
+
+
+    def doenca_sintomas_resultados(self) -> pd.DataFrame:
+        """
+        Return the report of the symptoms and results of each disease.
+        """
+        return pd.DataFrame({
+            "Doença": [doenca.name for doenca in self.grafo.doencas],
+            "Sintomas": self._fatos_por_doenca({sintoma.id: nome_sintoma(sintoma, "no (a)") for sintoma in self.grafo.sintomas}),
+            "Resultados": self._fatos_por_doenca({resultado.id: resultado.name for resultado in self.grafo.resultados}),
+        })
+
+
+    def doenca_diagnostico(self) -> pd.DataFrame:
+        """
+        Return the report of the diagnosis of each disease (the first one, when it has more than one), with its expression as text.
+        The diseases without a diagnosis are also listed, with empty values.
+        """
+        diagnosticos_by_id = {diagnostico.id: diagnostico for diagnostico in self.grafo.diagnosticos}
+        colunas = {"Doença": [], "Diagnostico": [], "Especificidade": [], "Sensibilidade": [], "Acurácia": []}
+        for doenca in self.grafo.doencas:
+            diagnosticos = self.indice.diagnosticos_por_doenca.get(doenca.id)
+            diagnostico = diagnosticos_by_id[diagnosticos[0]] if diagnosticos else None
+            colunas["Doença"].append(doenca.name)
+            colunas["Diagnostico"].append(repr(diagnostico.expressao) if diagnostico else None)
+            colunas["Especificidade"].append(diagnostico.especificidade if diagnostico else None)
+            colunas["Sensibilidade"].append(diagnostico.sensibilidade if diagnostico else None)
+            colunas["Acurácia"].append(diagnostico.acuracia if diagnostico else None)
+        return pd.DataFrame(colunas).astype({"Especificidade": float, "Sensibilidade": float, "Acurácia": float})
+
+
+    def get(self, nome: str) -> pd.DataFrame:
+        """
+        Return a report by its name (see RELATORIOS).
+        """
+        if nome not in RELATORIOS:
+            raise ValueError(f"Unknown report: {nome}")
+        return getattr(self, nome)()
+
+
+
+
+def get_formato(caminho: str, formato: str = None) -> str:
+    """
+    Function to get the format of a report file: the given one or, when it's not given, the one of its extension.
+    """
+    if formato is None:
+        formato = FORMATOS.get(os.path.splitext(caminho)[1].lower())
+    if formato not in FORMATOS.values():
+        raise ValueError(f"Unknown format of {caminho}: use one of {sorted(set(FORMATOS.values()))}")
+    return formato
+
+
+
+
+def exporta_relatorio(df: pd.DataFrame, caminho: str, formato: str = None) -> None:
+    """
+    Function to write a report to a Parquet file or to an Arrow IPC file (the Feather V2 format), for downstream analytics.
+    The list columns (e.g. Doenças) are written as Arrow lists of strings. pyarrow is only imported when a report is exported.
+    """
+    import pyarrow as pa
+    formato = get_formato(caminho, formato)
+    tabela = pa.Table.from_pandas(df, preserve_index=False)
+    if formato == "parquet":
+        import pyarrow.parquet as pq
+        pq.write_table(tabela, caminho)
+    else:
+        with pa.OSFile(caminho, "wb") as arquivo, pa.ipc.new_file(arquivo, tabela.schema) as writer:
+            writer.write_table(tabela)
+
+
+
+
+def main(argv: list[str] = None) -> None:
+    """
+    Command-line entry point. Run the script with python src/reports.py relatorios/ --formato parquet
+    """
+    parser = argparse.ArgumentParser(description="Export the reports of the knowledge base to Parquet or Arrow files, one file per report.")
+    parser.add_argument("diretorio", help="Directory where the reports are written")
+    parser.add_argument("--formato", choices=("parquet", "arrow"), default="parquet", help="Format of the files (default: parquet)")
+    parser.add_argument("--relatorio", action="append", choices=RELATORIOS, help="Report to export, can be repeated (default: all)")
+    parser.add_argument("--snapshot", default=get_snapshot_dir(), help="Snapshot directory to load the knowledge base from, instead of the database (default: $DISEASEDX_SNAPSHOT)")
+    args = parser.parse_args(argv)
+
+    if args.snapshot:
+        grafo, plano = carrega_snapshot(args.snapshot)
+    else:
+        with Session(DatabaseConfig().load_engine()) as session:
+            grafo = load_grafo(session)
+        plano = compile_grafo(grafo)
+    indice = IndiceInvertido(plano)
+    relatorios = Relatorios(grafo, MatrizIncidencia(plano, indice), indice)
+
+    os.makedirs(args.diretorio, exist_ok=True)
+    extensao = ".parquet" if args.formato == "parquet" else ".arrow"
+    for nome in args.relatorio or RELATORIOS:
+        df = relatorios.get(nome)
+        exporta_relatorio(df, os.path.join(args.diretorio, nome + extensao), args.formato)
+        print(f"{nome}: {len(df)} rows", file=sys.stderr)
+
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+import unicodedata
+from functools import lru_cache
+import numpy as np
+
+
+
+
+"""
+Size of the n-grams of the index. The words of the query with at least this size are matched anywhere in the words of the labels, the shorter ones only at their start.
+"""
+TAMANHO_NGRAMA = 3
+
+
+"""
+Translation table to remove the combining diacritical marks (the accents of a decomposed text).
+"""
+SEM_ACENTOS = dict.fromkeys(range(0x0300, 0x0370))
+
+
+
+
+def normaliza(texto: str) -> str:
+    """
+    Function to normalize a label or query for the search: without accents (e.g. "Édema" -> "edema", "Úlcera" -> "ulcera"), in lower case and with single spaces.
+    """
+    if not texto.isascii():
+        texto = unicodedata.normalize("NFKD", texto).translate(SEM_ACENTOS)
+    return " ".join(texto.casefold().split())
+
+
+
+
+class IndiceBusca():
+    """
+    Class to represent the search-as-you-type index of the labels of the symptoms or results, built once per version of the knowledge base.
+    The labels are normalized (see normaliza) and sorted when the index is built. The distinct words of the labels are indexed by their n-grams
+    and by their prefixes shorter than the n-grams, and each word maps to the positions of the labels that have it, so a query only checks
+    the words that have all its n-grams, and the labels are the ones that have a matching word for every word of the query.
+    The results are ranked (the whole label, then the start of the label, then the start of the words, then anywhere in the label) and paginated.
+
+    Attributes:
+        ids (list[int]): The id of each label, in alphabetical order of the normalized labels.
+        rotulos (list[str]): The labels, in the same order.
+        normalizados (list[str]): The normalized labels, in the same order.
+        rotulo_por_id (dict[int, str]): The label of each id.
+        palavras (list[str]): The distinct words of the normalized labels.
+        posicoes_por_palavra (list[np.ndarray]): The positions of the labels that have each word, in order.
+        ngramas (dict[str, np.ndarray]): The indexes of the words that have each n-gram.
+        prefixos (dict[str, np.ndarray]): The indexes of the words that start with each prefix shorter than the n-grams.
+    """
+    def __init__(self, rotulos: dict[int, str]) -> None:
+        """
+        Build the index from the label of each id.
+        """
+        normalizados = {fato_id: normaliza(rotulo) for fato_id, rotulo in rotulos.items()}
+        self.ids = sorted(rotulos, key=lambda fato_id: (normalizados[fato_id], fato_id))
+        self.rotulos = [rotulos[fato_id] for fato_id in self.ids]
+        self.normalizados = [normalizados[fato_id] for fato_id in self.ids]
+        self.rotulo_por_id = dict(rotulos)
+
+        posicoes_por_palavra = {}
+        for posicao, normalizado in enumerate(self.normalizados):
+            for palavra in dict.fromkeys(normalizado.split()):
+                posicoes_por_palavra.setdefault(palavra, []).append(posicao)
+        self.palavras = list(posicoes_por_palavra)
+        self.posicoes_por_palavra = [np.array(posicoes, dtype=np.int32) for posicoes in posicoes_por_palavra.values()]
+
+        ngramas, prefixos = {}, {}
+        for indice, palavra in enumerate(self.palavras):
+            for ngrama in dict.fromkeys(palavra[i:i + TAMANHO_NGRAMA] for i in range(len(palavra) - TAMANHO_NGRAMA + 1)):
+                ngramas.setdefault(ngrama, []).append(indice)
+            for tamanho in range(1, min(len(palavra), TAMANHO_NGRAMA - 1) + 1):
+                prefixos.setdefault(palavra[:tamanho], []).append(indice)
+        self.ngramas = {ngrama: np.array(indices, dtype=np.int32) for ngrama, indices in ngramas.items()}
+        self.prefixos = {prefixo: np.array(indices, dtype=np.int32) for prefixo, indices in prefixos.items()}
+        self._ordena = lru_cache(maxsize=256)(self._ordena)
+
+
+    def __len__(self) -> int:
+        """
+        Return the number of labels of the index.
+        """
+        return len(self.ids)
+
+
+    def _posicoes(self, palavra: str) -> np.ndarray:
+        """
+        Return the positions of the labels with a word that has the given word (or that starts with it, when it's shorter than the n-grams), in order.
+        """
+        if len(palavra) < TAMANHO_NGRAMA:
+            indices = self.prefixos.get(palavra, np.zeros(0, dtype=np.int32))
+        else:
+            listas = [self.ngramas.get(palavra[i:i + TAMANHO_NGRAMA]) for i in range(len(palavra) - TAMANHO_NGRAMA + 1)]
+            if any(lista is None for lista in listas):
+                return np.zeros(0, dtype=np.int32)
+            listas.sort(key=len)
+            indices = listas[0]
+            for lista in listas[1:]:
+                indices = np.intersect1d(indices, lista, assume_unique=True)
+            # Os n-gramas podem estar em qualquer ordem na palavra, então a palavra ainda é conferida
+            indices = [indice for indice in indices.tolist() if palavra in self.palavras[indice]]
+        if len(indices) == 0:
+            return np.zeros(0, dtype=np.int32)
+        return np.unique(np.concatenate([self.posicoes_por_palavra[indice] for indice in indices]))
+
+
+    def _ordena(self, consulta: str) -> tuple[int, ...]:
+        """
+        Return the positions of all labels that match a normalized query, ranked. It's cached, so the next pages of a query don't search again.
+        """
+        palavras = consulta.split()
+        if not palavras:
+            return tuple(range(len(self.ids)))
+
+        candidatos = None
+        for palavra in sorted(set(palavras), key=len, reverse=True):
+            posicoes = self._posicoes(palavra)
+            candidatos = posicoes if candidatos is None else np.intersect1d(candidatos, posicoes, assume_unique=True)
+            if len(candidatos) == 0:
+                return ()
+
+        classificados = []
+        for posicao in candidatos.tolist():
+            normalizado = self.normalizados[posicao]
+            if normalizado == consulta:
+                classe = 0
+            elif normalizado.startswith(consulta):
+                classe = 1
+            elif all(any(palavra_rotulo.startswith(palavra) for palavra_rotulo in normalizado.split()) for palavra in palavras):
+                classe = 2
+            else:
+                classe = 3
+            classificados.append((classe, posicao))
+        classificados.sort()
+        return tuple(posicao for _, posicao in classificados)
+
+
+    def busca(self, consulta: str, pagina: int = 0, tamanho: int = 50) -> tuple[list[int], int]:
+        """
+        Return the ids of a page of the labels that match the query, ranked, and the total number of labels that match it.
+        An empty query matches all labels, in alphabetical order.
+        """
+        posicoes = self._ordena(normaliza(consulta))
+        inicio = pagina * tamanho
+        return [self.ids[posicao] for posicao in posicoes[inicio:inicio + tamanho]], len(posicoes)
+
+
+    def get_rotulo(self, fato_id: int) -> str:
+        """
+        Return the label of an id.
+        """
+        return self.rotulo_por_id[fato_id]
@@ -0,0 +1,264 @@
+import os
+import sys
+import json
+import argparse
+import numpy as np
+from sqlalchemy.orm import Session
+from db_config import DatabaseConfig
+from models import Expressao, And, Or, AoMenos, Sintoma, Resultado, Exame, Manifestacao, RegiaoDoCorpo, RegiaoComposta, Orgao, Doenca, Diagnostico
+from compiler import PlanoAvaliacao, compile_grafo
+from loader import GrafoConhecimento, load_grafo, liga_grafo
+from versioning import BASE, ENTIDADES, init_versoes, load_versoes
+
+
+
+
+"""
+Version of the snapshot format and name of the environment variable with the directory of the snapshot used by the app (read-only mode).
+"""
+VERSAO = 1
+SNAPSHOT_ENV = "DISEASEDX_SNAPSHOT"
+
+
+
+
+"""
+Type codes of the regions and expressions stored in the snapshot, in the order of their polymorphic identities.
+"""
+TIPOS_REGIAO = (RegiaoDoCorpo, Orgao, RegiaoComposta)
+TIPOS_EXPRESSAO = (Sintoma, Resultado, And, Or, AoMenos)
+
+
+
+
+def get_snapshot_dir() -> str:
+    """
+    Function to get the directory of the snapshot set in the DISEASEDX_SNAPSHOT environment variable, or None when the app uses the database.
+    """
+    return os.getenv(SNAPSHOT_ENV) or None
+
+
+
+
+def exporta_snapshot(grafo: GrafoConhecimento, plano: PlanoAvaliacao, diretorio: str, versoes: dict[str, int] = None) -> None:
+    """
+    Function to write the knowledge base and its compiled plan to a directory, as one .npy file per array and a meta.json with the names.
+    The relationships are stored as arrays of ids (edges), in the order of the ORM collections, so the AoMenos children keep their order.
+    The plan is stored as CSR arrays (the children of node i are filhos[filhos_ptr[i]:filhos_ptr[i + 1]]), so it isn't compiled again on load.
+    The versions of the knowledge base (see versioning.py) are kept in meta.json, so the caches of an app running from the snapshot use the same keys.
+    """
+    os.makedirs(diretorio, exist_ok=True)
+    expressoes = grafo.expressoes
+    regioes = grafo.regioes
+
+    arrays = {
+        "manifestacoes_ids": [manifestacao.id for manifestacao in grafo.manifestacoes],
+        "regioes_ids": [regiao.id for regiao in regioes],
+        "regioes_tipos": [TIPOS_REGIAO.index(type(regiao)) for regiao in regioes],
+        "regioes_partes": [(regiao.id, parte.id) for regiao in regioes if isinstance(regiao, RegiaoComposta) for parte in regiao.regioes],
+        "exames_ids": [exame.id for exame in grafo.exames],
+        "expressoes_ids": [expr.id for expr in expressoes],
+        "expressoes_tipos": [TIPOS_EXPRESSAO.index(type(expr)) for expr in expressoes],
+        "expressoes_args": [_arg_expressao(expr) for expr in expressoes],
+        "expressoes_regioes": [expr.regiao_do_corpo_id if isinstance(expr, Sintoma) and expr.regiao_do_corpo_id is not None else -1 for expr in expressoes],
+        "expressoes_filhos": [(expr.id, filho.id) for expr in expressoes if isinstance(expr, (And, Or, AoMenos)) for filho in expr.expressoes],
+        "doencas_ids": [doenca.id for doenca in grafo.doencas],
+        "diagnosticos": [(diag.id, diag.doenca_id, diag.expressao_id) for diag in grafo.diagnosticos],
+        "diagnosticos_metricas": np.array([(diag.sensibilidade, diag.especificidade, diag.acuracia) for diag in grafo.diagnosticos], dtype=np.float64).reshape(-1, 3),
+        "plano_ops": np.array(plano.ops, dtype=np.int8),
+        "plano_args": plano.args,
+        "plano_filhos_ptr": np.cumsum([0] + [len(filhos) for filhos in plano.filhos]),
+        "plano_filhos": [filho for filhos in plano.filhos for filho in filhos],
+        "plano_expressao_ids": [expressao_id if expressao_id is not None else -1 for expressao_id in plano.expressao_ids],
+        "plano_raizes": list(plano.raizes.items()),
+        "plano_fatos_ids": plano.fatos_ids,
+    }
+    for nome, valores in arrays.items():
+        array = np.asarray(valores, dtype=np.int64) if not isinstance(valores, np.ndarray) else valores
+        if nome in ("regioes_partes", "expressoes_filhos", "diagnosticos", "plano_raizes") and array.size == 0:
+            array = array.reshape(0, 3 if nome == "diagnosticos" else 2)
+        np.save(os.path.join(diretorio, f"{nome}.npy"), array)
+
+    meta = {
+        "versao": VERSAO,
+        "versoes": versoes or {},
+        "manifestacoes": [manifestacao.name for manifestacao in grafo.manifestacoes],
+        "regioes": [regiao.name for regiao in regioes],
+        "exames": [[exame.name, exame.preco] for exame in grafo.exames],
+        "resultados": {str(expr.id): expr.name for expr in expressoes if isinstance(expr, Resultado)},
+        "doencas": [doenca.name for doenca in grafo.doencas],
+        "diagnosticos_links": [diag.paper_link for diag in grafo.diagnosticos],
+        "plano_labels": plano.labels,
+        "plano_nomes_doencas": {str(doenca_id): nome for doenca_id, nome in plano.nomes_doencas.items()},
+    }
+    with open(os.path.join(diretorio, "meta.json"), "w", encoding="utf-8") as arquivo:
+        json.dump(meta, arquivo, ensure_ascii=False)
+
+
+
+
+def _arg_expressao(expr: Expressao) -> int:
+    """
+    Function to get the integer argument of an expression in the snapshot: the manifestation of a symptom, the exam of a result and the qtd of an AoMenos.
+    """
+    if isinstance(expr, Sintoma):
+        return expr.manifestacao_id
+    if isinstance(expr, Resultado):
+        return expr.exame_id
+    if isinstance(expr, AoMenos):
+        return expr.qtd
+    return 0
+
+
+
+
+def _load_arrays(diretorio: str) -> tuple[dict[str, np.ndarray], dict]:
+    """
+    Function to open the arrays of a snapshot as read-only memory maps, and read its meta.json.
+    """
+    with open(os.path.join(diretorio, "meta.json"), encoding="utf-8") as arquivo:
+        meta = json.load(arquivo)
+    if meta.get("versao") != VERSAO:
+        raise ValueError(f"Unsupported snapshot version: {meta.get('versao')} (expected {VERSAO})")
+
+    arrays = {}
+    for nome in os.listdir(diretorio):
+        if nome.endswith(".npy"):
+            arrays[nome[:-4]] = np.load(os.path.join(diretorio, nome), mmap_mode="r")
+    return arrays, meta
+
+
+
+
+def carrega_versoes(diretorio: str) -> dict[str, int]:
+    """
+    Function to get the versions of the knowledge base and of each entity when the snapshot was exported. Missing versions are 0.
+    """
+    _, meta = _load_arrays(diretorio)
+    versoes = dict.fromkeys((BASE,) + ENTIDADES, 0)
+    versoes.update(meta.get("versoes", {}))
+    return versoes
+
+
+
+
+def carrega_plano(diretorio: str) -> PlanoAvaliacao:
+    """
+    Function to rebuild the compiled plan of a snapshot, without the ORM objects and without the database.
+    It's what the evaluation workers need (e.g. bulk_diagnosis.py --snapshot).
+    """
+    arrays, meta = _load_arrays(diretorio)
+    return _build_plano(arrays, meta)
+
+
+
+
+def _build_plano(arrays: dict[str, np.ndarray], meta: dict) -> PlanoAvaliacao:
+    """
+    Function to rebuild a plan from the arrays of a snapshot. The nodes are appended in their original order, so the indexes don't change.
+    """
+    plano = PlanoAvaliacao()
+    for fato_id in arrays["plano_fatos_ids"].tolist():
+        plano.add_fato(fato_id)
+
+    ptr = arrays["plano_filhos_ptr"].tolist()
+    filhos = arrays["plano_filhos"].tolist()
+    for no, (op, arg, expressao_id, label) in enumerate(zip(arrays["plano_ops"].tolist(), arrays["plano_args"].tolist(), arrays["plano_expressao_ids"].tolist(), meta["plano_labels"])):
+        plano.add_no(op, arg, tuple(filhos[ptr[no]:ptr[no + 1]]), expressao_id if expressao_id >= 0 else None, label)
+
+    doencas = {diag_id: doenca_id for diag_id, doenca_id, _ in arrays["diagnosticos"].tolist()}
+    for diagnostico_id, raiz in arrays["plano_raizes"].tolist():
+        plano.raizes[diagnostico_id] = raiz
+        plano.doencas[diagnostico_id] = doencas[diagnostico_id]
+    plano.nomes_doencas = {int(doenca_id): nome for doenca_id, nome in meta["plano_nomes_doencas"].items()}
+    return plano
+
+
+
+
+def carrega_grafo(diretorio: str) -> GrafoConhecimento:
+    """
+    Function to rebuild the knowledge base of a snapshot as transient ORM objects (they don't belong to any session), without the database.
+    The objects are created with their columns only, and their relationships are set by loader.liga_grafo, like the ones loaded from the database.
+    """
+    arrays, meta = _load_arrays(diretorio)
+    return _build_grafo(arrays, meta)
+
+
+
+
+def _build_grafo(arrays: dict[str, np.ndarray], meta: dict) -> GrafoConhecimento:
+    """
+    Function to rebuild the transient ORM objects from the arrays of a snapshot.
+    """
+    manifestacoes = [Manifestacao(id=manifestacao_id, name=nome) for manifestacao_id, nome in zip(arrays["manifestacoes_ids"].tolist(), meta["manifestacoes"])]
+
+    regioes = []
+    for regiao_id, tipo, nome in zip(arrays["regioes_ids"].tolist(), arrays["regioes_tipos"].tolist(), meta["regioes"]):
+        cls = TIPOS_REGIAO[tipo]
+        regiao = cls(nome, []) if cls is RegiaoComposta else cls(name=nome)
+        regiao.id = regiao_id
+        regioes.append(regiao)
+
+    exames = [Exame(id=exame_id, name=nome, preco=preco) for exame_id, (nome, preco) in zip(arrays["exames_ids"].tolist(), meta["exames"])]
+
+    expressoes = []
+    for expr_id, tipo, arg, regiao_id in zip(arrays["expressoes_ids"].tolist(), arrays["expressoes_tipos"].tolist(), arrays["expressoes_args"].tolist(), arrays["expressoes_regioes"].tolist()):
+        cls = TIPOS_EXPRESSAO[tipo]
+        if cls is Sintoma:
+            expr = Sintoma(None)
+            expr.manifestacao_id = arg
+            expr.regiao_do_corpo_id = regiao_id if regiao_id >= 0 else None
+        elif cls is Resultado:
+            expr = Resultado(meta["resultados"][str(expr_id)], None)
+            expr.exame_id = arg
+        elif cls is AoMenos:
+            expr = AoMenos(arg, [])
+        else:
+            expr = cls([])
+        expr.id = expr_id
+        expressoes.append(expr)
+
+    doencas = [Doenca(id=doenca_id, name=nome) for doenca_id, nome in zip(arrays["doencas_ids"].tolist(), meta["doencas"])]
+    diagnosticos = []
+    for (diag_id, doenca_id, expr_id), metricas, link in zip(arrays["diagnosticos"].tolist(), arrays["diagnosticos_metricas"].tolist(), meta["diagnosticos_links"]):
+        sensibilidade, especificidade, acuracia = (None if np.isnan(valor) else valor for valor in metricas)
+        diagnosticos.append(Diagnostico(id=diag_id, doenca_id=doenca_id, expressao_id=expr_id, sensibilidade=sensibilidade, especificidade=especificidade, acuracia=acuracia, paper_link=link))
+
+    return liga_grafo(manifestacoes, regioes, exames, expressoes, doencas, diagnosticos, arrays["expressoes_filhos"].tolist(), arrays["regioes_partes"].tolist())
+
+
+
+
+def carrega_snapshot(diretorio: str) -> tuple[GrafoConhecimento, PlanoAvaliacao]:
+    """
+    Function to load both the knowledge base and the compiled plan of a snapshot.
+    """
+    arrays, meta = _load_arrays(diretorio)
+    return _build_grafo(arrays, meta), _build_plano(arrays, meta)
+
+
+
+
+def main(argv: list[str] = None) -> None:
+    """
+    Command-line entry point. Run the script with python src/snapshot.py snapshot/ to export the knowledge base of the database.
+    """
+    parser = argparse.ArgumentParser(description="Export the knowledge base of the database to a snapshot directory.")
+    parser.add_argument("diretorio", help="Directory where the snapshot is written")
+    args = parser.parse_args(argv)
+
+    engine = DatabaseConfig().load_engine()
+    init_versoes(engine)
+    with Session(engine) as session:
+        versoes = load_versoes(session)
+        grafo = load_grafo(session)
+    plano = compile_grafo(grafo)
+    exporta_snapshot(grafo, plano, args.diretorio, versoes)
+    print(f"Snapshot with {len(grafo.diagnosticos)} diagnoses and {len(plano)} nodes written to {args.diretorio}.", file=sys.stderr)
+
+
+
+
+if __name__ == "__main__":
+    main()
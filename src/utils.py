@@ -1,7 +1,22 @@
-from sqlalchemy import select
-from sqlalchemy.orm import Session, joinedload
 from db_config import DatabaseConfig
-from models import Doenca, Diagnostico, Or, And, AoMenos, Sintoma, Manifestacao, RegiaoComposta, RegiaoDoCorpo, Orgao, Exame, Resultado, Expressao, FatosSintomaResultado, AvaliaNode
+from models import Doenca, Diagnostico, Or, And, AoMenos, Sintoma, Manifestacao, RegiaoComposta, Orgao, Exame, Resultado, Expressao, FatosSintomaResultado, AvaliaNode
+from compiler import compile_diagnosticos
+from loader import load_grafo
+from snapshot import get_snapshot_dir, carrega_snapshot, carrega_versoes
+from versioning import BASE, ENTIDADES, init_versoes, load_versoes, incrementa_versao, get_entidades_novas
+from hashcons import init_assinaturas, get_or_create_expressao, get_or_create_composta
+from batch import avalia_lote
+from incremental import AvaliacaoIncremental
+from parallel import ExecutorParalelo
+from inverted_index import IndiceInvertido
+from incidence import MatrizIncidencia
+from ranking import RankingDiagnosticos
+from questions import SeletorPerguntas
+from reports import Relatorios, nome_sintoma
+from regions import FechoRegioes, SubsuncaoSintomas
+from search import IndiceBusca
+from sqlalchemy import select
+import numpy as np
 import streamlit as st
 import pandas as pd
 from tribool import Tribool
@@ -9,19 +24,56 @@ from tribool import Tribool
 
 
 
+"""
+Entities read by each method cached with cache_versionado, keyed by the method name. It's used by clear_streamlit_queries to clear only the affected methods.
+"""
+METODOS_VERSIONADOS = {}
+
+
+
+
+def cache_versionado(*entidades: str, hash_funcs: dict = None):
+    """
+    Function to cache a method of StreamlitQueries with st.cache_data, keyed by its arguments and by the versions of the entities it reads (see versioning.py).
+    The StreamlitQueries argument is hashed as the versions of these entities, so a write to another entity doesn't change the key of the method.
+    """
+    def decorator(func):
+        METODOS_VERSIONADOS[func.__name__] = entidades
+        hash_versoes = {f"{__name__}.StreamlitQueries": lambda sq: sq.get_versoes(entidades)}
+        return st.cache_data(hash_funcs={**(hash_funcs or {}), **hash_versoes})(func)
+    return decorator
+
+
+
+
 class StreamlitQueries():
     """
     Class to handle all queries to the database using SQLAlchemy.
     It uses Streamlit's caching to optimize the performance of the queries.
+    The pages use the instance shared by the server process (see load_streamlit_queries), instead of building one on each rerun.
     """
     def __init__(self) -> None:
         """
-        Initialize the class and load the database engine.
+        Initialize the class and load the database engine and its session factory (self.sessionmaker), so all sessions share the connection pool.
         It also loads all classes related to the diagnosis from the database into memory, saving them in dictionaries.
+        They're loaded with load_grafo, in a constant number of queries, with all relationships already set, so they can be used after the session is closed.
         This dictionary is used to avoid querying the database multiple times.
         We use it in the add functions to avoid duplicate entries by checking if it's already in the dict.
-        """
-        self.engine = DatabaseConfig().load_engine()
+        The expressions of all diagnoses are compiled into a flat evaluation plan (self.plano), so the requests don't need to walk the ORM objects.
+        self.indice maps each symptom/result to the diagnoses that reference it, so the "which diseases use this symptom" queries are dictionary lookups.
+        self.ranking keeps the baseline score of each diagnosis, to rank the top K diagnoses without evaluating all of them.
+        self.seletor_perguntas chooses the next best symptom/result to ask about.
+        self.relatorios builds the tables of the st_write functions (see reports.py).
+        self.busca_sintomas and self.busca_resultados are the search-as-you-type indexes of the labels of the symptoms and results (see search.py), used by the pickers of the pages.
+        self.subsuncao maps each symptom to the more general/specific ones by the closure of the hierarchy of regions (see regions.py), for the subsumption mode.
+        The get_all functions return the lists of the knowledge base loaded in memory (self.sintomas and self.resultados are built once from self.grafo),
+        without st.cache_data, which would pickle and unpickle the objects (and the expression DAG linked to them) on every call.
+        self.versoes has the versions of the knowledge base and of each entity when it was loaded (see versioning.py), used in the keys of the cached methods.
+        When the DISEASEDX_SNAPSHOT environment variable is set, the knowledge base and its plan are loaded from that snapshot (see snapshot.py) instead of the database,
+        and the app is read-only (self.engine is None and the add functions raise RuntimeError).
+        """
+        self.snapshot = get_snapshot_dir()
+        plano = None
         self.manifestacao_cache = {}
         self.orgao_cache = {}
         self.regiao_cache = {}
@@ -34,55 +86,99 @@ class StreamlitQueries():
         self.aomenos_cache = {}
         self.diagnostico_cache = {}
 
-        with Session(self.engine, expire_on_commit=False) as session:
-            for obj in session.query(Manifestacao).all():
-                key = (obj.name,)
-                self.manifestacao_cache[key] = obj
-
-            for obj in session.query(Orgao).all():
-                key = (obj.name,)
-                self.orgao_cache[key] = obj
-            
-            for obj in session.query(RegiaoDoCorpo).all():
-                key = (obj.name, obj.type)
-                self.regiao_cache[key] = obj
-
-            for obj in session.query(Sintoma).all():
-                key = (
-                    obj.manifestacao.id if obj.manifestacao else None,
-                    obj.regiao_do_corpo.id if obj.regiao_do_corpo else None,
-                )
-                self.sintoma_cache[key] = obj
-
-            for obj in session.query(Exame).all():
-                key = (obj.name, obj.preco)
-                self.exame_cache[key] = obj
-
-            for obj in session.query(Resultado).all():
-                key = (obj.name, obj.exame.id if obj.exame else None)
-                self.resultado_cache[key] = obj
-
-            for obj in session.query(Doenca).all():
-                key = (obj.name,)
-                self.doenca_cache[key] = obj
-
-            # for obj in session.query(And).all():
-            #     key = (obj.left_expr.id, obj.right_expr.id)
-            #     self.and_cache[key] = obj
-            
-            # for obj in session.query(Or).all():
-            #     ids = sorted([obj.left_expr.id, obj.right_expr.id])
-            #     key = tuple(ids)
-            #     self.or_cache[key] = obj
-
-            for obj in session.query(AoMenos).all():
+        if self.snapshot:
+            self.engine = None
+            self.sessionmaker = None
+            grafo, plano = carrega_snapshot(self.snapshot)
+            self.versoes = carrega_versoes(self.snapshot)
+        else:
+            db_config = DatabaseConfig()
+            self.engine = db_config.load_engine()
+            self.sessionmaker = db_config.load_sessionmaker()
+            init_versoes(self.engine)
+            init_assinaturas(self.engine)
+            with self.sessionmaker() as session:
+                self.versoes = load_versoes(session)
+                grafo = load_grafo(session)
+        self.grafo = grafo
+
+        for obj in grafo.manifestacoes:
+            key = (obj.name,)
+            self.manifestacao_cache[key] = obj
+
+        for obj in grafo.orgaos:
+            key = (obj.name,)
+            self.orgao_cache[key] = obj
+
+        for obj in grafo.regioes:
+            key = (obj.name, obj.type)
+            self.regiao_cache[key] = obj
+
+        for obj in grafo.sintomas:
+            key = (
+                obj.manifestacao.id if obj.manifestacao else None,
+                obj.regiao_do_corpo.id if obj.regiao_do_corpo else None,
+            )
+            self.sintoma_cache[key] = obj
+
+        for obj in grafo.exames:
+            key = (obj.name, obj.preco)
+            self.exame_cache[key] = obj
+
+        for obj in grafo.resultados:
+            key = (obj.name, obj.exame.id if obj.exame else None)
+            self.resultado_cache[key] = obj
+
+        for obj in grafo.doencas:
+            key = (obj.name,)
+            self.doenca_cache[key] = obj
+
+        for obj in grafo.expressoes:
+            if isinstance(obj, AoMenos):
                 ids = tuple(sorted(e.id for e in obj.expressoes))
                 key = (obj.qtd, ids)
                 self.aomenos_cache[key] = obj
+            elif isinstance(obj, And):
+                key = tuple(sorted(e.id for e in obj.expressoes))
+                self.and_cache[key] = obj
+            elif isinstance(obj, Or):
+                key = tuple(sorted(e.id for e in obj.expressoes))
+                self.or_cache[key] = obj
+
+        for obj in grafo.diagnosticos:
+            key = (obj.doenca.id if obj.doenca else None, obj.expressao.id if obj.expressao else None)
+            self.diagnostico_cache[key] = obj
+
+        if plano is None:
+            plano = compile_diagnosticos(self.diagnostico_cache.values())
+            for obj in list(self.sintoma_cache.values()) + list(self.resultado_cache.values()):
+                plano.add_fato(obj.id)
+        self.plano = plano
+        self.indice = IndiceInvertido(self.plano)
+        self.sintomas = grafo.sintomas
+        self.resultados = grafo.resultados
+        self.sintomas_by_id = {obj.id: obj for obj in self.sintoma_cache.values()}
+        self.resultados_by_id = {obj.id: obj for obj in self.resultado_cache.values()}
+        self.diagnosticos_by_id = {obj.id: obj for obj in self.diagnostico_cache.values()}
+        self.ranking = RankingDiagnosticos(self.plano, self.indice)
+        self.incidencia = MatrizIncidencia(self.plano, self.indice)
+        self.seletor_perguntas = SeletorPerguntas(self.plano, self.indice, self.incidencia)
+        self.relatorios = Relatorios(self.grafo, self.incidencia, self.indice)
+        self.subsuncao = SubsuncaoSintomas(grafo.sintomas, FechoRegioes(grafo.regioes))
+        self.busca_sintomas = IndiceBusca({sintoma.id: nome_sintoma(sintoma) for sintoma in self.sintomas_by_id.values()})
+        self.busca_resultados = IndiceBusca({
+            resultado.id: f"{resultado.name} do exame {resultado.exame.name}" if resultado.exame else f"{resultado.name}"
+            for resultado in self.resultados_by_id.values()
+        })
 
-            for obj in session.query(Diagnostico).all():
-                key = (obj.doenca.id if obj.doenca else None, obj.expressao.id if obj.expressao else None)
-                self.diagnostico_cache[key] = obj
+
+
+
+    def get_versoes(self, entidades) -> tuple[int, ...]:
+        """
+        Function to get the versions of the given entities, when the knowledge base was loaded.
+        """
+        return tuple(self.versoes[entidade] for entidade in entidades)
 
 
 
@@ -141,111 +237,74 @@ class StreamlitQueries():
 
 
 
-    @st.cache_data
-    def get_all_manifestacoes(_self) -> list[Manifestacao]:
+    def get_all_manifestacoes(self) -> list[Manifestacao]:
         """
-        Function to get all manifestations from the database.
+        Function to get all manifestations from the knowledge base loaded in memory.
         """
-        with Session(_self.engine, expire_on_commit=False) as session:
-            statement = select(Manifestacao)
-            manifestacoes = session.scalars(statement).unique().all()
-            return manifestacoes
+        return list(self.grafo.manifestacoes)
     
 
     
 
-    @st.cache_data
-    def get_all_regioes_compostas(_self) -> list[RegiaoComposta]:
+    def get_all_regioes_compostas(self) -> list[RegiaoComposta]:
         """
-        Function to get all composed regions from the database.
+        Function to get all composed regions from the knowledge base loaded in memory.
         """
-        with Session(_self.engine, expire_on_commit=False) as session:
-            statement = select(RegiaoComposta)
-            regioes_compostas = session.scalars(statement).unique().all()
-            return regioes_compostas
+        return [regiao for regiao in self.grafo.regioes if isinstance(regiao, RegiaoComposta)]
         
     
     
 
-    @st.cache_data
-    def get_all_orgaos(_self) -> list[Orgao]:
+    def get_all_orgaos(self) -> list[Orgao]:
         """
-        Function to get all organs from the database.
+        Function to get all organs from the knowledge base loaded in memory.
         """
-        with Session(_self.engine, expire_on_commit=False) as session:
-            statement = select(Orgao)
-            orgaos = session.scalars(statement).unique().all()
-            return orgaos
+        return self.grafo.orgaos
         
     
     
 
-    @st.cache_data
-    def get_all_exames(_self) -> list[Exame]:
+    def get_all_exames(self) -> list[Exame]:
         """
-        Function to get all exams from the database.
+        Function to get all exams from the knowledge base loaded in memory.
         """
-        with Session(_self.engine, expire_on_commit=False) as session:
-            statement = select(Exame)
-            exames = session.scalars(statement).unique().all()
-            return exames
+        return list(self.grafo.exames)
 
 
     
 
-    @st.cache_data
-    def get_all_sintomas(_self) -> list[Sintoma]:
+    def get_all_sintomas(self) -> list[Sintoma]:
         """
-        Function to get all symptoms from the database.
+        Function to get all symptoms from the knowledge base loaded in memory.
         """
-        with Session(_self.engine, expire_on_commit=False) as session:
-            statement = select(Sintoma).options(
-                joinedload(Sintoma.manifestacao),
-                joinedload(Sintoma.regiao_do_corpo)
-            )
-            sintomas = session.scalars(statement).unique().all()
-            return sintomas
+        return self.sintomas
         
         
     
 
-    @st.cache_data
-    def get_all_resultados(_self) -> list[Resultado]:
+    def get_all_resultados(self) -> list[Resultado]:
         """
-        Function to get all results from the database.
+        Function to get all results from the knowledge base loaded in memory.
         """
-        with Session(_self.engine, expire_on_commit=False) as session:
-            statement = select(Resultado).options(
-                joinedload(Resultado.exame)
-            )
-            resultados = session.scalars(statement).unique().all()
-            return resultados
+        return self.resultados
         
     
     
 
-    @st.cache_data
-    def get_all_doencas(_self) -> list[Doenca]:
+    def get_all_doencas(self) -> list[Doenca]:
         """
-        Function to get all diseases from the database.
+        Function to get all diseases from the knowledge base loaded in memory.
         """
-        with Session(_self.engine, expire_on_commit=False) as session:
-            doencas = session.query(Doenca).all()
-            return doencas
+        return list(self.grafo.doencas)
         
     
     
 
-    @st.cache_data
-    def get_all_expressions(_self) -> list[Expressao]:
+    def get_all_expressions(self) -> list[Expressao]:
         """
-        Function to get all expressions from the database.
+        Function to get all expressions from the knowledge base loaded in memory.
         """
-        with Session(_self.engine, expire_on_commit=False) as session:
-            statement = select(Expressao)
-            expressao = session.scalars(statement).unique().all()
-            print(f"Expressao: {expressao}") # TODO: Ajeitar o loading para evitar DetachedInstanceError
-            return expressao
+        return list(self.grafo.expressoes)
         
 
 
@@ -254,260 +313,349 @@ class StreamlitQueries():
 
 
     
-    @st.cache_data(hash_funcs={Doenca: lambda doenca: doenca.id})
     def get_sintomas_by_doenca(_self, target_doenca) -> list[Sintoma]:
         """
         Function to get all symptoms associated with a disease.
+        It's a row of the incidence matrix, so the expressions aren't walked again. When the disease has more than one diagnosis, the last one is used.
         """
-        with Session(_self.engine, expire_on_commit=False) as session:
-            target_doenca = session.get(Doenca, target_doenca.id)
-
-            diagnosticos = session.query(Diagnostico).options(
-                joinedload(Diagnostico.doenca),
-                joinedload(Diagnostico.expressao)
-            ).all()
-
-            sintomas = []
-            for diag in diagnosticos:
-                if diag.doenca == target_doenca:
-                    sintomas = _self.get_all_sintomas_from_expression(diag.expressao)
-            
-            # TODO: Ver eager loading pra evitar DetachedInstanceError
-            for sintoma in sintomas:
-                if sintoma.regiao_do_corpo != None:
-                    sintoma.regiao_do_corpo = session.get(RegiaoDoCorpo, sintoma.regiao_do_corpo_id)
-                sintoma.manifestacao = session.get(Manifestacao, sintoma.manifestacao_id)
-
-            return sintomas
+        sintomas = []
+        for diagnostico_id in _self.indice.diagnosticos_por_doenca.get(target_doenca.id, []):
+            sintomas = [_self.sintomas_by_id[fato_id] for fato_id in _self.incidencia.get_fatos(diagnostico_id).tolist() if fato_id in _self.sintomas_by_id]
+        return sintomas
         
 
 
     
-    @st.cache_data(hash_funcs={Doenca: lambda doenca: doenca.id})
     def get_resultados_by_doenca(_self, target_doenca) -> list[Resultado]:
         """
         Function to get all results associated with a disease.
+        It's a row of the incidence matrix, so the expressions aren't walked again. When the disease has more than one diagnosis, the last one is used.
         """
-        with Session(_self.engine, expire_on_commit=False) as session:
-            target_doenca = session.get(Doenca, target_doenca.id)
-
-            diagnosticos = session.query(Diagnostico).options(
-                joinedload(Diagnostico.doenca),
-                joinedload(Diagnostico.expressao)
-            ).all()
-
-            resultados = []
-            for diag in diagnosticos:
-                if diag.doenca == target_doenca:
-                    resultados = _self.get_all_resultados_from_expression(diag.expressao)
+        resultados = []
+        for diagnostico_id in _self.indice.diagnosticos_por_doenca.get(target_doenca.id, []):
+            resultados = [_self.resultados_by_id[fato_id] for fato_id in _self.incidencia.get_fatos(diagnostico_id).tolist() if fato_id in _self.resultados_by_id]
+        return resultados
 
-            for resultado in resultados:
-                resultado.exame = session.get(Exame, resultado.exame_id)
 
-            return resultados
 
 
+    def get_diagnosticos_by_sintoma(_self, sintoma) -> list[Diagnostico]:
+        """
+        Function to get all diagnoses associated with a symptom, mapped to their expressions.
+        It's a column of the incidence matrix, instead of loading all diagnoses and walking their expressions.
+        """
+        diagnosticos = [_self.diagnosticos_by_id[diagnostico_id] for diagnostico_id in _self.incidencia.get_diagnosticos(sintoma.id).tolist()]
+        return {diag: diag.expressao for diag in diagnosticos}
+        
 
+    
 
-    @st.cache_data(hash_funcs={Sintoma: lambda sintoma: sintoma.id})
-    def get_diagnosticos_by_sintoma(_self, sintoma) -> list[Diagnostico]:
+    def get_diagnosticos_by_resultado(_self, resultado) -> list[Diagnostico]:
         """
-        Function to get all diagnoses associated with a symptom.
+        Function to get all diagnoses associated with a result, mapped to their expressions.
+        It's a column of the incidence matrix, instead of loading all diagnoses and walking their expressions.
         """
-        with Session(_self.engine, expire_on_commit=False) as session:
-            sintoma = session.get(Sintoma, sintoma.id)
+        diagnosticos = [_self.diagnosticos_by_id[diagnostico_id] for diagnostico_id in _self.incidencia.get_diagnosticos(resultado.id).tolist()]
+        return {diag: diag.expressao for diag in diagnosticos}
 
-            diagnosticos = session.query(Diagnostico).options(
-                joinedload(Diagnostico.doenca),
-                joinedload(Diagnostico.expressao)
-            ).all()
 
-            diagnosticos_filtrados = {}
-            for diag in diagnosticos:
-                if _self.contains_expression(diag.expressao, sintoma):
-                    diagnosticos_filtrados[diag] = diag.expressao
 
-            return diagnosticos_filtrados
+
+    def get_fatos_coocorrentes(self, fato, k: int = 10) -> list[tuple[Expressao, int]]:
+        """
+        Function to get the k symptoms/results referenced by the most diagnoses together with the given symptom/result, with the number of those diagnoses.
+        It's a row of the co-occurrence matrix, computed from the incidence matrix.
+        """
+        coocorrencias = self.incidencia.coocorrencias(fato.id)
+        coluna = self.incidencia.coluna_por_fato.get(fato.id)
+        if coluna is not None:
+            coocorrencias[coluna] = 0
+        colunas = np.argsort(-coocorrencias, kind="stable")[:k]
+
+        fatos_by_id = {**self.sintomas_by_id, **self.resultados_by_id}
+        return [
+            (fatos_by_id[fato_id], quantidade)
+            for fato_id, quantidade in zip(self.incidencia.fatos_ids[colunas].tolist(), coocorrencias[colunas].tolist())
+            if quantidade > 0 and fato_id in fatos_by_id
+        ]
         
 
     
 
-    @st.cache_data(hash_funcs={Resultado: lambda resultado: resultado.id})
-    def get_diagnosticos_by_resultado(_self, resultado) -> list[Diagnostico]:
+    def get_sintomas_by_busca(self, consulta: str, pagina: int = 0, tamanho: int = 50) -> tuple[list[Sintoma], int]:
         """
-        Function to get all diagnoses associated with a result.
+        Function to get a page of the symptoms whose labels match a query (accents and case are ignored), ranked, and the total number of matches.
+        It uses the search index built with the knowledge base, so the labels aren't rebuilt from the relationships of the symptoms.
         """
-        with Session(_self.engine, expire_on_commit=False) as session:
-            resultado = session.get(Resultado, resultado.id)
+        sintomas_ids, total = self.busca_sintomas.busca(consulta, pagina, tamanho)
+        return [self.sintomas_by_id[sintoma_id] for sintoma_id in sintomas_ids], total
 
-            diagnosticos = session.query(Diagnostico).options(
-                joinedload(Diagnostico.doenca),
-                joinedload(Diagnostico.expressao)
-            ).all()
 
-            diagnosticos_filtrados = {}
-            for diag in diagnosticos:
-                if _self.contains_expression(diag.expressao, resultado):
-                    diagnosticos_filtrados[diag] = diag.expressao
 
-            return diagnosticos_filtrados
-        
 
-    
+    def get_resultados_by_busca(self, consulta: str, pagina: int = 0, tamanho: int = 50) -> tuple[list[Resultado], int]:
+        """
+        Function to get a page of the results whose labels (with the name of the exam) match a query, ranked, and the total number of matches.
+        """
+        resultados_ids, total = self.busca_resultados.busca(consulta, pagina, tamanho)
+        return [self.resultados_by_id[resultado_id] for resultado_id in resultados_ids], total
+
+
 
-    @st.cache_data(hash_funcs={Doenca: lambda doenca: doenca.id})
-    def get_diagnostico_by_doenca(_self, doenca) -> Diagnostico:
+
+    def get_rotulo(self, fato) -> str:
         """
-        Function to get the diagnosis associated with a disease.
+        Function to get the label of a symptom or result precomputed by the search indexes, e.g. for the format_func of the pickers.
         """
-        with Session(_self.engine, expire_on_commit=False) as session:
-            doenca = session.get(Doenca, doenca.id)
+        if fato.id in self.busca_sintomas.rotulo_por_id:
+            return self.busca_sintomas.get_rotulo(fato.id)
+        return self.busca_resultados.get_rotulo(fato.id)
 
-            diagnosticos = session.query(Diagnostico).options(
-                joinedload(Diagnostico.doenca),
-                joinedload(Diagnostico.expressao)
-            ).all()
 
-            for diag in diagnosticos:
-                if diag.doenca == doenca:
-                    return diag
 
-            return diag
+
+    def expande_sintomas_by_subsuncao(self, present_sintomas, not_present_sintomas) -> tuple[list[Sintoma], list[Sintoma]]:
+        """
+        Function to add to the present/absent symptoms the ones implied by the hierarchy of regions (the subsumption mode):
+        a present symptom is also evidence for its more general symptoms (e.g. "Dor no Abdome" for "Dor no Tronco"), and an absent one rules out its more specific ones.
+        The lists returned can be passed to any of the evaluation functions. The symptoms added come after the given ones, in the order of their ids.
+        """
+        presentes, ausentes = self.subsuncao.expande([sintoma.id for sintoma in present_sintomas], [sintoma.id for sintoma in not_present_sintomas])
+        present_ids = {sintoma.id for sintoma in present_sintomas}
+        not_present_ids = {sintoma.id for sintoma in not_present_sintomas}
+        present_sintomas = list(present_sintomas) + [self.sintomas_by_id[sintoma_id] for sintoma_id in sorted(presentes - present_ids)]
+        not_present_sintomas = [sintoma for sintoma in not_present_sintomas if sintoma.id in ausentes] + [self.sintomas_by_id[sintoma_id] for sintoma_id in sorted(ausentes - not_present_ids)]
+        return present_sintomas, not_present_sintomas
 
 
     
 
-    @st.cache_data(hash_funcs={Sintoma: lambda sintoma: sintoma.id, Resultado: lambda resultado: resultado.id})
-    def get_diagnosticos_by_list_of_sintomas_and_resultados(_self, present_sintomas, not_present_sintomas, present_resultados, not_present_resultados) -> list[Diagnostico]:
+    def get_diagnostico_by_doenca(self, doenca) -> Diagnostico:
         """
-        Function to get all diagnoses associated with a list of symptoms and results.
+        Function to get the diagnosis associated with a disease (the first one, when it has more than one), or None.
+        It's a lookup in the inverted index, and it returns the object of the knowledge base loaded in memory, without st.cache_data.
         """
-        with Session(_self.engine, expire_on_commit=False) as session:
-            sintomas = _self.get_all_sintomas()
-            sintomas_presentes = [session.get(Sintoma, sintoma.id) for sintoma in present_sintomas]
-            sintomas_ausentes = [session.get(Sintoma, sintoma.id) for sintoma in not_present_sintomas]
+        diagnosticos = self.indice.diagnosticos_por_doenca.get(doenca.id)
+        return self.diagnosticos_by_id[diagnosticos[0]] if diagnosticos else None
 
-            resultados = _self.get_all_resultados()
-            resultados_presentes = [session.get(Resultado, resultado.id) for resultado in present_resultados]
-            resultados_ausentes = [session.get(Resultado, resultado.id) for resultado in not_present_resultados]
 
-            diagnosticos = session.query(Diagnostico).options(
-                joinedload(Diagnostico.doenca),
-                joinedload(Diagnostico.expressao)
-            ).all()
-            
-            diagnosticos_filtrados = {}
+    
+
+    @cache_versionado(*ENTIDADES, hash_funcs={Sintoma: lambda sintoma: sintoma.id, Resultado: lambda resultado: resultado.id})
+    def get_diagnosticos_by_list_of_sintomas_and_resultados(self, present_sintomas, not_present_sintomas, present_resultados, not_present_resultados) -> list[Diagnostico]:
+        """
+        Function to get all diagnoses associated with a list of symptoms and results.
+        """
+        sintomas = self.get_all_sintomas()
+        resultados = self.get_all_resultados()
 
-            fatos = FatosSintomaResultado(sintomas, sintomas_presentes, sintomas_ausentes, resultados, resultados_presentes, resultados_ausentes)
+        diagnosticos_filtrados = {}
 
-            for diag in diagnosticos:
-                print(f"\n- Doenca: {diag.doenca.name}")
-                avalia_result, avalia_return = diag.expressao.avalia(fatos)
-                print(f"- Avalia Result: {avalia_result}")
-                avalia_return.print_tree() # TODO: Ajeitar o loading para evitar DetachedInstanceError
+        fatos = FatosSintomaResultado(sintomas, present_sintomas, not_present_sintomas, resultados, present_resultados, not_present_resultados, indice=self.plano.indice_fatos)
 
-                if avalia_result.value is not False:
-                    diagnosticos_filtrados[diag.doenca] = diag.expressao
+        avaliacoes = self.plano.avalia(fatos)
+        for diag in self.diagnosticos_by_id.values():
+            avalia_result, avalia_score = avaliacoes[diag.id]
+            if avalia_result.value is not False:
+                diagnosticos_filtrados[diag.doenca] = diag.expressao
 
-            return diagnosticos_filtrados
+        return diagnosticos_filtrados
 
 
 
 
-    @st.cache_data(hash_funcs={Sintoma: lambda sintoma: sintoma.id, Resultado: lambda resultado: resultado.id})
-    def get_diagnosticos_avaliacoes_by_list_of_sintomas_and_resultados(_self, present_sintomas, not_present_sintomas, present_resultados, not_present_resultados) -> dict[Doenca, tuple[AvaliaNode, float]]:
+    @cache_versionado(*ENTIDADES, hash_funcs={Sintoma: lambda sintoma: sintoma.id, Resultado: lambda resultado: resultado.id})
+    def get_diagnosticos_avaliacoes_by_list_of_sintomas_and_resultados(self, present_sintomas, not_present_sintomas, present_resultados, not_present_resultados) -> dict[Doenca, tuple[AvaliaNode, float]]:
         """
         Function to get all diagnoses evaluations associated with a list of symptoms and results.
+        The expressions were loaded with load_grafo, so walking them doesn't query the database.
         """
-        with Session(_self.engine, expire_on_commit=False) as session:
-            sintomas = _self.get_all_sintomas()
-            sintomas_presentes = [session.get(Sintoma, sintoma.id) for sintoma in present_sintomas]
-            sintomas_ausentes = [session.get(Sintoma, sintoma.id) for sintoma in not_present_sintomas]
+        sintomas = self.get_all_sintomas()
+        resultados = self.get_all_resultados()
 
-            resultados = _self.get_all_resultados()
-            resultados_presentes = [session.get(Resultado, resultado.id) for resultado in present_resultados]
-            resultados_ausentes = [session.get(Resultado, resultado.id) for resultado in not_present_resultados]
+        avalia_dict = {}
 
-            diagnosticos = session.query(Diagnostico).options(
-                joinedload(Diagnostico.doenca),
-                joinedload(Diagnostico.expressao)
-            ).all()
-            
-            avalia_dict = {}
+        fatos = FatosSintomaResultado(sintomas, present_sintomas, not_present_sintomas, resultados, present_resultados, not_present_resultados, indice=self.plano.indice_fatos)
+        for diag in self.diagnosticos_by_id.values():
+            avalia_result, avalia_return = diag.expressao.avalia(fatos)
+            diag_score = f"{avalia_return.score:.2f}"
 
-            fatos = FatosSintomaResultado(sintomas, sintomas_presentes, sintomas_ausentes, resultados, resultados_presentes, resultados_ausentes)
-            fatos.print_fatos()
-            for diag in diagnosticos:
-                print(f"\n- Doenca: {diag.doenca.name}")
-                avalia_result, avalia_return = diag.expressao.avalia(fatos)
-                print(f"- Avalia Result: {avalia_result}")
-                avalia_return.print_tree() # TODO: Ajeitar o loading para evitar DetachedInstanceError
+            avalia_dict[diag.doenca] = (avalia_return, diag_score)
 
-                diag_score = f"{avalia_return.score:.2f}"
-
-                avalia_dict[diag.doenca] = (avalia_return, diag_score)
-
-            return avalia_dict
+        return avalia_dict
         
     
     
 
-    @st.cache_data(hash_funcs={Sintoma: lambda sintoma: sintoma.id})
-    def get_most_common_sintoma(_self, sintomas, present_sintomas, not_present_sintomas) -> Sintoma:
+    @cache_versionado(*ENTIDADES, hash_funcs={Sintoma: lambda sintoma: sintoma.id, Resultado: lambda resultado: resultado.id})
+    def get_diagnosticos_resultados_by_list_of_sintomas_and_resultados(self, present_sintomas, not_present_sintomas, present_resultados, not_present_resultados) -> dict[Doenca, tuple[Tribool, float]]:
+        """
+        Function to get the result and score of all diagnoses for a list of symptoms and results, without building the evaluation trees.
+        It uses the compiled plan, which stops evaluating a node as soon as its result is decided.
+        Use get_arvore_avaliacao_by_doenca to build the evaluation tree of a disease when it's actually displayed.
+        """
+        sintomas = self.get_all_sintomas()
+        resultados = self.get_all_resultados()
+        fatos = FatosSintomaResultado(sintomas, present_sintomas, not_present_sintomas, resultados, present_resultados, not_present_resultados, indice=self.plano.indice_fatos)
+
+        resultados_dict = {}
+        memo = {}
+        for diag in self.diagnosticos_by_id.values():
+            avalia_result, avalia_score = self.plano.avalia_diagnostico(diag.id, fatos, memo)
+            resultados_dict[diag.doenca] = (avalia_result, avalia_score)
+
+        return resultados_dict
+
+
+
+
+    @cache_versionado(*ENTIDADES, hash_funcs={Doenca: lambda doenca: doenca.id, Sintoma: lambda sintoma: sintoma.id, Resultado: lambda resultado: resultado.id})
+    def get_arvore_avaliacao_by_doenca(self, doenca, present_sintomas, not_present_sintomas, present_resultados, not_present_resultados) -> AvaliaNode:
+        """
+        Function to build the evaluation tree of the diagnosis of a single disease for a list of symptoms and results.
+        When the disease has more than one diagnosis, the first one is used.
+        """
+        sintomas = self.get_all_sintomas()
+        resultados = self.get_all_resultados()
+        fatos = FatosSintomaResultado(sintomas, present_sintomas, not_present_sintomas, resultados, present_resultados, not_present_resultados, indice=self.plano.indice_fatos)
+
+        diag = self.diagnosticos_by_id[self.indice.diagnosticos_por_doenca[doenca.id][0]]
+        avalia_result, avalia_return = diag.expressao.avalia(fatos)
+        return avalia_return
+
+
+
+
+    def get_avaliacao_incremental(self) -> AvaliacaoIncremental:
+        """
+        Function to create an incremental evaluation of all diagnoses, to be kept between reruns (e.g. in st.session_state).
+        """
+        return self.seletor_perguntas.avaliacao.copia()
+
+
+
+
+    def get_diagnosticos_resultados_by_avaliacao_incremental(self, avaliacao, present_sintomas, not_present_sintomas, present_resultados, not_present_resultados) -> dict[Doenca, tuple[Tribool, float]]:
+        """
+        Function to get the result and score of all diagnoses from an incremental evaluation.
+        Only the facts that changed since the last call are flipped, so only the diagnoses that use them are recomputed.
+        """
+        presentes = {sintoma.id for sintoma in present_sintomas} | {resultado.id for resultado in present_resultados}
+        ausentes = {sintoma.id for sintoma in not_present_sintomas} | {resultado.id for resultado in not_present_resultados}
+        avaliacao.sincroniza(presentes, ausentes)
+
+        doencas = {doenca.id: doenca for doenca in self.doenca_cache.values()}
+        return {doencas[avaliacao.plano.doencas[diagnostico_id]]: valor for diagnostico_id, valor in avaliacao.avaliacoes().items()}
+
+
+
+
+    def get_diagnosticos_avaliacoes_by_batch_of_fatos(self, fatos: np.ndarray, executor: ExecutorParalelo = None) -> tuple[list[Doenca], np.ndarray, np.ndarray]:
+        """
+        Function to evaluate all diagnoses for a batch of N cases at once.
+        The cases are an N x F int8 matrix (1 present, -1 absent, 0 unknown), with the columns ordered like self.plano.fatos_ids (see batch.codifica_casos).
+        It returns the list of the D diseases, an N x D matrix of Kleene results (1, -1, 0) and an N x D matrix of scores.
+        When an executor is given (see get_executor_paralelo), the cases are split in chunks evaluated by its worker processes.
+        """
+        doencas = {doenca.id: doenca for doenca in self.doenca_cache.values()}
+        doencas_avaliadas = [doencas.get(self.plano.doencas[diagnostico_id]) for diagnostico_id in self.plano.diagnostico_ids()]
+        if executor is not None:
+            resultados, scores = executor.avalia_lote(fatos)
+        else:
+            resultados, scores = avalia_lote(self.plano, fatos)
+        return doencas_avaliadas, resultados, scores
+
+
+
+
+    def get_top_k_diagnosticos_by_list_of_sintomas_and_resultados(self, present_sintomas, not_present_sintomas, present_resultados, not_present_resultados, k: int) -> dict[Doenca, tuple[Tribool, float]]:
         """
-        Function to get the most common symptom among all diagnoses.
+        Function to get the k diagnoses with the highest scores for a list of symptoms and results, ordered by score.
+        The diagnoses that can't enter the top k (by the upper bound of their score) aren't evaluated.
         """
-        max_ammount = 0
-        with Session(_self.engine, expire_on_commit=False) as session:
+        presentes = [sintoma.id for sintoma in present_sintomas] + [resultado.id for resultado in present_resultados]
+        ausentes = [sintoma.id for sintoma in not_present_sintomas] + [resultado.id for resultado in not_present_resultados]
+
+        doencas = {doenca.id: doenca for doenca in self.doenca_cache.values()}
+        return {doencas[self.plano.doencas[diagnostico_id]]: (result, score) for diagnostico_id, result, score in self.ranking.top_k(presentes, ausentes, k)}
+
+
+
+
+    def get_executor_paralelo(self, workers: int = None) -> ExecutorParalelo:
+        """
+        Function to start a pool of worker processes with the compiled plan, to be kept while the app runs (e.g. with st.cache_resource).
+        By default it uses one worker per CPU. Call shutdown() on it to stop the workers.
+        """
+        return ExecutorParalelo(self.plano, workers)
+
+
+
 
-            if len(sintomas) == 0:
-                sintomas = _self.get_all_sintomas()
-            else:
-                sintomas = [session.get(Sintoma, sintoma.id) for sintoma in sintomas]
+    def get_diagnosticos_resultados_by_executor_paralelo(self, executor, present_sintomas, not_present_sintomas, present_resultados, not_present_resultados) -> dict[Doenca, tuple[Tribool, float]]:
+        """
+        Function to get the result and score of all diagnoses for a list of symptoms and results, with the diagnoses split among the worker processes of the executor.
+        """
+        presentes = [sintoma.id for sintoma in present_sintomas] + [resultado.id for resultado in present_resultados]
+        ausentes = [sintoma.id for sintoma in not_present_sintomas] + [resultado.id for resultado in not_present_resultados]
 
-            not_already_selected_sintomas = [sintoma for sintoma in sintomas if sintoma not in present_sintomas and sintoma not in not_present_sintomas]
+        doencas = {doenca.id: doenca for doenca in self.doenca_cache.values()}
+        return {doencas[self.plano.doencas[diagnostico_id]]: valor for diagnostico_id, valor in executor.avalia(presentes, ausentes).items()}
+    
+    
 
-            for sintoma in not_already_selected_sintomas:
-                diagnosticos = _self.get_diagnosticos_by_sintoma(sintoma)
-                ammount = len(diagnosticos)
-                if ammount > max_ammount:
-                    max_ammount = ammount
-                    most_common_sintoma = sintoma
 
-            most_common_sintoma.manifestacao = session.get(Manifestacao, most_common_sintoma.manifestacao_id)  
-            if most_common_sintoma.regiao_do_corpo != None:
-                most_common_sintoma.regiao_do_corpo = session.get(RegiaoDoCorpo, most_common_sintoma.regiao_do_corpo_id)      
+    @cache_versionado(*ENTIDADES, hash_funcs={Sintoma: lambda sintoma: sintoma.id, Resultado: lambda resultado: resultado.id})
+    def get_most_common_sintoma(self, sintomas, present_sintomas, not_present_sintomas, present_resultados=(), not_present_resultados=()) -> Sintoma:
+        """
+        Function to get the next best symptom to ask about, among the given symptoms (or all of them, if the list is empty).
+        It's the symptom with the highest expected information gain over the diagnoses that are still possible (see questions.SeletorPerguntas).
+        Between symptoms with the same gain, the most common one among the possible diagnoses is chosen.
+        """
+        if len(sintomas) == 0:
+            sintomas = self.get_all_sintomas()
+        presentes = [sintoma.id for sintoma in present_sintomas] + [resultado.id for resultado in present_resultados]
+        ausentes = [sintoma.id for sintoma in not_present_sintomas] + [resultado.id for resultado in not_present_resultados]
 
-        return most_common_sintoma
+        melhores = self.seletor_perguntas.melhores(presentes, ausentes, [sintoma.id for sintoma in sintomas])
+        if not melhores:
+            return None
+        return self.sintomas_by_id[melhores[0][0]]
     
     
     
 
-    @st.cache_data(hash_funcs={Resultado: lambda resultado: resultado.id})
-    def get_most_common_resultado(_self, resultados, present_resultados, not_present_resultados) -> Resultado:
+    @cache_versionado(*ENTIDADES, hash_funcs={Sintoma: lambda sintoma: sintoma.id, Resultado: lambda resultado: resultado.id})
+    def get_most_common_resultado(self, resultados, present_resultados, not_present_resultados, present_sintomas=(), not_present_sintomas=()) -> Resultado:
         """
-        Function to get the most common result among all diagnoses.
+        Function to get the next best result to ask about, among the given results (or all of them, if the list is empty).
+        It's the result with the highest expected information gain over the diagnoses that are still possible (see questions.SeletorPerguntas).
+        Between results with the same gain, the most common one among the possible diagnoses is chosen.
         """
-        max_ammount = 0
-        with Session(_self.engine, expire_on_commit=False) as session:
+        if len(resultados) == 0:
+            resultados = self.get_all_resultados()
+        presentes = [sintoma.id for sintoma in present_sintomas] + [resultado.id for resultado in present_resultados]
+        ausentes = [sintoma.id for sintoma in not_present_sintomas] + [resultado.id for resultado in not_present_resultados]
 
-            if len(resultados) == 0:
-                resultados = _self.get_all_resultados()
-            else:
-                resultados = [session.get(Resultado, resultado.id) for resultado in resultados]
+        melhores = self.seletor_perguntas.melhores(presentes, ausentes, [resultado.id for resultado in resultados])
+        if not melhores:
+            return None
+        return self.resultados_by_id[melhores[0][0]]
 
-            not_already_selected_resultados = [resultado for resultado in resultados if resultado not in present_resultados and resultado not in not_present_resultados]
 
-            for resultado in not_already_selected_resultados:
-                diagnosticos = _self.get_diagnosticos_by_resultado(resultado)
-                ammount = len(diagnosticos)
-                if ammount > max_ammount:
-                    max_ammount = ammount
-                    most_common_resultado = resultado
 
-            most_common_resultado.exame = session.get(Exame, most_common_resultado.exame_id)  
 
-        return most_common_resultado
+    @cache_versionado(*ENTIDADES, hash_funcs={Sintoma: lambda sintoma: sintoma.id, Resultado: lambda resultado: resultado.id})
+    def get_proximas_perguntas(self, present_sintomas, not_present_sintomas, present_resultados, not_present_resultados, k: int = 5) -> list[tuple[Expressao, float]]:
+        """
+        Function to get the k symptoms and results that are the best next questions, with their expected information gain in bits.
+        """
+        presentes = [sintoma.id for sintoma in present_sintomas] + [resultado.id for resultado in present_resultados]
+        ausentes = [sintoma.id for sintoma in not_present_sintomas] + [resultado.id for resultado in not_present_resultados]
+
+        fatos_by_id = {**self.sintomas_by_id, **self.resultados_by_id}
+        melhores = self.seletor_perguntas.melhores(presentes, ausentes, list(fatos_by_id), k)
+        return [(fatos_by_id[fato_id], ganho) for fato_id, ganho in melhores]
 
 
 
@@ -516,60 +664,113 @@ class StreamlitQueries():
 
 
     
+    def check_escrita(self) -> None:
+        """
+        Function to check that the knowledge base can be changed, i.e. that it wasn't loaded from a snapshot.
+        """
+        if self.engine is None:
+            raise RuntimeError(f"The knowledge base was loaded from the snapshot {self.snapshot} and is read-only.")
+
+
+
+
     def add_manifestacao(self, manifestacao_str) -> str:
         """
-        Function to add a new manifestation to the database.
+        Function to add a new manifestation to the database, unless one with the same name already exists (in memory or in the database).
+        Like the other add functions, it increments the versions of the new entities, so the pages read it on the next call.
         """
-        manifestacao = Manifestacao(name=manifestacao_str)
-        if self.manifestacoes.get(manifestacao_str) == None and manifestacao_str != "":
-            self.manifestacoes[manifestacao_str] = manifestacao
-            with Session(self.engine, expire_on_commit=False) as session:
-                session.add(manifestacao)
-                session.commit()
-            return 'Created'
-        else:
+        self.check_escrita()
+        key = (manifestacao_str,)
+        if manifestacao_str == "" or key in self.manifestacao_cache:
             return 'Exists'
+
+        with self.sessionmaker() as session:
+            # A manifestação pode ter sido criada por outro processo depois que a base foi carregada
+            manifestacao = session.scalars(select(Manifestacao).where(Manifestacao.name == manifestacao_str).limit(1)).first()
+            if manifestacao is not None:
+                self.manifestacao_cache[key] = manifestacao
+                return 'Exists'
+            manifestacao = Manifestacao(name=manifestacao_str)
+            session.add(manifestacao)
+            entidades = get_entidades_novas(session)
+            incrementa_versao(session, *entidades)
+            session.commit()
+        self.manifestacao_cache[key] = manifestacao
+        clear_streamlit_queries(entidades)
+        return 'Created'
         
     
 
 
-    def add_or(self, left_expr, right_expr) -> str:
+    def add_composta(self, tipo: type, expressoes, qtd: int, cache: dict) -> str:
         """
-        Function to add a new Or object to the database.
+        Function to add a new And/Or/AoMenos (tipo) to the database, unless an equal one already exists (see hashcons.get_or_create_composta).
+        The structural hash is checked in the database, so the expressions written by other processes are also reused.
         """
-        # Create a unique key for the Or object based on the left and right expressions
-        key = (left_expr.id, right_expr.id)
-
-        # Check if the Or object already exists in the cache
-        if key in self.or_cache:
+        self.check_escrita()
+        # Chave única: ids dos filhos em ordem (os filhos são um conjunto), e qtd no AoMenos. Sem chave se algum filho é novo
+        ids = [expr.id for expr in expressoes]
+        key = tuple(sorted(set(ids))) if None not in ids else None
+        if key is not None and tipo is AoMenos:
+            key = (qtd, key)
+        if key is not None and key in cache:
             return 'Exists'
 
-        # Check if the Or object exists in the database
-        with Session(self.engine, expire_on_commit=False) as session:
-            existing_or = session.query(Or).filter_by(left_expr_id=left_expr.id, right_expr_id=right_expr.id).first()
-            if existing_or:
-                self.or_cache[key] = existing_or
+        with self.sessionmaker() as session:
+            criadas = []
+            expressao = get_or_create_composta(session, tipo, expressoes, qtd, criadas)
+            if key is not None:
+                cache[key] = expressao
+            if not criadas:
                 return 'Exists'
-
-            # Create a new Or object if it doesn't exist
-            new_or = Or(left=left_expr, right=right_expr)
-            session.add(new_or)
+            # Os filhos novos (e as manifestações, regiões e exames deles) também mudam a versão das suas entidades
+            entidades = get_entidades_novas(session)
+            incrementa_versao(session, *entidades)
             session.commit()
+        clear_streamlit_queries(entidades)
+        return 'Created'
+
+
+
+
+    def add_and(self, *expressoes) -> str:
+        """
+        Function to add a new And object to the database.
+        """
+        return self.add_composta(And, expressoes, None, self.and_cache)
+
+
+
+
+    def add_or(self, *expressoes) -> str:
+        """
+        Function to add a new Or object to the database.
+        """
+        return self.add_composta(Or, expressoes, None, self.or_cache)
+
+
+
+
+    def add_ao_menos(self, qtd: int, *expressoes) -> str:
+        """
+        Function to add a new AoMenos object to the database.
+        """
+        return self.add_composta(AoMenos, expressoes, qtd, self.aomenos_cache)
 
-            # Add the new Or object to the cache
-            self.or_cache[key] = new_or
-            return 'Created'
 
 
-    
 
     def add_orgao(self, orgao) -> str:
         """
         Function to add a new organ to the database.
         """
-        with Session(self.engine, expire_on_commit=False) as session:
+        self.check_escrita()
+        with self.sessionmaker() as session:
             session.add(orgao)
+            entidades = get_entidades_novas(session)
+            incrementa_versao(session, *entidades)
             session.commit()
+            clear_streamlit_queries(entidades)
             return orgao
         
 
@@ -579,9 +780,13 @@ class StreamlitQueries():
         """
         Function to add a new composed region to the database.
         """
-        with Session(self.engine, expire_on_commit=False) as session:
+        self.check_escrita()
+        with self.sessionmaker() as session:
             session.add(regiao_composta)
+            entidades = get_entidades_novas(session)
+            incrementa_versao(session, *entidades)
             session.commit()
+            clear_streamlit_queries(entidades)
             return regiao_composta
         
     
@@ -591,9 +796,16 @@ class StreamlitQueries():
         """
         Function to add a new symptom to the database.
         """
-        with Session(self.engine, expire_on_commit=False) as session:
-            session.add(sintoma)
-            session.commit()
+        self.check_escrita()
+        with self.sessionmaker() as session:
+            criadas = []
+            sintoma = get_or_create_expressao(session, sintoma, criadas)
+            if criadas:
+                # Uma manifestação ou região nova do sintoma também muda a versão da sua entidade
+                entidades = get_entidades_novas(session)
+                incrementa_versao(session, *entidades)
+                session.commit()
+                clear_streamlit_queries(entidades)
             return sintoma
 
 
@@ -603,118 +815,94 @@ class StreamlitQueries():
 
 
     
-    @st.cache_data
-    def st_write_sintoma_doencas_table(_self) -> pd.DataFrame:
+    @cache_versionado("sintoma", "manifestacao", "regiao", "expressao", "doenca", "diagnostico")
+    def st_write_sintoma_doencas_table(self) -> pd.DataFrame:
         """
         Create a dataframe to display the information of all diseases associated with each symptom.
+        It's built in a single pass over the incidence matrix (see Relatorios.sintoma_doencas).
         """
-        df = pd.DataFrame(columns=["Sintoma", "Doenças", "Count"])
-        sintomas = _self.get_all_sintomas()
-        for sintoma in sintomas:
-            diagnosticos = _self.get_diagnosticos_by_sintoma(sintoma)
-            doencas_names = sorted([diagnostico.doenca.name for diagnostico in diagnosticos])
-            if(sintoma.regiao_do_corpo == None):
-                df = pd.concat([df, pd.DataFrame([{
-                    "Sintoma": f"{sintoma.manifestacao.name}",
-                    "Doenças": doencas_names,
-                    "Count": len(doencas_names)
-                }])], ignore_index=True)
-            else:
-                df = pd.concat([df, pd.DataFrame([{
-                    "Sintoma": f"{sintoma.manifestacao.name} no(a) {sintoma.regiao_do_corpo.name}", 
-                    "Doenças": doencas_names,
-                    "Count": len(doencas_names)
-                }])], ignore_index=True)
-        df_sorted = df.sort_values(by="Count", ascending=False)
-        return df_sorted
+        return self.relatorios.sintoma_doencas()
 
 
     
 
-    @st.cache_data
-    def st_write_resultado_doencas_table(_self) -> pd.DataFrame:
+    @cache_versionado("resultado", "exame", "expressao", "doenca", "diagnostico")
+    def st_write_resultado_doencas_table(self) -> pd.DataFrame:
         """
         Create a dataframe to display the information of all diseases associated with each result.
+        It's built in a single pass over the incidence matrix (see Relatorios.resultado_doencas).
         """
-        df = pd.DataFrame(columns=["Resultado", "Doenças", "Count"])
-        resultados = _self.get_all_resultados()
-        for resultado in resultados:
-            diagnosticos = _self.get_diagnosticos_by_resultado(resultado)
-            doencas_names = sorted([diagnostico.doenca.name for diagnostico in diagnosticos])
-            df = pd.concat([df, pd.DataFrame([{
-                "Resultado": f"{resultado.name}",
-                "Doenças": doencas_names,
-                "Count": len(doencas_names)
-            }])], ignore_index=True)
-        df_sorted = df.sort_values(by="Count", ascending=False)
-        return df_sorted
+        return self.relatorios.resultado_doencas()
 
 
     
 
-    @st.cache_data
-    def st_write_doenca_sintomas_table(_self) -> pd.DataFrame:
+    @cache_versionado("sintoma", "manifestacao", "regiao", "expressao", "doenca", "diagnostico")
+    def st_write_doenca_sintomas_table(self) -> pd.DataFrame:
         """
         Create a dataframe to display the information of all diseases and their symptoms.
         """
-        df = pd.DataFrame(columns=["Doença", "Sintomas"])
-        doencas = _self.get_all_doencas()
-        for doenca in doencas:
-            sintomas = _self.get_sintomas_by_doenca(doenca)
-            sintomas_names = sorted([
-                f"{sintoma.manifestacao.name} no (a) {sintoma.regiao_do_corpo.name}" if sintoma.regiao_do_corpo 
-                else f"{sintoma.manifestacao.name}" 
-                for sintoma in sintomas
-            ])
-            df = pd.concat([df, pd.DataFrame([{
-                "Doença": doenca.name,
-                "Sintomas": sintomas_names
-            }])], ignore_index=True)
-        return df
+        return self.relatorios.doenca_sintomas()
 
 
     
 
-    @st.cache_data(hash_funcs={Doenca: lambda doenca: doenca.id})
-    def st_write_doenca_sintomas_resultados_table(_self) -> pd.DataFrame:
+    @cache_versionado(*ENTIDADES, hash_funcs={Doenca: lambda doenca: doenca.id})
+    def st_write_doenca_sintomas_resultados_table(self) -> pd.DataFrame:
         """
         Create a dataframe to display the information of all diseases, their symptoms and results.
         """
-        df = pd.DataFrame(columns=["Doença", "Sintomas", "Resultados"])
-        doencas = _self.get_all_doencas()
-        for doenca in doencas:
-            sintomas = _self.get_sintomas_by_doenca(doenca)
-            sintomas_names = sorted([
-                f"{sintoma.manifestacao.name} no (a) {sintoma.regiao_do_corpo.name}" if sintoma.regiao_do_corpo 
-                else f"{sintoma.manifestacao.name}" 
-                for sintoma in sintomas
-            ])
-            resultados = _self.get_resultados_by_doenca(doenca)
-            resultados_names = sorted([resultado.name for resultado in resultados])
-            df = pd.concat([df, pd.DataFrame([{
-                "Doença": doenca.name,
-                "Sintomas": sintomas_names,
-                "Resultados": resultados_names
-            }])], ignore_index=True)
-        return df
+        return self.relatorios.doenca_sintomas_resultados()
 
 
     
 
-    @st.cache_data
-    def st_write_doenca_diagnostico_table(_self) -> pd.DataFrame:
+    @cache_versionado(*ENTIDADES)
+    def st_write_doenca_diagnostico_table(self) -> pd.DataFrame:
         """
         Create a dataframe to display the information of all diseases and their diagnoses.
         """
-        df = pd.DataFrame(columns=["Doença", "Diagnostico", "Especificidade", "Sensibilidade", "Acurácia"])
-        doencas = _self.get_all_doencas()
-        for doenca in doencas:
-            diagnostico = sorted(_self.get_diagnostico_by_doenca(doenca))
-            df = pd.concat([df, pd.DataFrame([{
-                "Doença": diagnostico.doenca.name,
-                "Diagnostico": diagnostico.expressao,
-                "Especificidade": diagnostico.especificidade,
-                "Sensibilidade": diagnostico.sensibilidade,
-                "Acurácia": diagnostico.acuracia
-            }])], ignore_index=True)
-        return df
\ No newline at end of file
+        return self.relatorios.doenca_diagnostico()
+
+
+
+
+@st.cache_resource
+def _load_streamlit_queries() -> StreamlitQueries:
+    """
+    Function to build the StreamlitQueries shared by all sessions and reruns of the server process.
+    The st.cache_resource decorator builds it only once, until clear_streamlit_queries is called.
+    """
+    return StreamlitQueries()
+
+
+
+
+def load_streamlit_queries() -> StreamlitQueries:
+    """
+    Function to get the StreamlitQueries shared by all sessions and reruns of the server process, so a rerun doesn't load and compile the knowledge base again.
+    The object is read-mostly: the queries don't change it, and the add functions call clear_streamlit_queries after a write.
+    The versions of the database are checked on each call (a single small query), so the writes of other processes are also seen:
+    when they changed, only the cached methods that read the changed entities are cleared, and the knowledge base is loaded again.
+    """
+    sq = _load_streamlit_queries()
+    if sq.engine is not None:
+        with sq.sessionmaker() as session:
+            versoes = load_versoes(session)
+        if versoes[BASE] != sq.versoes[BASE]:
+            clear_streamlit_queries([entidade for entidade in ENTIDADES if versoes[entidade] != sq.versoes[entidade]])
+            sq = _load_streamlit_queries()
+    return sq
+
+
+
+
+def clear_streamlit_queries(entidades=None) -> None:
+    """
+    Function to invalidate the shared StreamlitQueries and the cached results of the methods that read the given entities, when they change.
+    Without entities, all cached methods are cleared. The next call to load_streamlit_queries loads the knowledge base again.
+    """
+    _load_streamlit_queries.clear()
+    for nome, dependencias in METODOS_VERSIONADOS.items():
+        if entidades is None or any(entidade in dependencias for entidade in entidades):
+            getattr(StreamlitQueries, nome).clear()
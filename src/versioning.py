@@ -0,0 +1,123 @@
+from sqlalchemy import Engine, event, select, update
+from sqlalchemy.orm import Session
+from models import VersaoBase, Manifestacao, RegiaoDoCorpo, Exame, Sintoma, Resultado, Expressao, Doenca, Diagnostico
+
+
+
+
+"""
+Name of the version of the whole knowledge base and names of the versioned entities.
+'expressao' is used for the And/Or/AoMenos expressions, since symptoms and results have their own versions.
+"""
+BASE = "base"
+ENTIDADES = ("manifestacao", "regiao", "exame", "sintoma", "resultado", "expressao", "doenca", "diagnostico")
+
+
+
+"""
+Entity of each class of the models. Sintoma and Resultado come before Expressao, since they're also expressions.
+"""
+ENTIDADE_POR_CLASSE = (
+    (Manifestacao, "manifestacao"),
+    (RegiaoDoCorpo, "regiao"),
+    (Exame, "exame"),
+    (Sintoma, "sintoma"),
+    (Resultado, "resultado"),
+    (Expressao, "expressao"),
+    (Doenca, "doenca"),
+    (Diagnostico, "diagnostico"),
+)
+
+
+"""
+Key of Session.info with the entities of the objects inserted in the current transaction of the session.
+"""
+ENTIDADES_NOVAS = "entidades_novas"
+
+
+
+
+def init_versoes(engine: Engine) -> None:
+    """
+    Function to create the version table, when it doesn't exist yet, and the rows of the knowledge base and of each entity, starting at 0.
+    """
+    VersaoBase.__table__.create(engine, checkfirst=True)
+    with Session(engine) as session:
+        existentes = set(session.scalars(select(VersaoBase.entidade)).all())
+        session.add_all(VersaoBase(entidade=entidade, versao=0) for entidade in (BASE,) + ENTIDADES if entidade not in existentes)
+        session.commit()
+
+
+
+
+def load_versoes(session: Session) -> dict[str, int]:
+    """
+    Function to get the version of the knowledge base and of each entity. Missing rows are version 0.
+    """
+    versoes = dict.fromkeys((BASE,) + ENTIDADES, 0)
+    versoes.update(session.execute(select(VersaoBase.entidade, VersaoBase.versao)).tuples().all())
+    return versoes
+
+
+
+
+def get_entidade(obj) -> str:
+    """
+    Function to get the versioned entity of an object of the models, or None.
+    """
+    for classe, entidade in ENTIDADE_POR_CLASSE:
+        if isinstance(obj, classe):
+            return entidade
+    return None
+
+
+
+
+@event.listens_for(Session, "before_flush")
+def registra_entidades_novas(session: Session, flush_context, instances) -> None:
+    """
+    Function to record the entities of the new objects of every flush, including the ones added by cascade (e.g. the new manifestation of a new symptom),
+    since session.new is empty after the flush.
+    """
+    session.info.setdefault(ENTIDADES_NOVAS, set()).update(get_entidade(obj) for obj in session.new)
+
+
+
+
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_rollback")
+def limpa_entidades_novas(session: Session) -> None:
+    """
+    Function to forget the entities of the new objects when the transaction ends.
+    """
+    session.info.pop(ENTIDADES_NOVAS, None)
+
+
+
+
+def get_entidades_novas(session: Session) -> list[str]:
+    """
+    Function to get the entities of the objects inserted in the current transaction of the session, flushed or not, to be passed to incrementa_versao.
+    """
+    entidades = set(session.info.get(ENTIDADES_NOVAS, ())) | {get_entidade(obj) for obj in session.new}
+    entidades.discard(None)
+    return sorted(entidades)
+
+
+
+
+def incrementa_versao(session: Session, *entidades: str) -> int:
+    """
+    Function to increment the version of the knowledge base and set it as the version of the changed entities, in the transaction of the session.
+    It must be called in the same transaction of the write, before the commit, so the new version is only visible with the new data.
+    The increment is done by the database (versao = versao + 1), so concurrent writers always get different versions.
+    It returns the new version of the knowledge base.
+    """
+    for entidade in entidades:
+        if entidade not in ENTIDADES:
+            raise ValueError(f"Unknown entity: {entidade}")
+
+    session.execute(update(VersaoBase).where(VersaoBase.entidade == BASE).values(versao=VersaoBase.versao + 1))
+    versao = session.scalar(select(VersaoBase.versao).where(VersaoBase.entidade == BASE))
+    session.execute(update(VersaoBase).where(VersaoBase.entidade.in_(entidades)).values(versao=versao))
+    return versao
@@ -0,0 +1,64 @@
+import itertools
+import os
+import random
+import sys
+import pytest
+
+
+# Os módulos do projeto são importados a partir da pasta src, como na execução do app
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+from models import Manifestacao, Sintoma, Exame, Resultado, And, Or, AoMenos, Doenca, Diagnostico
+from compiler import PlanoAvaliacao, compile_diagnosticos
+
+
+
+
+@pytest.fixture
+def build_plano_aleatorio():
+    """
+    Fixture with a function to compile a random plan of transient diagnoses (with fixed ids, so no database is needed) and return it with the ids of its facts.
+    Some diagnoses share the same expression, so they tie, and some have an empty AoMenos, so they have no score.
+    """
+    def build(seed: int, quantidade_fatos: int = 8, quantidade_diagnosticos: int = 25) -> tuple[PlanoAvaliacao, list[int]]:
+        rng = random.Random(seed)
+        ids = itertools.count(1)
+        exame = Exame(name="E", preco="1")
+        fatos = []
+        for i in range(quantidade_fatos):
+            fato = Sintoma(Manifestacao(name=f"M{i}")) if i % 2 else Resultado(name=f"R{i}", exame=exame)
+            fato.id = next(ids)
+            fatos.append(fato)
+
+        def build_expressao(profundidade: int):
+            if profundidade == 0 or rng.random() < 0.25:
+                return rng.choice(fatos)
+            filhos = [build_expressao(profundidade - 1) for _ in range(rng.randint(1, 4))]
+            tipo = rng.random()
+            if tipo < 0.35:
+                expressao = And(filhos)
+            elif tipo < 0.7:
+                expressao = Or(filhos)
+            else:
+                expressao = AoMenos(rng.randint(1, len(filhos)), filhos)
+            expressao.id = next(ids)
+            return expressao
+
+        expressoes = [build_expressao(3) for _ in range(quantidade_diagnosticos - 2)]
+        for _ in range(quantidade_diagnosticos // 5):
+            expressoes[rng.randrange(len(expressoes))] = rng.choice(expressoes)
+        vazia = AoMenos(1, [])
+        vazia.id = next(ids)
+        expressoes.insert(rng.randrange(len(expressoes) + 1), vazia)
+        expressoes.insert(rng.randrange(len(expressoes) + 1), rng.choice(expressoes))
+
+        diagnosticos = []
+        for i, expressao in enumerate(expressoes):
+            doenca = Doenca(name=f"D{i}")
+            doenca.id = i + 1
+            diagnostico = Diagnostico(doenca=doenca, expressao=expressao)
+            diagnostico.id = i + 1
+            diagnostico.doenca_id = doenca.id
+            diagnosticos.append(diagnostico)
+        return compile_diagnosticos(diagnosticos), [fato.id for fato in fatos]
+
+    return build
@@ -0,0 +1,76 @@
+import itertools
+import pytest
+from models import FatosSintomaResultado, Manifestacao, Sintoma, And, Or, AoMenos, Doenca, Diagnostico
+from compiler import compile_diagnosticos
+
+
+
+
+def build_sintomas(quantidade: int) -> list[Sintoma]:
+    """
+    Function to build transient symptoms with fixed ids, so they can be compiled without a database.
+    """
+    sintomas = []
+    for i in range(quantidade):
+        sintoma = Sintoma(Manifestacao(name=f"M{i}"))
+        sintoma.id = i + 1
+        sintomas.append(sintoma)
+    return sintomas
+
+
+
+
+def build_diagnosticos(sintomas: list[Sintoma]) -> list[Diagnostico]:
+    """
+    Function to build diagnoses whose expressions have structurally identical siblings (different rows with the same children),
+    repeated among the children of And, Or and AoMenos.
+    """
+    s1, s2, s3 = sintomas
+    ids = itertools.count(100)
+
+    def com_id(expr):
+        expr.id = next(ids)
+        return expr
+
+    expressoes = [
+        com_id(And([com_id(Or([s1, s2])), com_id(Or([s1, s2])), s2])),
+        com_id(And([com_id(Or([s1, s2])), s2])),
+        com_id(Or([com_id(And([s1, s3])), com_id(And([s1, s3])), s2])),
+        com_id(Or([com_id(And([s1, s3])), s2])),
+        com_id(AoMenos(2, [com_id(And([s2, s3])), com_id(And([s2, s3])), s1])),
+        com_id(AoMenos(2, [com_id(And([s2, s3])), s1])),
+        com_id(And([s1, com_id(AoMenos(1, [s2, s3])), com_id(AoMenos(1, [s2, s3])), com_id(Or([s3, s1]))])),
+    ]
+
+    diagnosticos = []
+    for i, expressao in enumerate(expressoes):
+        doenca = Doenca(name=f"D{i}")
+        doenca.id = i + 1
+        diagnostico = Diagnostico(doenca=doenca, expressao=expressao)
+        diagnostico.id = i + 1
+        diagnostico.doenca_id = doenca.id
+        diagnosticos.append(diagnostico)
+    return diagnosticos
+
+
+
+
+@pytest.mark.parametrize("valores", list(itertools.product((True, False, None), repeat=3)))
+def test_plano_avalia_igual_ao_interpretador(valores):
+    """
+    The compiled plan must give the same result and score of Expressao.avalia for every diagnosis, including the ones with repeated siblings.
+    """
+    sintomas = build_sintomas(3)
+    diagnosticos = build_diagnosticos(sintomas)
+    plano = compile_diagnosticos(diagnosticos)
+
+    presentes = [sintoma for sintoma, valor in zip(sintomas, valores) if valor is True]
+    ausentes = [sintoma for sintoma, valor in zip(sintomas, valores) if valor is False]
+    fatos = FatosSintomaResultado(sintomas, presentes, ausentes, [], [], [], indice=plano.indice_fatos)
+
+    avaliacoes = plano.avalia(fatos)
+    for diagnostico in diagnosticos:
+        resultado, arvore = diagnostico.expressao.avalia(fatos)
+        plano_resultado, plano_score = avaliacoes[diagnostico.id]
+        assert plano_resultado.value == resultado.value, diagnostico.doenca.name
+        assert plano_score == pytest.approx(arvore.score), diagnostico.doenca.name
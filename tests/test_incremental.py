@@ -0,0 +1,66 @@
+import random
+import pytest
+from tribool import Tribool
+from models import FatosSintomaResultado
+from incremental import AvaliacaoIncremental
+
+
+
+
+def avalia_tudo(plano, valores_fatos: dict[int, bool]) -> list[tuple[int, float]]:
+    """
+    Function to evaluate every node of the plan from scratch with the known facts.
+    """
+    presentes = [fato_id for fato_id, valor in valores_fatos.items() if valor is True]
+    ausentes = [fato_id for fato_id, valor in valores_fatos.items() if valor is False]
+    return plano.avalia_nos(FatosSintomaResultado.from_ids(presentes, ausentes, plano.indice_fatos))
+
+
+
+
+@pytest.mark.parametrize("seed", range(8))
+def test_altera_fato_igual_a_avaliar_tudo(build_plano_aleatorio, seed):
+    """
+    After any sequence of changes of the facts (including present -> absent -> unknown), the cached values must be the ones of a fresh
+    evaluation of the plan, and the changed diagnoses must be the ones whose root changed.
+    """
+    plano, fatos_ids = build_plano_aleatorio(seed)
+    avaliacao = AvaliacaoIncremental(plano)
+    rng = random.Random(seed)
+    valores_fatos = {}
+    assert avaliacao.valores == avalia_tudo(plano, valores_fatos)
+
+    for _ in range(200):
+        fato_id = rng.choice(fatos_ids)
+        valor = rng.choice((True, False, None))
+        antes = list(avaliacao.valores)
+        alterados = avaliacao.altera_fato(fato_id, Tribool(valor))
+        if valor is None:
+            valores_fatos.pop(fato_id, None)
+        else:
+            valores_fatos[fato_id] = valor
+
+        assert avaliacao.valores == avalia_tudo(plano, valores_fatos), valores_fatos
+        assert alterados == {diagnostico_id for diagnostico_id, raiz in plano.raizes.items() if avaliacao.valores[raiz] != antes[raiz]}
+
+
+@pytest.mark.parametrize("seed", range(8))
+def test_sincroniza_igual_a_avaliar_tudo(build_plano_aleatorio, seed):
+    """
+    Bringing the facts to any present and absent sets, from any previous ones, must give the values of a fresh evaluation,
+    and must not change the copies of the evaluation.
+    """
+    plano, fatos_ids = build_plano_aleatorio(seed)
+    avaliacao = AvaliacaoIncremental(plano)
+    copia = avaliacao.copia()
+    rng = random.Random(seed)
+
+    for _ in range(50):
+        presentes = set(rng.sample(fatos_ids, rng.randint(0, 4)))
+        ausentes = set(rng.sample(fatos_ids, rng.randint(0, 4)))
+        avaliacao.sincroniza(presentes, ausentes)
+        valores_fatos = {**dict.fromkeys(ausentes, False), **dict.fromkeys(presentes, True)}
+        assert avaliacao.valores == avalia_tudo(plano, valores_fatos), (presentes, ausentes)
+
+    assert copia.fatos == {}
+    assert copia.valores == avalia_tudo(plano, {})
@@ -0,0 +1,41 @@
+import random
+import pytest
+from models import FatosSintomaResultado
+from ranking import RankingDiagnosticos
+from kleene import to_tribool
+
+
+
+
+def ordena_todos(plano, presentes, ausentes) -> list[tuple[int, object, float]]:
+    """
+    Function to rank all diagnoses with a full evaluation of the plan: the highest scores first, the ones without score last,
+    and the ties in the order of plano.diagnostico_ids().
+    """
+    valores = plano.avalia_nos(FatosSintomaResultado.from_ids(presentes, ausentes, plano.indice_fatos))
+    ordem = sorted(
+        enumerate(plano.diagnostico_ids()),
+        key=lambda item: (-valores[plano.raizes[item[1]]][1] if valores[plano.raizes[item[1]]][1] is not None else float("inf"), item[0]),
+    )
+    return [(diagnostico_id, valores[plano.raizes[diagnostico_id]][0], valores[plano.raizes[diagnostico_id]][1]) for _, diagnostico_id in ordem]
+
+
+
+
+@pytest.mark.parametrize("seed", range(8))
+@pytest.mark.parametrize("k", [1, 3, 10, 25, 40])
+def test_top_k_igual_a_ordenar_todos(build_plano_aleatorio, seed, k):
+    """
+    The top k of the ranking must be the first k diagnoses of a full evaluation sorted by score, including the ties,
+    the diagnoses without score and k greater than or equal to the number of diagnoses.
+    """
+    plano, fatos_ids = build_plano_aleatorio(seed)
+    ranking = RankingDiagnosticos(plano)
+    rng = random.Random(seed)
+
+    for _ in range(40):
+        presentes = rng.sample(fatos_ids, rng.randint(0, 3))
+        ausentes = rng.sample(fatos_ids, rng.randint(0, 3))
+        esperado = [(diagnostico_id, to_tribool(codigo).value, score) for diagnostico_id, codigo, score in ordena_todos(plano, presentes, ausentes)[:k]]
+        top = [(diagnostico_id, resultado.value, score) for diagnostico_id, resultado, score in ranking.top_k(presentes, ausentes, k)]
+        assert top == esperado, (presentes, ausentes)